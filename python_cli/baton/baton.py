@@ -1,15 +1,14 @@
-from genericpath import exists
-import click, shutil, os, subprocess, sys, re
-import baton.git_hooks as git_hooks
-from baton.solution import combine_solutions, SolutionFileError
+import click, shutil, os, subprocess, sys, re, threading
 from baton.logger import log, log_error, log_success, log_warning, log_info, log_reset
-import baton.plugin_template
+import baton.timing as timing
+
+# The modules needed by only some of the commands (git_hooks, solution, plugin_template, etc.)
+# are imported in those commands, so that every command only pays for what it uses.
+# See `baton -startup_profile` and benchmarks/cold_start.py.
 
 # Environment variable shenanigans only exist for windows
-import platform
-IS_WINDOWS = platform.system().lower().startswith('win')
+IS_WINDOWS = sys.platform.startswith('win')
 if IS_WINDOWS:
-    from baton.registry_hijacking import set_env, get_env
     def quote(path : str) -> str:
         return '"' + path + '"'
 # Assume Linux
@@ -28,6 +27,12 @@ UNITY_ASSETS_DIRECTORY = None    # /Game/Assets
 KARI_PROJECT_PATH = None         # /Kari
 KARI_SOURCE_PATH = None          # /Kari/source
 KARI_PLUGINS_PATH = None         # /Kari/source/Kari.Plugins
+TELEMETRY_PATH = None            # Build/baton_telemetry.sqlite
+
+# The commands whose runs are kept by telemetry.py, see `baton stats`
+TELEMETRY_COMMANDS = {"setup", "master_sln", "kari build", "kari run", "kari unity"}
+TELEMETRY_COMMAND = None         # the one being run, if it is one of them
+COMMAND_FAILED = False           # whether the command has returned False
 
 def set_global_and_env(name, value):
     globals()[name] = value
@@ -36,14 +41,35 @@ def set_global_and_env(name, value):
 def set_global(name, value):
     globals()[name] = value
 
+def print_startup_profile(context, parameter, value):
+    if not value or context.resilient_parsing:
+        return
+    from baton.startup_profile import print_startup_profile
+    print_startup_profile()
+    context.exit()
+
 @click.group()
+@click.option("-startup_profile", is_flag=True, expose_value=False, is_eager=True, callback=print_startup_profile,
+    help="Reports the import time of baton and of the modules used by the commands, and exits")
 @click.option("-build_directory", envvar="BUILD_DIRECTORY", default=os.path.abspath("Build"))
 @click.option("-project_directory", envvar="PROJECT_DIRECTORY", default=os.path.abspath("."))
+@click.option("-timings", is_flag=True, help="Whether to print the time taken by each phase and process at the end")
+@click.option("-trace_file", type=str, default=None, help="The file to write the phases and processes to, in the Chrome trace event format")
 # @click.option("-update", isFlag=True, help="Whether to update itself before running the command")
-def cli(build_directory, project_directory):
+def cli(build_directory, project_directory, timings, trace_file):
     """Prepares environment and global variables"""
+    context = click.get_current_context()
+    if timings or trace_file:
+        context.call_on_close(lambda: report_timings(timings, trace_file))
+    if context.invoked_subcommand in TELEMETRY_COMMANDS:
+        set_global("TELEMETRY_COMMAND", context.invoked_subcommand)
+    context.call_on_close(record_telemetry)
+    # Exited before the report, see Context.close
+    context.with_resource(timing.phase(f"baton {context.invoked_subcommand}"))
+
     set_global_and_env("MSBUILD_INTERMEDIATE_OUTPUT_PATH", os.path.join(build_directory, "obj"))
     set_global_and_env("MSBUILD_OUTPUT_PATH", os.path.join(build_directory, "bin"))
+    set_global("TELEMETRY_PATH", os.path.join(build_directory, "baton_telemetry.sqlite"))
     set_global("PROJECT_DIRECTORY", project_directory)
     set_global("GIT_SOURCE_HOOKS_PATH", os.path.join(project_directory, "git_hooks"))
     set_global("DOT_GIT_HOOKS_PATH", os.path.join(project_directory, ".git", "hooks"))
@@ -51,15 +77,60 @@ def cli(build_directory, project_directory):
     set_global("UNITY_ASSETS_DIRECTORY", os.path.join(UNITY_PROJECT_DIRECTORY, "Assets"))
     
 
+@cli.result_callback()
+def on_command_result(result, **kwargs):
+    if result is False:
+        set_global("COMMAND_FAILED", True)
+    return result
+
+
+def record_telemetry():
+    """Appends the timings of the command to the history, if it is one of those kept"""
+    if TELEMETRY_COMMAND is None:
+        return
+    import sqlite3
+    from baton.telemetry import record_run
+
+    # The phase of the whole command is the first one, and it has ended by now
+    records = timing.timeline.records
+    status = records[0].status if records else "ok"
+    if status == "ok" and COMMAND_FAILED:
+        status = "failed"
+    try:
+        record_run(TELEMETRY_PATH, TELEMETRY_COMMAND, timing.timeline, status, PROJECT_DIRECTORY)
+    except (OSError, sqlite3.Error) as exception:
+        log_warning(f"Could not record the timings in {TELEMETRY_PATH}: {exception}")
+        log_reset()
+
+
+def report_timings(print_summary : bool, trace_file : str):
+    if print_summary:
+        log_info("Timings:")
+        log_reset()
+        timing.timeline.print_summary()
+    if trace_file:
+        timing.timeline.write_chrome_trace(trace_file)
+        log_info(f"Wrote the trace to {trace_file}")
+        log_reset()
+
+
 @cli.command("setup")
 @click.option("-skip_unity_editor_envvar", is_flag=True, default=False)
 def setup(skip_unity_editor_envvar):
     """Does the setup and the initial build"""
+    import baton.git_hooks as git_hooks
+
     kari.callback()
-    copy_github_hooks.callback()
-    git_hooks.update_submodules(PROJECT_DIRECTORY)    # Initialize the submodules
-    build_kari.callback(clean=False, retry=True, debug=False)
-    generate_code_for_unity.callback()
+    with timing.phase("copy hooks"):
+        copy_github_hooks.callback()
+    with timing.phase("update submodules"):
+        git_hooks.update_submodules(PROJECT_DIRECTORY)    # Initialize the submodules
+    with timing.phase("build kari"):
+        build_kari.callback(clean=False, retry=True, debug=False)
+    with timing.phase("generate code for unity"):
+        generate_code_for_unity.callback()
+    with timing.phase("master sln"):
+        master_sln.callback(output_path=None, inputs=["Game/Game.sln", "Kari/Kari.sln"])
 
     if not skip_unity_editor_envvar:
         set_unity_editor_envvar.callback(info=True)
@@ -89,6 +160,8 @@ def set_unity_editor_envvar(info):
         log_warning("This feature is unavailable for non-windows machines")
         return
 
+    from baton.registry_hijacking import set_env, get_env
+
     current_path = get_env("UNITY_EDITOR")
     if current_path == "":
         log("Currently, the variable UNITY_EDITOR has no value.")
@@ -120,13 +193,28 @@ def set_unity_editor_envvar(info):
 
 @cli.command("master_sln")
 @click.option("-output_path", type=str, default=None)
-def master_sln(output_path):
-    """Generates the master sln by combining Game.sln and Kari.sln"""
-    prev_dir = os.curdir
+@click.option("-input", "inputs", type=str, multiple=True, default=["Game/Game.sln", "Kari/Kari.sln"],
+    help="A solution to include, relative to the project directory. Can be a glob, e.g. `Modules/*/*.sln`. Can be repeated")
+def master_sln(output_path, inputs):
+    """
+    Generates the master sln by combining Game.sln and Kari.sln, or the given solutions.
+    Does nothing if neither they nor the master sln have changed since the last time, so it is cheap to call every time.
+    """
+    from baton.solution import update_combined_solution, expand_solution_patterns, SolutionFileError
+    from baton.git_hooks import get_baton_git_directory
+
+    output_path = output_path or "Master.sln"
+    stamp_path = os.path.join(get_baton_git_directory(PROJECT_DIRECTORY), "master_sln_stamp.json")
+
+    prev_dir = os.path.abspath(os.curdir)
     os.chdir(PROJECT_DIRECTORY)
 
     try:
-        combine_solutions(["Game/Game.sln", "Kari/Kari.sln"], output_path or "Master.sln")
+        input_paths = expand_solution_patterns(inputs)
+        if len(input_paths) == 0:
+            log_error(f"No solution matches {', '.join(inputs)}")
+            return False
+        is_written = update_combined_solution(input_paths, output_path, stamp_path)
     except SolutionFileError as exception:
         log_error(f'Failed to read one of the solution files: {exception}')
         return False
@@ -135,7 +223,13 @@ def master_sln(output_path):
         return False
     finally:
         os.chdir(prev_dir)
-    
+
+    timing.cache("master sln", not is_written)
+    if is_written:
+        log_success(f"Generated {output_path}")
+    else:
+        log_info(f"{output_path} is up to date")
+    log_reset()
     return True
 
 
@@ -151,9 +245,214 @@ def copy_github_hooks():
 @cli.command("git_precommit")
 def github_pre_commit():
     """Script called by git before commiting, used to validate the commit"""
+    import baton.git_hooks as git_hooks
+
     exit_code = git_hooks.precommit(PROJECT_DIRECTORY)
     sys.exit(exit_code)
 
+@cli.group("daemon")
+def daemon():
+    """
+    Manages the optional background process that runs the git hooks.
+    It saves the startup cost of baton on every commit. The hooks work without it.
+    """
+    pass
+
+@daemon.command("start")
+@click.option("-foreground", is_flag=True, help="Whether to run the daemon in this process instead of in the background")
+def start_daemon(foreground):
+    """Starts the daemon for the current project"""
+    import baton.daemon
+
+    if baton.daemon.is_running(PROJECT_DIRECTORY):
+        log_info("The daemon is already running")
+        return True
+
+    if foreground:
+        baton.daemon.serve(PROJECT_DIRECTORY)
+        return True
+
+    if not baton.daemon.start_detached(PROJECT_DIRECTORY):
+        log_error("The daemon has not started, see .git/baton/daemon.log")
+        return False
+
+    log_success("The daemon has started")
+    return True
+
+@daemon.command("stop")
+def stop_daemon():
+    """Stops the daemon for the current project"""
+    import baton.daemon
+
+    if baton.daemon.stop(PROJECT_DIRECTORY):
+        log_success("The daemon has been stopped")
+    else:
+        log_info("The daemon is not running")
+
+@daemon.command("status")
+def daemon_status():
+    """Tells whether the daemon for the current project is running"""
+    import baton.daemon
+
+    if baton.daemon.is_running(PROJECT_DIRECTORY):
+        log_success("The daemon is running")
+    else:
+        log_info("The daemon is not running")
+
+
+@cli.group("meta")
+def meta():
+    """Has to do with the .meta files of the Unity project"""
+    pass
+
+@meta.command("audit")
+@click.option("-json", "as_json", is_flag=True, help="Whether to output the report as json")
+@click.option("-jobs", type=int, default=None, help="The number of threads scanning the folders. By default depends on the number of cores")
+def audit_metas(as_json, jobs):
+    """Checks the .meta files of the whole Assets folder, including the ones that predate the git hooks"""
+    import json
+    from baton.meta_audit import audit
+
+    report = audit(PROJECT_DIRECTORY, UNITY_ASSETS_DIRECTORY, jobs)
+
+    if as_json:
+        print(json.dumps(report.to_dict(), indent=2))
+    else:
+        for path in report.orphan_metas:
+            log_warning(f"Orphan meta: {path}")
+        for path in report.missing_metas:
+            log_warning(f"Missing meta for: {path}")
+        for path in report.metaless_folders:
+            log_warning(f"Missing meta for folder: {path}")
+
+        log_info(f"Scanned {report.directory_count} folders and {report.file_count} files")
+        if report.is_ok():
+            log_success("All .meta files are consistent")
+        else:
+            log_error(f"Found {len(report.orphan_metas)} orphan metas, {len(report.missing_metas)} missing metas "
+                + f"and {len(report.metaless_folders)} folders without a meta")
+        log_reset()
+
+    if not report.is_ok():
+        sys.exit(1)
+
+@cli.group("guid")
+def guid():
+    """Has to do with the GUIDs in the .meta files of the Unity project"""
+    pass
+
+@guid.command("lookup")
+@click.argument("query")
+def lookup_guid(query):
+    """Prints the paths of the .meta files with the given GUID, or the GUID of the given .meta file or asset"""
+    from baton.guid_index import load_updated_guid_index, is_guid
+
+    index = load_updated_guid_index(PROJECT_DIRECTORY, UNITY_ASSETS_DIRECTORY)
+
+    if is_guid(query):
+        paths = index.get_paths(query)
+        if len(paths) == 0:
+            log_warning(f"No .meta file has the guid {query}")
+            return False
+        for path in sorted(paths):
+            print(path)
+        return True
+
+    path = os.path.relpath(os.path.abspath(query), PROJECT_DIRECTORY).replace(os.sep, '/')
+    if not path.endswith('.meta'):
+        path += '.meta'
+    guid = index.get_guid(path)
+    if guid is None:
+        log_warning(f"{path} is not in the index")
+        return False
+    print(guid)
+    return True
+
+@guid.command("dupes")
+def guid_duplicates():
+    """Lists the GUIDs shared by multiple .meta files"""
+    from baton.guid_index import load_updated_guid_index
+
+    index = load_updated_guid_index(PROJECT_DIRECTORY, UNITY_ASSETS_DIRECTORY)
+    duplicates = index.get_duplicates()
+
+    for guid, paths in duplicates.items():
+        log_warning(f"{guid}:")
+        for path in paths:
+            print("    " + path)
+
+    if len(duplicates) > 0:
+        log_error(f"Found {len(duplicates)} duplicate guids")
+        log_reset()
+        sys.exit(1)
+
+    log_success("All guids are unique")
+    log_reset()
+
+@cli.command("stats")
+@click.option("-command", "command_name", type=str, default=None, help="Only the runs of this command, e.g. `kari build`. By default those of every command")
+@click.option("-last", type=int, default=15, help="The number of most recent runs to list and to find the slowest steps in")
+@click.option("-window", type=int, default=10, help="The number of runs before a run whose median it is compared against")
+@click.option("-threshold", type=float, default=0.25, help="How much slower than that median a run has to be to be flagged, 0.25 being 25%")
+@click.option("-steps", type=int, default=10, help="The number of slowest steps to show")
+def stats(command_name, last, window, threshold, steps):
+    """Reports on the timings of the past runs of the build and code generation commands, flagging the regressions"""
+    import time
+    import baton.telemetry as telemetry
+
+    if not os.path.exists(TELEMETRY_PATH):
+        log_warning(f"No runs have been recorded in {TELEMETRY_PATH} yet")
+        log_reset()
+        return False
+
+    connection = telemetry.connect(TELEMETRY_PATH)
+    try:
+        commands = [command_name] if command_name else telemetry.get_commands(connection)
+        for command in commands:
+            runs = telemetry.get_runs(connection, command)
+            if len(runs) == 0:
+                log_warning(f"No runs of `{command}` have been recorded")
+                continue
+
+            failed_count = sum(1 for run in runs if run.status != "ok")
+            # The failed runs tend to stop early, so they are only counted if there is nothing else
+            successful = [run.wall_seconds for run in runs if run.status == "ok"] or [run.wall_seconds for run in runs]
+            log_info(f"{command}: {len(runs)} runs, {failed_count} failed, "
+                + f"p50 {telemetry.percentile(successful, 0.5):.1f}s, p90 {telemetry.percentile(successful, 0.9):.1f}s, "
+                + f"p95 {telemetry.percentile(successful, 0.95):.1f}s, max {max(successful):.1f}s")
+
+            medians = telemetry.get_rolling_medians(runs, window)
+            recent = runs[-last:]
+            log(f"{'started':<17} {'commit':<10} {'host':<16} {'status':<12} {'seconds':>8} {'median':>8} {'change':>7} {'cache':>9}")
+            for run, median in zip(recent, medians[-last:]):
+                median_text = f"{median:.2f}" if median is not None else ""
+                change = f"{(run.wall_seconds / median - 1) * 100:+.0f}%" if median else ""
+                line = (f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(run.started_at)):<17} {(run.commit_sha or '')[:10]:<10} "
+                    + f"{(run.host or '')[:16]:<16} {run.status[:12]:<12} {run.wall_seconds:8.2f} "
+                    + f"{median_text:>8} {change:>7} {run.cache_hits:>4}/{run.cache_misses:<4}")
+                if telemetry.is_regression(run, median, threshold):
+                    log_error(line + " regression")
+                elif run.status != "ok":
+                    log_warning(line)
+                else:
+                    print(line)
+
+            step_seconds = telemetry.get_step_seconds(connection, recent)
+            slowest = sorted(step_seconds.items(), key=lambda item: telemetry.percentile(item[1], 0.5), reverse=True)[:steps]
+            if slowest:
+                log(f"The slowest steps of the last {len(recent)} runs:")
+                print(f"{'median':>8} {'p90':>8} {'max':>8} {'runs':>5}  name")
+                for name, seconds in slowest:
+                    print(f"{telemetry.percentile(seconds, 0.5):8.2f} {telemetry.percentile(seconds, 0.9):8.2f} {max(seconds):8.2f} {len(seconds):>5}  {name}")
+
+            cache_counts = telemetry.get_cache_counts(connection, recent)
+            for name, (hits, misses) in cache_counts.items():
+                print(f"cache {name}: {hits} hits, {misses} misses, {hits * 100 // max(hits + misses, 1)}% hit rate")
+            log_reset()
+    finally:
+        connection.close()
+    return True
+
 # It may be too slow, this should check the version ideally 
 # TODO: does not work
 @cli.command("git_postcheckout")
@@ -162,16 +461,28 @@ def git_post_checkout():
     update_self.callback()
 
 KARI_PLUGIN_NAMES = None
+KARI_PLUGIN_REGISTRY = None
+# The commands that only read the plugin registry, the rest look for new plugins in the plugins folder
+KARI_REGISTRY_READING_COMMANDS = { "unity", "watch", "run", "plugins" }
 
 @cli.group("kari")
 def kari():
     """Has to do with code generation"""
+    context = click.get_current_context()
+    subcommand = context.invoked_subcommand if context.command is kari else None
+    if subcommand is not None and f"kari {subcommand}" in TELEMETRY_COMMANDS:
+        set_global("TELEMETRY_COMMAND", f"kari {subcommand}")
     set_global("KARI_PROJECT_PATH", os.path.join(PROJECT_DIRECTORY, "Kari"))
     set_global("KARI_SOURCE_PATH", os.path.join(KARI_PROJECT_PATH, "source"))
     set_global("KARI_PLUGINS_PATH", os.path.join(KARI_SOURCE_PATH, "Kari.Plugins"))
     set_global("KARI_GENERATOR_PATH", os.path.join(MSBUILD_OUTPUT_PATH, "Kari.Generator", "Release", "netcoreapp3.1", "publish", "kari.exe"))
-    set_global("KARI_PLUGIN_NAMES", [directory for directory in os.listdir(KARI_PLUGINS_PATH) 
-        if os.path.isdir(os.path.join(KARI_PLUGINS_PATH, directory))])
+
+    registry = get_kari_plugin_registry()
+    if not registry.exists or subcommand not in KARI_REGISTRY_READING_COMMANDS:
+        if registry.discover(KARI_PLUGINS_PATH) or not registry.exists:
+            registry.save()
+    set_global("KARI_PLUGIN_REGISTRY", registry)
+    set_global("KARI_PLUGIN_NAMES", registry.names)
 
 @kari.command("build")
 @click.option("-clean", is_flag=True, help="Whether to nuke all previous output before recompiling")
@@ -180,7 +491,16 @@ def kari():
 @click.option("-plugin", multiple=True, default=lambda: KARI_PLUGIN_NAMES, help="Which plugins to also build. By default all plugins are built.")
 @click.option("-no_plugins", is_flag=True, help="Whether  to not rebuild any plugins")
 @click.option("-no_generator", is_flag=True, help="Whether to not rebuild the generator")
-def build_kari(clean=False, retry=False, debug=False, plugin : 'list[str]' = None, no_plugins=False, no_generator=False):
+@click.option("-jobs", type=int, default=None,
+    help="Builds the projects in the order of their dependencies, this many at a time, with the output of each printed once it is done. "
+        + "By default the generator and the plugins are published one after the other")
+@click.option("-traversal", is_flag=True,
+    help="Publishes the generator and the plugins in a single MSBuild invocation, building the projects in parallel, "
+        + "-jobs at a time if given, on MSBuild nodes that are kept around for the next build")
+@click.option("-force", is_flag=True, help="Whether to build the projects even if their sources have not changed since the last build")
+@click.option("-force_restore", is_flag=True, help="Whether to restore the tools and the packages even if nothing they depend on has changed since the last restore")
+@click.option("-timeout", type=float, default=None, help="The seconds after which a dotnet command is stopped and considered failed")
+def build_kari(clean=False, retry=False, debug=False, plugin : 'list[str]' = None, no_plugins=False, no_generator=False, jobs=None, traversal=False, force=False, force_restore=False, timeout=None):
     """Builds the Kari code generator"""
 
     log_info(f"Available plugins: {KARI_PLUGIN_NAMES}")
@@ -207,21 +527,39 @@ def build_kari(clean=False, retry=False, debug=False, plugin : 'list[str]' = Non
     try:
         os.chdir(KARI_PROJECT_PATH)
 
-        run_sync("dotnet tool restore")
-        run_sync("dotnet restore")
+        with timing.phase("restore"):
+            restore_kari(force_restore)
 
         os.chdir(KARI_SOURCE_PATH)
 
         configuration = "Debug" if debug else "Release"
-        options = f" --configuration {configuration} --no-self-contained"
-
+        options = ["--configuration", configuration, "--no-self-contained"]
+        manifest = get_kari_build_manifest()
+
+        if traversal or jobs is not None:
+            projects = [] if no_generator else [os.path.join(KARI_SOURCE_PATH, "Kari.Generator", "Kari.Generator.csproj")]
+            projects += [os.path.join(KARI_PLUGINS_PATH, name, f"{name}.csproj") for name in plugin]
+            with timing.phase("publish"):
+                if traversal:
+                    ok = publish_kari_projects_at_once(projects, configuration, jobs, retry, manifest, force, timeout)
+                else:
+                    ok = build_kari_projects(projects, configuration, jobs, retry, manifest, force, timeout)
+                if not ok:
+                    return False
+            log_success(f"Path to Kari: {KARI_GENERATOR_PATH}")
+            log_success("To run it, do `baton kari run`, passing in the flags")
+            return True
+
+        # (name, project path, command)
         cmds = []
 
         if not no_generator:
-            cmds.append(f"dotnet publish Kari.Generator/Kari.Generator.csproj{options}")
+            cmds.append(("Kari.Generator", os.path.join(KARI_SOURCE_PATH, "Kari.Generator", "Kari.Generator.csproj"),
+                ["dotnet", "publish", "Kari.Generator/Kari.Generator.csproj"] + options))
 
         for name in plugin:
-            cmds.append(f"dotnet publish Kari.Plugins/{name}/{name}.csproj{options}")
+            cmds.append((name, os.path.join(KARI_PLUGINS_PATH, name, f"{name}.csproj"),
+                ["dotnet", "publish", f"Kari.Plugins/{name}/{name}.csproj"] + options))
 
         # dotnet fails the first time for some strange reason if the repository has just been cloned.
         # Probably has to do with the templates. The sources they generate are not included in the build
@@ -229,15 +567,29 @@ def build_kari(clean=False, retry=False, debug=False, plugin : 'list[str]' = Non
         if retry:
             def run_twice(cmd):
                 try:
-                    run_sync(cmd)
-                except subprocess.CalledProcessError as err:
-                    run_sync(cmd)
+                    run_sync(cmd, timeout=timeout)
+                except subprocess.CalledProcessError:
+                    run_sync(cmd, timeout=timeout)
             execute = run_twice
         else:
-            execute = run_sync
-
-        for cmd in cmds:
-            execute(cmd)
+            execute = lambda cmd: run_sync(cmd, timeout=timeout)
+
+        with timing.phase("publish"):
+            for name, project_path, cmd in cmds:
+                key = f"{configuration}/{name}"
+                output_path = get_kari_output_path(project_path, configuration)
+                if not force and manifest.is_up_to_date(key, project_path, output_path):
+                    log_info(f"{name} is up to date")
+                    record_kari_plugin_build(project_path, configuration, True, manifest)
+                    continue
+                inputs = manifest.get_inputs_hash(project_path)
+                try:
+                    execute(cmd)
+                except subprocess.CalledProcessError:
+                    record_kari_plugin_build(project_path, configuration, False, manifest)
+                    raise
+                manifest.record(key, inputs, output_path)
+                record_kari_plugin_build(project_path, configuration, True, manifest)
         
         log_success(f"Path to Kari: {KARI_GENERATOR_PATH}")
         log_success("To run it, do `baton kari run`, passing in the flags")
@@ -254,11 +606,198 @@ def build_kari(clean=False, retry=False, debug=False, plugin : 'list[str]' = Non
     
     return True
 
+def restore_kari(force=False):
+    """Restores the tools and the packages of Kari, unless the files they depend on are the same as the last time"""
+    from baton.build_cache import CommandStamp, get_tool_restore_files, get_package_restore_files
+
+    # Kept with the intermediate output, next to what the restore writes, so that deleting it means restoring again
+    stamp = CommandStamp(os.path.join(MSBUILD_INTERMEDIATE_OUTPUT_PATH, "kari_restore_stamp.json"), KARI_PROJECT_PATH, "restore")
+    for command, get_files in ((["dotnet", "tool", "restore"], get_tool_restore_files), (["dotnet", "restore"], get_package_restore_files)):
+        name = " ".join(command)
+        files = get_files(KARI_PROJECT_PATH)
+        if not force and stamp.is_up_to_date(name, files):
+            log_info(f"Skipping `{name}`, nothing has changed since the last one")
+            continue
+        run_sync(command)
+        # Looked for again, restoring may have written a lock file
+        stamp.record(name, get_files(KARI_PROJECT_PATH))
+
+def get_kari_build_manifest():
+    """The hashes of the sources the Kari projects were last built from, kept with the build output"""
+    from baton.build_cache import BuildManifest
+    return BuildManifest(os.path.join(MSBUILD_OUTPUT_PATH, "kari_build_manifest.json"), KARI_PROJECT_PATH)
+
+def get_kari_plugin_registry():
+    """The plugins and how their last builds went, kept with the build output"""
+    from baton.plugin_registry import PluginRegistry
+    return PluginRegistry(os.path.join(MSBUILD_OUTPUT_PATH, "kari_plugins.json"), PROJECT_DIRECTORY)
+
+def record_kari_plugin_build(project_path : str, configuration : str, ok : bool, manifest = None):
+    """Records how the build of the project went in the plugin registry, if it is a plugin"""
+    name = os.path.splitext(os.path.basename(project_path))[0]
+    if KARI_PLUGIN_REGISTRY is None or name not in KARI_PLUGIN_REGISTRY.plugins:
+        return
+    inputs = None
+    if manifest is not None:
+        inputs = manifest.projects.get(f"{configuration}/{name}", {}).get("inputs")
+    KARI_PLUGIN_REGISTRY.record_build(name, configuration, get_kari_output_path(project_path, configuration), inputs, ok)
+
+def get_kari_output_path(project_path : str, configuration : str) -> str:
+    """The file published for the generator or for a plugin, None for the other projects"""
+    name = os.path.splitext(os.path.basename(project_path))[0]
+    if name == "Kari.Generator":
+        return os.path.join(MSBUILD_OUTPUT_PATH, "Kari.Generator", configuration, "netcoreapp3.1", "publish", "kari.exe")
+    if os.path.normcase(os.path.dirname(os.path.dirname(os.path.abspath(project_path)))) == os.path.normcase(os.path.abspath(KARI_PLUGINS_PATH)):
+        return os.path.join(MSBUILD_OUTPUT_PATH, name, configuration, "netcoreapp3.1", f"Kari.Plugins.{name}.dll")
+    return None
+
+def publish_kari_projects_at_once(projects : 'list[str]', configuration : str, jobs : int, retry : bool,
+        manifest = None, force=False, timeout : float = None) -> bool:
+    """
+    Publishes the projects with a single `dotnet msbuild` of a traversal project generated in the intermediate output,
+    which saves starting dotnet and evaluating the shared props for every project.
+    The projects the manifest says are up to date are left out.
+    """
+    import time
+    from baton.build_graph import write_traversal_project
+
+    def is_up_to_date(project_path):
+        name = os.path.splitext(os.path.basename(project_path))[0]
+        return manifest.is_up_to_date(f"{configuration}/{name}", project_path, get_kari_output_path(project_path, configuration))
+
+    if manifest is not None and not force:
+        up_to_date = [project for project in projects if is_up_to_date(project)]
+        for project in up_to_date:
+            log_info(f"{os.path.splitext(os.path.basename(project))[0]} is up to date")
+            record_kari_plugin_build(project, configuration, True, manifest)
+        projects = [project for project in projects if project not in up_to_date]
+    if not projects:
+        return True
+
+    # Hashed before the build, see BuildManifest.get_inputs_hash
+    inputs = { project: manifest.get_inputs_hash(project) for project in projects } if manifest is not None else {}
+
+    traversal_path = os.path.join(MSBUILD_INTERMEDIATE_OUTPUT_PATH, "kari_publish.proj")
+    # The traversal project calls the Publish target of every project itself,
+    # and the global properties, which the referenced projects get too, are those of `dotnet publish --no-self-contained`
+    write_traversal_project(traversal_path, projects, target="Publish")
+    command = ["dotnet", "msbuild", traversal_path, "-m" if jobs is None else f"-m:{jobs}", "-nodeReuse:true", "-nologo",
+        f"-p:Configuration={configuration}", "-p:SelfContained=false"]
+
+    start_time = time.time()
+    try:
+        try:
+            run_sync(command, timeout=timeout)
+        except subprocess.CalledProcessError:
+            if not retry:
+                raise
+            run_sync(command, timeout=timeout)
+    except subprocess.CalledProcessError as err:
+        log_error(f"Build process exited with error code {err.returncode}")
+        # Which of the projects have failed is only known from whether their output has been written
+        for project in projects:
+            output_path = get_kari_output_path(project, configuration)
+            is_written = output_path is not None and os.path.isfile(output_path) and os.path.getmtime(output_path) >= start_time
+            record_kari_plugin_build(project, configuration, is_written, manifest)
+        return False
+
+    for project in projects:
+        if manifest is not None:
+            name = os.path.splitext(os.path.basename(project))[0]
+            manifest.record(f"{configuration}/{name}", inputs[project], get_kari_output_path(project, configuration))
+        record_kari_plugin_build(project, configuration, True, manifest)
+    return True
+
+def build_kari_projects(projects : 'list[str]', configuration : str, jobs : int, retry : bool, manifest = None, force=False, timeout : float = None) -> bool:
+    """
+    Publishes the projects, after building the projects they depend on, running the independent ones concurrently.
+    Every project is only built once, so that concurrent builds never write the same output:
+    the dependencies are built with --no-dependencies and the projects are published with BuildProjectReferences=false.
+    The projects the manifest says are up to date are not built at all.
+    """
+    from baton.build_graph import load_build_graph, run_build_graph, BuildGraphError
+    import baton.process as process
+
+    try:
+        graph = load_build_graph(os.path.join(KARI_PROJECT_PATH, "Kari.sln"), projects).subgraph(projects)
+        graph.topological_order()
+    except BuildGraphError as exception:
+        log_error(f"Cannot order the build: {exception}")
+        return False
+
+    published = { graph.get(project).key for project in projects }
+    retried = set()
+    up_to_date = set()
+
+    def build(node):
+        key = f"{configuration}/{node.name}"
+        output_path = get_kari_output_path(node.project_path, configuration)
+        if manifest is not None and not force and manifest.is_up_to_date(key, node.project_path, output_path):
+            up_to_date.add(node.key)
+            record_kari_plugin_build(node.project_path, configuration, True, manifest)
+            return
+
+        if node.key in published:
+            command = ["dotnet", "publish", node.project_path, "--configuration", configuration,
+                "--no-self-contained", "--no-restore", "-p:BuildProjectReferences=false"]
+        else:
+            command = ["dotnet", "build", node.project_path, "--configuration", configuration, "--no-restore", "--no-dependencies"]
+
+        inputs = manifest.get_inputs_hash(node.project_path) if manifest is not None else None
+
+        # The output of concurrent jobs is printed once they are done, prefixed with the project, so that it does not interleave
+        if jobs > 1:
+            execute = lambda command: run_command_buffered(command, f"[{node.name}] ", timeout=timeout)
+        else:
+            execute = lambda command: run_sync(command, timeout=timeout)
+
+        try:
+            try:
+                execute(command)
+            except subprocess.CalledProcessError:
+                if not retry:
+                    raise
+                retried.add(node.key)
+                execute(command)
+        except subprocess.CalledProcessError:
+            record_kari_plugin_build(node.project_path, configuration, False, manifest)
+            raise
+
+        if manifest is not None:
+            manifest.record(key, inputs, output_path)
+        record_kari_plugin_build(node.project_path, configuration, True, manifest)
+
+    report = run_build_graph(graph, build, jobs, cancel=process.cancel_all)
+
+    log_info("Build summary:")
+    for node in graph.topological_order():
+        result = report.results[node.key]
+        line = f"{node.name:<40} {result.status:<8} {result.seconds:8.1f}s" + (" (retried)" if node.key in retried else "") \
+            + (" (up to date)" if node.key in up_to_date else "")
+        if result.status == "ok":
+            log_success(line)
+        elif result.status == "failed":
+            log_error(line)
+        else:
+            log_warning(line)
+
+    critical_path, critical_seconds = report.critical_path()
+    log_info(f"Built {len(report.results)} projects in {report.wall_seconds:.1f}s with {jobs} jobs, "
+        + f"the critical path took {critical_seconds:.1f}s: {' -> '.join(node.name for node in critical_path)}")
+    failed = report.get_failed()
+    if failed:
+        log_error(f"Failed: {', '.join(result.node.name for result in failed)}")
+    log_reset()
+
+    return report.is_ok()
+
+
 @kari.command("new_plugin")
 @click.option("-name", required=True, help="The name of the plugin to be added")
 @click.option("-override", is_flag=True, help="Whether to replace the existing plugin folder and all files if the given plugin exists.")
 def new_plugin(name : str, override=False):
     """Creates a new plugin, adds it to Kari solution"""
+    import baton.plugin_template
 
     # Make sure the first letter is capitalized and it is a valid identifier name
     ident_pattern = re.compile('^[A-Z][A-Za-z0-9_]*')
@@ -269,9 +808,10 @@ def new_plugin(name : str, override=False):
     
     if not baton.plugin_template.write(KARI_PLUGINS_PATH, name, override):
         return False
+    KARI_PLUGIN_REGISTRY.register(name, os.path.join(KARI_PLUGINS_PATH, name, f"{name}.csproj"))
 
     try:
-        run_sync(f"dotnet sln add Kari.Plugins/{name}/{name}.csproj")
+        run_sync(["dotnet", "sln", "add", f"Kari.Plugins/{name}/{name}.csproj"])
         if not build_kari.callback(retry=True, plugin=[name], no_generator=True):
             return False
     
@@ -282,6 +822,39 @@ def new_plugin(name : str, override=False):
     return True
     
 
+@kari.command("plugins")
+@click.option("-refresh", is_flag=True, help="Whether to look for the plugins added or removed since the last build")
+def list_kari_plugins(refresh=False):
+    """Lists the plugins, with how their last builds went"""
+    import datetime
+
+    if refresh and KARI_PLUGIN_REGISTRY.discover(KARI_PLUGINS_PATH):
+        KARI_PLUGIN_REGISTRY.save()
+        set_global("KARI_PLUGIN_NAMES", KARI_PLUGIN_REGISTRY.names)
+
+    manifest = get_kari_build_manifest()
+    for name in KARI_PLUGIN_NAMES:
+        project_path = KARI_PLUGIN_REGISTRY.get_project_path(name)
+        log(f"{name}: {os.path.relpath(project_path, PROJECT_DIRECTORY)}")
+        builds = KARI_PLUGIN_REGISTRY.plugins[name]["builds"]
+        if not builds:
+            log_warning("    not built")
+        for configuration in sorted(builds):
+            build = KARI_PLUGIN_REGISTRY.get_build(name, configuration)
+            built_at = datetime.datetime.fromtimestamp(build["built_at"]).strftime("%Y-%m-%d %H:%M")
+            line = f"    {configuration:<8} {build['status']:<7} {built_at}  {os.path.relpath(build['output'], PROJECT_DIRECTORY)}"
+            if build["status"] != "ok":
+                log_error(line)
+            elif not os.path.isfile(build["output"]):
+                log_warning(line + " (missing)")
+            elif build["inputs"] is not None and build["inputs"] != manifest.get_inputs_hash(project_path):
+                log_warning(line + " (changed since)")
+            else:
+                log_success(line)
+    log_reset()
+    return True
+
+
 @kari.command(name="run", context_settings={"ignore_unknown_options": True})
 @click.option("-rebuild", is_flag=True, help="Whether to recompile Kari before generating code.")
 @click.argument("unprocessed_args", nargs=-1, type=click.UNPROCESSED)
@@ -303,9 +876,9 @@ def generate_with_kari(rebuild, unprocessed_args):
     
     try:
         # Pass along all of the unparsed arguments
-        command = [quote(KARI_GENERATOR_PATH)]
+        command = [KARI_GENERATOR_PATH]
         command.extend(unprocessed_args)
-        run_sync(" ".join(command))
+        run_sync(command)
 
     except subprocess.CalledProcessError as err:
         log_error(f"Generation failed with error code {err.returncode}")
@@ -315,25 +888,205 @@ def generate_with_kari(rebuild, unprocessed_args):
 
 
 @kari.command("unity")
-def generate_code_for_unity():
-    """Generates code for the unity project """
-
-    plugin_path = MSBUILD_OUTPUT_PATH + "/{0}/Release/netcoreapp3.1/Kari.Plugins.{0}.dll"
-    plugins = ",".join([plugin_path.format(p) for p in KARI_PLUGIN_NAMES])
-
-    # TODO: maybe generate in a single file to minimize .meta's, which is possible
-    return generate_with_kari.callback(
-        rebuild=False, 
-        unprocessed_args=
-        [   "-input", quote(os.path.join(UNITY_ASSETS_DIRECTORY, "Source")), 
-            "-pluginsLocations", quote(plugins),
-            "-generatedName", "Generated",
-            "-rootNamespace", "SomeProject",
-            "-commonNamespace", "Common",
-            "-clearOutput",
-            "-terminalProject", "CommandTerminal",
-            "-engineCommon", "EngineCommon"
-        ])
+@click.option("-force", is_flag=True, help="Whether to generate the code even if neither the sources nor Kari have changed since the last time")
+@click.option("-single_file", is_flag=True, help="Whether to combine the code generated for each assembly into a single file (one per set of using directives), so that Unity has fewer files to import")
+def generate_code_for_unity(force=False, single_file=False):
+    """
+    Generates code for the unity project.
+    Does nothing if the sources, the generated code, Kari and the plugins are the same as the last time.
+    The generated files that come out the same are left untouched, so that Unity does not reimport them.
+    """
+    from baton.build_cache import CommandStamp, walk_files
+    import baton.generated_output as generated_output
+
+    source_directory = os.path.join(UNITY_ASSETS_DIRECTORY, "Source")
+    generated_name = "Generated"
+
+    # Built before the plugins are looked at, since the build is what records them in the registry
+    if not os.path.exists(KARI_GENERATOR_PATH):
+        log("Initiating build, since Kari has not been built")
+        if not build_kari.callback(clean=False, retry=False):
+            return False
+
+    # The plugins that have not been built would make Kari fail, so it is run without them
+    plugin_paths, unusable_plugins, stale_plugins = KARI_PLUGIN_REGISTRY.get_usable_outputs("Release",
+        lambda project_path: get_kari_output_path(project_path, "Release"), get_kari_build_manifest().get_inputs_hash)
+    for name, reason in unusable_plugins.items():
+        log_warning(f"Generating without the plugin {name}, since {reason}. Build it with `baton kari build -plugin {name}`")
+    # Still used, since generating without them would delete the code they have generated
+    for name in stale_plugins:
+        log_warning(f"Generating with the last build of the plugin {name}, which has changed since. Rebuild it with `baton kari build -plugin {name}`")
+    # Kari would clear the output, deleting all of the generated code
+    if len(plugin_paths) == 0:
+        log_error("None of the plugins can be used, so the code has not been generated. Build them with `baton kari build`")
+        log_reset()
+        return False
+
+    arguments = [
+        "-input", source_directory, 
+        "-pluginsLocations", ",".join(plugin_paths),
+        "-generatedName", generated_name,
+        "-rootNamespace", "SomeProject",
+        "-commonNamespace", "Common",
+        "-clearOutput",
+        "-terminalProject", "CommandTerminal",
+        "-engineCommon", "EngineCommon"
+    ]
+    # Not passed to Kari, but changes the output all the same
+    stamp_arguments = arguments + (["single file"] if single_file else [])
+
+    def get_input_files():
+        # The generated code is included, so that it is generated again if it is edited or deleted.
+        # The .meta files are not, since Unity writes them after the code has been generated.
+        files = [path for path in walk_files(source_directory, set()) if not path.endswith(".meta")]
+        return files + plugin_paths + list(walk_files(os.path.dirname(KARI_GENERATOR_PATH)))
+
+    stamp = CommandStamp(os.path.join(MSBUILD_INTERMEDIATE_OUTPUT_PATH, "kari_unity_stamp.json"), PROJECT_DIRECTORY, "kari unity")
+    # Outside of the sources, so that Kari does not read the old generated code, and Unity does not import it
+    stash_root = os.path.join(MSBUILD_INTERMEDIATE_OUTPUT_PATH, "kari_unity_stash")
+    generated_output.recover_stashes(source_directory, stash_root, generated_name)
+    if not force and stamp.is_up_to_date("kari unity", get_input_files(), stamp_arguments):
+        log_info("The generated code is up to date")
+        log_reset()
+        return True
+
+    stashes = generated_output.stash(generated_output.find_output_directories(source_directory, generated_name),
+        source_directory, stash_root)
+
+    def unstash_all():
+        for output_directory, stash_directory in stashes:
+            generated_output.unstash(output_directory, stash_directory)
+        shutil.rmtree(stash_root, ignore_errors=True)
+
+    try:
+        is_generated = generate_with_kari.callback(rebuild=False, unprocessed_args=arguments)
+    except BaseException:
+        unstash_all()
+        raise
+    if not is_generated:
+        unstash_all()
+        return False
+
+    if single_file:
+        # Before the sync, so that the combined files that come out the same are not touched either
+        with timing.phase("combine generated code"):
+            combined_count = 0
+            for output_directory in generated_output.find_output_directories(source_directory, generated_name):
+                count, left = generated_output.combine_sources(output_directory)
+                combined_count += count
+                for path in left:
+                    log_warning(f"Could not combine {os.path.relpath(path, source_directory)}")
+        log_info(f"Combined {combined_count} generated files")
+
+    with timing.phase("sync generated code"):
+        report = generated_output.SyncReport()
+        for output_directory, stash_directory in stashes:
+            generated_output.sync(output_directory, stash_directory, report)
+        shutil.rmtree(stash_root, ignore_errors=True)
+    log_info(f"Generated files: {report}")
+    log_reset()
+
+    stamp.record("kari unity", get_input_files(), stamp_arguments)
+    return True
+
+
+@kari.command("watch")
+@click.option("-debounce", type=float, default=0.3, help="The seconds without changes to wait for after a change before generating the code")
+@click.option("-poll", is_flag=True, help="Whether to look for changes by scanning the folder, instead of with inotify, which only works on Linux")
+@click.option("-interval", type=float, default=0.5, help="The seconds between the scans, when polling")
+@click.option("-single_file", is_flag=True, help="Whether to combine the generated code into a single file per assembly, see `baton kari unity`")
+def watch_kari(debounce, poll, interval, single_file):
+    """
+    Generates the code for the unity project whenever the sources change, until interrupted.
+    The changes saved in a quick succession are handled at once.
+    """
+    import time, errno, traceback
+    from baton.file_watcher import create_watcher, InotifyWatcher, PollingWatcher
+    from baton.generated_output import META_EXTENSION
+
+    source_directory = os.path.join(UNITY_ASSETS_DIRECTORY, "Source")
+    # Saving many times in a row should not put off the generation forever
+    max_delay = max(debounce * 10, 2.0)
+
+    def is_ignored(path, is_directory):
+        name = os.path.basename(path)
+        # Unity ignores those too
+        if name.startswith('.') or name.endswith('~'):
+            return True
+        if is_directory:
+            return name == "Generated"
+        return name.endswith(META_EXTENSION)
+
+    def generate():
+        # Whatever goes wrong, e.g. a file that cannot be moved, is worth another try after the next change
+        try:
+            return generate_code_for_unity.callback(single_file=single_file)
+        except Exception:
+            log_error(traceback.format_exc())
+            return False
+
+    if not generate():
+        log_warning("Fix the errors and save, the code will be generated again")
+
+    watcher = create_watcher(source_directory, is_ignored, poll, interval)
+
+    def wait(timeout=None):
+        nonlocal watcher
+        try:
+            return watcher.wait(timeout)
+        except OSError as error:
+            if not isinstance(watcher, InotifyWatcher):
+                raise
+            # e.g. ENOSPC when a new folder needs more watches than are allowed (fs.inotify.max_user_watches)
+            reason = "it is out of watches" if error.errno == errno.ENOSPC else str(error)
+            log_warning(f"Cannot watch with inotify, since {reason}, looking for changes every {interval}s instead")
+            log_reset()
+            watcher.close()
+            watcher = PollingWatcher(source_directory, is_ignored, interval)
+            # The changes may have been missed in the meantime
+            return { source_directory }
+    log_info(f"Watching {source_directory} " + ("with inotify" if isinstance(watcher, InotifyWatcher) else f"every {interval}s")
+        + ", press Ctrl+C to stop")
+    log_reset()
+
+    latencies = []
+    try:
+        while True:
+            changes = wait()
+            first_change = time.perf_counter()
+            while time.perf_counter() - first_change < max_delay:
+                more_changes = wait(debounce)
+                if not more_changes:
+                    break
+                changes |= more_changes
+
+            log(f"{len(changes)} paths changed: " + ", ".join(sorted(os.path.relpath(path, source_directory) for path in changes)[:5])
+                + (", ..." if len(changes) > 5 else ""))
+            generation_start = time.perf_counter()
+            with timing.phase("watch cycle"):
+                is_generated = generate()
+            end = time.perf_counter()
+            latencies.append(end - first_change)
+
+            message = (f"Generated in {end - generation_start:.2f}s, "
+                + f"{end - first_change:.2f}s after the first change")
+            if is_generated:
+                log_success(message)
+            else:
+                log_error(message.replace("Generated", "Failed", 1))
+            log_reset()
+
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
+
+    if latencies:
+        latencies.sort()
+        log_info(f"{len(latencies)} cycles, the median latency was {latencies[len(latencies) // 2]:.2f}s, "
+            + f"the longest {latencies[-1]:.2f}s")
+        log_reset()
+    return True
 
 
 @kari.command("nuke")
@@ -382,15 +1135,45 @@ def copy_all_files(source_dir, dest_dir):
 def try_delete(file_path):
     shutil.rmtree(file_path, ignore_errors = True)
 
-def run_command_sync(command):
-    log(command)
-    returncode = os.system(quote(command))
-    log_reset()
-    if returncode != 0:
-        raise subprocess.CalledProcessError(returncode, command)
+def run_command_sync(command : 'list[str]', timeout : float = None):
+    """Runs the command, printing its output as it comes, raising CalledProcessError if it fails or times out"""
+    import baton.process as process
+
+    log(process.format_command(command))
+    try:
+        process.run(command, timeout=timeout)
+    except FileNotFoundError:
+        log_error(f"{command[0]} was not found")
+        raise subprocess.CalledProcessError(127, process.format_command(command))
+    finally:
+        log_reset()
 
 run_sync = run_command_sync
 
+# Keeps the output of the commands run concurrently from interleaving
+_output_lock = threading.Lock()
+
+def run_command_buffered(command : 'list[str]', prefix : str, timeout : float = None):
+    """Like run_command_sync, but prints the output of the command at once when it is done, every line prefixed"""
+    import baton.process as process
+
+    try:
+        result = process.run(command, timeout=timeout, on_line=None, capture=True, check=False)
+    except FileNotFoundError:
+        with _output_lock:
+            log_error(f"{prefix}{command[0]} was not found")
+        raise subprocess.CalledProcessError(127, process.format_command(command))
+
+    with _output_lock:
+        log(prefix + process.format_command(command))
+        for line in result.output:
+            print(prefix + line)
+        if result.timed_out:
+            log_error(f"{prefix}Stopped after {timeout} seconds")
+        log_reset()
+
+    result.check()
+
 
 def try_make_dir(path):
     os.makedirs(path, exist_ok = True)
@@ -0,0 +1,291 @@
+"""
+Tells which .NET projects need to be built again, from a hash of their inputs kept in a manifest in the build output.
+The inputs of a project are the files in its folder (sources, templates, the .csproj) apart from bin and obj,
+the files it imports (e.g. Plugin.props), the Directory.Build.* files above it, and the inputs of the projects it references.
+The manifest lives next to the build output, so that deleting the output (`baton kari nuke`) also forgets what was built.
+
+Similarly, tells whether a command needs to run again, from a hash of the files it reads and writes,
+e.g. `dotnet tool restore`, `dotnet restore` and the code generation for Unity.
+"""
+
+import os, json, hashlib, threading
+from baton.build_graph import read_project_files
+import baton.timing as timing
+
+BUILD_MANIFEST_VERSION = 1
+COMMAND_STAMP_VERSION = 1
+IGNORED_DIRECTORIES = { "bin", "obj" }
+DIRECTORY_BUILD_FILES = ("Directory.Build.props", "Directory.Build.targets", "Directory.Packages.props")
+TOOL_MANIFEST_PATH = os.path.join(".config", "dotnet-tools.json")
+# The files `dotnet restore` reads, apart from the projects
+RESTORE_FILE_NAMES = { "packages.lock.json", "nuget.config", "global.json" }
+RESTORE_FILE_EXTENSIONS = { ".csproj", ".props", ".targets", ".sln" }
+
+
+def walk_files(directory : str, ignored_directories : 'set[str]' = IGNORED_DIRECTORIES):
+    """
+    The files under the folder, apart from those in the ignored folders, the dot folders and the folders ending in ~,
+    which Unity ignores too. Nothing if the folder does not exist.
+    """
+    directories = [directory]
+    while directories:
+        directory = directories.pop()
+        try:
+            iterator = os.scandir(directory)
+        except FileNotFoundError:
+            continue
+        with iterator:
+            for entry in iterator:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in ignored_directories and not entry.name.endswith('~'):
+                        directories.append(entry.path)
+                else:
+                    yield entry.path
+
+
+def _hash_file(file_path : str) -> str:
+    hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+class FileHashes:
+    """
+    The hashes of files, which are only computed again if the size or the modification time of a file has changed.
+    Kept in the manifest as path -> [mtime_ns, size, sha256].
+    """
+
+    def __init__(self, entries : 'dict[str, list]' = None):
+        self.entries = entries or {}
+        # The files looked at since the last refresh, which are not looked at again until then
+        self._checked : 'set[str]' = set()
+
+    def get(self, file_path : str) -> str:
+        """The sha256 of the file, None if it does not exist"""
+        entry = self.entries.get(file_path)
+        if file_path in self._checked:
+            return entry[2] if entry is not None else None
+
+        self._checked.add(file_path)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            self.entries.pop(file_path, None)
+            return None
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            entry = [stat.st_mtime_ns, stat.st_size, _hash_file(file_path)]
+            self.entries[file_path] = entry
+        return entry[2]
+
+    def refresh(self, file_path : str = None):
+        """Makes the file, or all of the files, be looked at again, e.g. after a build has changed some of them"""
+        if file_path is None:
+            self._checked.clear()
+        else:
+            self._checked.discard(file_path)
+
+    def prune(self):
+        """Forgets the files that do not exist anymore"""
+        self.entries = { path: entry for path, entry in self.entries.items() if path in self._checked or os.path.exists(path) }
+
+
+def _update_with_files(hash, files : 'list[str]', root_directory : str, file_hashes : FileHashes):
+    """Adds the paths, relative to the root, and the contents of the files to the hash"""
+    for file_path in sorted(set(files)):
+        hash.update(os.path.relpath(file_path, root_directory).replace(os.sep, '/').encode('utf-8'))
+        hash.update(b'\0')
+        hash.update((file_hashes.get(file_path) or 'missing').encode('ascii'))
+        hash.update(b'\n')
+
+
+class ProjectHasher:
+    def __init__(self, root_directory : str, file_hashes : FileHashes):
+        # The Directory.Build.* files are looked for up to this folder
+        self.root_directory = os.path.abspath(root_directory)
+        self.file_hashes = file_hashes
+        self._hashes : 'dict[str, str]' = {}
+
+    def _get_directory_build_files(self, project_directory : str) -> 'list[str]':
+        files = []
+        directory = project_directory
+        while True:
+            for name in DIRECTORY_BUILD_FILES:
+                path = os.path.join(directory, name)
+                if os.path.isfile(path):
+                    files.append(path)
+            parent = os.path.dirname(directory)
+            if directory == self.root_directory or parent == directory or not directory.startswith(self.root_directory):
+                return files
+            directory = parent
+
+    def get_hash(self, project_path : str, _visiting : 'set[str]' = None) -> str:
+        """The hash of all of the inputs of the project, including those of the projects it references"""
+        project_path = os.path.normpath(os.path.abspath(project_path))
+        result = self._hashes.get(project_path)
+        if result is not None:
+            return result
+
+        visiting = _visiting or set()
+        visiting.add(project_path)
+
+        project_directory = os.path.dirname(project_path)
+        references, imports = read_project_files(project_path)
+        files = list(walk_files(project_directory)) + imports + self._get_directory_build_files(project_directory)
+
+        hash = hashlib.sha256()
+        _update_with_files(hash, files, self.root_directory, self.file_hashes)
+        for reference in sorted(set(references)):
+            if reference in visiting:
+                continue
+            hash.update(b'reference ')
+            hash.update(self.get_hash(reference, visiting).encode('ascii'))
+            hash.update(b'\n')
+
+        visiting.discard(project_path)
+        result = hash.hexdigest()
+        self._hashes[project_path] = result
+        return result
+
+
+class BuildManifest:
+    """
+    What was built: key (e.g. `Release/Kari.Generator`) -> the hash of the inputs and of the output when it was built.
+    Can be used from multiple threads.
+    """
+
+    def __init__(self, file_path : str, root_directory : str):
+        self.file_path = file_path
+        self.projects : 'dict[str, dict]' = {}
+        file_hashes = FileHashes()
+        try:
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+            if data.get("version") == BUILD_MANIFEST_VERSION:
+                self.projects = data["projects"]
+                file_hashes = FileHashes(data["files"])
+        except (OSError, ValueError, KeyError):
+            pass
+        self.file_hashes = file_hashes
+        self.hasher = ProjectHasher(root_directory, file_hashes)
+        self._lock = threading.Lock()
+
+    def _get_output_hash(self, output_path : str) -> str:
+        if output_path is None:
+            return None
+        return self.file_hashes.get(output_path)
+
+    def is_up_to_date(self, key : str, project_path : str, output_path : str = None) -> bool:
+        """
+        Whether the project has been built from the same inputs, and its output, if given, is still what was built then.
+        The projects without a known output are trusted to still have it, since the manifest is deleted along with the output.
+        """
+        with self._lock:
+            result = self._is_up_to_date(key, project_path, output_path)
+        timing.cache("build", result)
+        return result
+
+    def _is_up_to_date(self, key : str, project_path : str, output_path : str) -> bool:
+        entry = self.projects.get(key)
+        if entry is None:
+            return False
+        if entry["inputs"] != self.hasher.get_hash(project_path):
+            return False
+        if output_path is not None and entry.get("output") != self._get_output_hash(output_path):
+            return False
+        return True
+
+    def get_inputs_hash(self, project_path : str) -> str:
+        """
+        The hash of the inputs of the project, as they were when first looked at in this run.
+        Taken before the build and recorded after it, so that a file saved while the project is being built
+        makes it be built again the next time. So do the sources generated by the build, but only once.
+        """
+        with self._lock:
+            return self.hasher.get_hash(project_path)
+
+    def record(self, key : str, inputs : str, output_path : str = None):
+        """Remembers that the project has just been built from the inputs with the given hash, and saves the manifest"""
+        with self._lock:
+            if output_path is not None:
+                self.file_hashes.refresh(output_path)
+            self.projects[key] = {
+                "inputs": inputs,
+                "output": self._get_output_hash(output_path),
+            }
+            self._save()
+
+    def forget(self, key : str):
+        with self._lock:
+            if self.projects.pop(key, None) is not None:
+                self._save()
+
+    def _save(self):
+        self.file_hashes.prune()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ "version": BUILD_MANIFEST_VERSION, "projects": self.projects, "files": self.file_hashes.entries }, file)
+        os.replace(temp_path, self.file_path)
+
+
+def get_tool_restore_files(root_directory : str) -> 'list[str]':
+    """The files that `dotnet tool restore` reads"""
+    return [os.path.join(root_directory, TOOL_MANIFEST_PATH)]
+
+def get_package_restore_files(root_directory : str) -> 'list[str]':
+    """The files that `dotnet restore` reads: the projects and solutions, the files they import, the lock files and the NuGet config"""
+    return [path for path in walk_files(root_directory)
+        if os.path.splitext(path)[1].lower() in RESTORE_FILE_EXTENSIONS or os.path.basename(path).lower() in RESTORE_FILE_NAMES]
+
+
+class CommandStamp:
+    """
+    The hashes of the files and of the arguments of commands the last time they succeeded, by the name of the command.
+    `cache_name` is what the lookups are counted as in the timeline.
+    """
+
+    def __init__(self, file_path : str, root_directory : str, cache_name : str):
+        self.file_path = file_path
+        self.root_directory = os.path.abspath(root_directory)
+        self.cache_name = cache_name
+        self.commands : 'dict[str, str]' = {}
+        file_hashes = FileHashes()
+        try:
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+            if data.get("version") == COMMAND_STAMP_VERSION:
+                self.commands = data["commands"]
+                file_hashes = FileHashes(data["files"])
+        except (OSError, ValueError, KeyError):
+            pass
+        self.file_hashes = file_hashes
+
+    def get_hash(self, files : 'list[str]', arguments : 'list[str]' = ()) -> str:
+        hash = hashlib.sha256()
+        for argument in arguments:
+            hash.update(argument.encode('utf-8'))
+            hash.update(b'\0')
+        hash.update(b'\n')
+        _update_with_files(hash, files, self.root_directory, self.file_hashes)
+        return hash.hexdigest()
+
+    def is_up_to_date(self, name : str, files : 'list[str]', arguments : 'list[str]' = ()) -> bool:
+        result = self.commands.get(name) == self.get_hash(files, arguments)
+        timing.cache(self.cache_name, result)
+        return result
+
+    def record(self, name : str, files : 'list[str]', arguments : 'list[str]' = ()):
+        """Remembers that the command has just succeeded with the files as they are now, and saves the stamp"""
+        # The command may have changed some of them, e.g. restoring may update the lock files
+        self.file_hashes.refresh()
+        self.commands[name] = self.get_hash(files, arguments)
+        self.file_hashes.prune()
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ "version": COMMAND_STAMP_VERSION, "commands": self.commands, "files": self.file_hashes.entries }, file)
+        os.replace(temp_path, self.file_path)
@@ -0,0 +1,304 @@
+"""
+Builds .NET projects in the order of their dependencies, running the independent ones concurrently.
+The graph comes from the ProjectDependencies sections of a solution and from the ProjectReferences of the .csproj files,
+including those of the .props files they import.
+"""
+
+import os, time, threading
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+OK = "ok"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+class BuildGraphError(Exception):
+    pass
+
+
+def _normalize_path(path : str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+def _local_name(tag : str) -> str:
+    """The tag without the namespace, which the old style projects have"""
+    return tag[tag.rfind('}') + 1:]
+
+
+def read_project_files(project_path : str) -> 'tuple[list[str], list[str]]':
+    """
+    Returns the absolute paths of the projects referenced by the project, directly or in the files it imports,
+    and the paths of the files it imports, e.g. a Plugin.props shared by the plugins.
+    The paths with MSBuild properties in them cannot be resolved without MSBuild, so they are ignored.
+    """
+    references = []
+    imports = []
+    visited = set()
+    files = [project_path]
+    while files:
+        file_path = files.pop()
+        normalized_path = _normalize_path(file_path)
+        if normalized_path in visited:
+            continue
+        visited.add(normalized_path)
+
+        try:
+            root = ElementTree.parse(file_path).getroot()
+        except (OSError, ElementTree.ParseError):
+            continue
+
+        directory = os.path.dirname(file_path)
+        for element in root.iter():
+            name = _local_name(element.tag)
+            if name not in ("ProjectReference", "Import"):
+                continue
+            include = element.get("Include" if name == "ProjectReference" else "Project")
+            if not include or '$(' in include:
+                continue
+            path = os.path.normpath(os.path.join(directory, include.replace('\\', os.sep)))
+            if name == "ProjectReference":
+                references.append(path)
+            else:
+                imports.append(path)
+                files.append(path)
+    return references, imports
+
+
+def read_project_references(project_path : str) -> 'list[str]':
+    """The absolute paths of the projects referenced by the project, directly or in the files it imports"""
+    return read_project_files(project_path)[0]
+
+
+def write_traversal_project(file_path : str, project_paths : 'list[str]', target : str = "Publish"):
+    """
+    Writes an MSBuild project that runs the target of all of the projects in a single build, with `-m` in parallel.
+    MSBuild evaluates the shared imports and builds every referenced project only once per build,
+    instead of once for every project.
+    """
+    from xml.sax.saxutils import quoteattr
+
+    lines = ['<Project DefaultTargets="Build">', '  <ItemGroup>']
+    for project_path in project_paths:
+        lines.append(f'    <TraversedProject Include={quoteattr(os.path.abspath(project_path))} />')
+    lines += [
+        '  </ItemGroup>',
+        '  <Target Name="Build">',
+        f'    <MSBuild Projects="@(TraversedProject)" Targets={quoteattr(target)} BuildInParallel="true" />',
+        '  </Target>',
+        '</Project>',
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+class BuildNode:
+    __slots__ = ('key', 'name', 'project_path', 'dependencies')
+
+    def __init__(self, project_path : str):
+        self.key          = _normalize_path(project_path)
+        self.name         = os.path.splitext(os.path.basename(project_path))[0]
+        self.project_path = project_path
+        # The keys of the nodes that have to be built before this one
+        self.dependencies : 'set[str]' = set()
+
+
+class BuildGraph:
+    def __init__(self):
+        self.nodes : 'dict[str, BuildNode]' = {}
+
+    def add_project(self, project_path : str) -> BuildNode:
+        node = BuildNode(project_path)
+        return self.nodes.setdefault(node.key, node)
+
+    def get(self, project_path : str) -> BuildNode:
+        return self.nodes.get(_normalize_path(project_path))
+
+    def subgraph(self, project_paths : 'list[str]') -> 'BuildGraph':
+        """The graph of the given projects and of everything they depend on"""
+        result = BuildGraph()
+        keys = [_normalize_path(path) for path in project_paths]
+        while keys:
+            key = keys.pop()
+            if key in result.nodes:
+                continue
+            node = self.nodes.get(key)
+            if node is None:
+                raise BuildGraphError(f"The project {key} is not in the graph")
+            result.nodes[key] = node
+            keys.extend(node.dependencies)
+        return result
+
+    def topological_order(self) -> 'list[BuildNode]':
+        """The nodes with their dependencies before them, raising BuildGraphError on cycles"""
+        order = []
+        state = {}  # key -> False while being visited, True once done
+        for root_key in sorted(self.nodes):
+            stack = [(root_key, False)]
+            while stack:
+                key, is_exit = stack.pop()
+                if is_exit:
+                    state[key] = True
+                    order.append(self.nodes[key])
+                    continue
+                if state.get(key) is True:
+                    continue
+                if key in state:
+                    raise BuildGraphError(f"The project {self.nodes[key].name} depends on itself")
+                state[key] = False
+                stack.append((key, True))
+                for dependency in sorted(self.nodes[key].dependencies, reverse=True):
+                    if state.get(dependency) is not True:
+                        stack.append((dependency, False))
+        return order
+
+
+def load_build_graph(solution_path : str, project_paths : 'list[str]' = []) -> BuildGraph:
+    """The graph of the .csproj projects of the solution, and of the given projects in case they are not in it"""
+    from baton.solution import Solution
+
+    graph = BuildGraph()
+    solution_directory = os.path.dirname(os.path.abspath(solution_path))
+    with Solution.read(solution_path) as solution:
+        def get_path(project):
+            return os.path.normpath(os.path.join(solution_directory, project.relative_path.replace('\\', os.sep)))
+
+        # Solution folders and other non C# projects are not built
+        projects = [project for project in solution.projects if project.relative_path.endswith('.csproj')]
+        for project in projects:
+            graph.add_project(get_path(project))
+
+        for project in projects:
+            node = graph.get(get_path(project))
+            for dependency in solution.dependencies_of(project):
+                dependency_node = graph.get(get_path(dependency))
+                if dependency_node is not None:
+                    node.dependencies.add(dependency_node.key)
+
+    for project_path in project_paths:
+        graph.add_project(project_path)
+
+    # The referenced projects that are not in the solution are built by their dependents
+    for node in list(graph.nodes.values()):
+        for reference in read_project_references(node.project_path):
+            dependency_node = graph.get(reference)
+            if dependency_node is not None and dependency_node is not node:
+                node.dependencies.add(dependency_node.key)
+
+    return graph
+
+
+class BuildResult:
+    def __init__(self, node : BuildNode):
+        self.node   = node
+        self.status = SKIPPED
+        self.start  = 0.0
+        self.end    = 0.0
+        self.error  : BaseException = None
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+class BuildReport:
+    def __init__(self, graph : BuildGraph, results : 'dict[str, BuildResult]', wall_seconds : float):
+        self.graph        = graph
+        self.results      = results
+        self.wall_seconds = wall_seconds
+
+    def is_ok(self) -> bool:
+        return all(result.status == OK for result in self.results.values())
+
+    def get_failed(self) -> 'list[BuildResult]':
+        return [result for result in self.results.values() if result.status == FAILED]
+
+    def critical_path(self) -> 'tuple[list[BuildNode], float]':
+        """
+        The chain of dependencies that took the longest to build, which bounds the time of the build
+        however many workers there are. Only the built nodes are considered.
+        """
+        finish : 'dict[str, tuple[float, str]]' = {}  # key -> (seconds until done along the path, previous key)
+        for node in self.graph.topological_order():
+            result = self.results[node.key]
+            if result.status == SKIPPED:
+                continue
+            previous = max(((finish[key][0], key) for key in node.dependencies if key in finish), default=(0.0, None))
+            finish[node.key] = (previous[0] + result.seconds, previous[1])
+
+        if not finish:
+            return [], 0.0
+        key = max(finish, key=lambda key: finish[key][0])
+        seconds = finish[key][0]
+        path = []
+        while key is not None:
+            path.append(self.graph.nodes[key])
+            key = finish[key][1]
+        path.reverse()
+        return path, seconds
+
+
+def run_build_graph(graph : BuildGraph, build, jobs : int, cancel = None) -> BuildReport:
+    """
+    Calls `build(node)` on every node once all of its dependencies have been built, on up to `jobs` threads.
+    A node has failed if `build` raises. After the first failure no more nodes are started,
+    the ones already running are waited for, and the rest are reported as skipped.
+    If the wait is interrupted, e.g. by Ctrl-C, `cancel()` is called to stop the builds running, and the exception is raised.
+    """
+    order = graph.topological_order()
+    results = { node.key: BuildResult(node) for node in order }
+    dependents : 'dict[str, list[str]]' = { node.key: [] for node in order }
+    remaining_dependencies = {}
+    for node in order:
+        remaining_dependencies[node.key] = len(node.dependencies)
+        for dependency in node.dependencies:
+            dependents[dependency].append(node.key)
+
+    # Started in the topological order, which keeps the order deterministic with a single job
+    ready = [node.key for node in order if remaining_dependencies[node.key] == 0]
+    lock = threading.Lock()
+
+    def run(key : str):
+        result = results[key]
+        result.start = time.perf_counter()
+        try:
+            build(result.node)
+            status = OK
+        except Exception as exception:
+            result.error = exception
+            status = FAILED
+        result.end = time.perf_counter()
+        with lock:
+            result.status = status
+        return key
+
+    start = time.perf_counter()
+    has_failed = False
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        running = set()
+        while True:
+            while ready and not has_failed and len(running) < max(1, jobs):
+                running.add(executor.submit(run, ready.pop(0)))
+            if not running:
+                break
+
+            try:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+            except BaseException:
+                # The executor waits for the running builds before the exception gets out
+                has_failed = True
+                ready.clear()
+                if cancel is not None:
+                    cancel()
+                raise
+            for future in done:
+                key = future.result()
+                if results[key].status != OK:
+                    has_failed = True
+                    continue
+                for dependent in dependents[key]:
+                    remaining_dependencies[dependent] -= 1
+                    if remaining_dependencies[dependent] == 0:
+                        ready.append(dependent)
+
+    return BuildReport(graph, results, time.perf_counter() - start)
@@ -0,0 +1,74 @@
+"""
+A thin entry point for the git hooks, which forwards the command to a running baton daemon (see daemon.py),
+falling back to running baton in-process if the daemon is not running.
+Only import the standard library here, since not paying for the imports of baton is the whole point.
+"""
+
+import os, sys, hashlib, tempfile
+from multiprocessing.connection import Client
+
+IS_WINDOWS = sys.platform.startswith('win')
+
+# The commands the daemon is able to run
+DAEMON_COMMANDS = {"git_precommit"}
+# The variables git sets for the hooks that change what the git commands see, e.g. `git commit -a` uses a temporary index
+FORWARDED_ENVIRONMENT = ("GIT_INDEX_FILE", "GIT_DIR")
+
+
+def get_project_directory() -> str:
+    return os.environ.get("PROJECT_DIRECTORY") or os.path.abspath(".")
+
+def get_daemon_address(project_directory : str) -> str:
+    """The address is unique per project, so that several clones can each have a daemon"""
+    key = hashlib.sha1(os.path.normcase(os.path.abspath(project_directory)).encode('utf-8')).hexdigest()[:16]
+    if IS_WINDOWS:
+        return r'\\.\pipe\baton-' + key
+    return os.path.join(tempfile.gettempdir(), f"baton-{key}.sock")
+
+def get_daemon_family() -> str:
+    return 'AF_PIPE' if IS_WINDOWS else 'AF_UNIX'
+
+def get_daemon_key_path(project_directory : str) -> str:
+    return os.path.join(project_directory, ".git", "baton", "daemon_key")
+
+
+def try_forward(project_directory : str, argv : 'list[str]') -> 'tuple[int, str]':
+    """Returns (exit code, output) of the command run by the daemon, or None if it could not be run there."""
+    if len(argv) == 0 or argv[0] not in DAEMON_COMMANDS:
+        return None
+
+    try:
+        with open(get_daemon_key_path(project_directory), 'rb') as file:
+            authkey = file.read()
+        with Client(get_daemon_address(project_directory), get_daemon_family(), authkey=authkey) as connection:
+            connection.send({ "argv": argv, "cwd": os.path.abspath("."),
+                "env": { name: os.environ[name] for name in FORWARDED_ENVIRONMENT if name in os.environ } })
+            response = connection.recv()
+    except (OSError, EOFError):
+        return None
+    except Exception:
+        # e.g. AuthenticationError if the key has been regenerated by a new daemon
+        return None
+
+    if response is None:
+        return None
+    return response["exit_code"], response["output"]
+
+
+def main():
+    project_directory = get_project_directory()
+    argv = sys.argv[1:]
+
+    result = try_forward(project_directory, argv)
+    if result is not None:
+        exit_code, output = result
+        sys.stdout.write(output)
+        sys.stdout.flush()
+        sys.exit(exit_code)
+
+    from baton.baton import cli
+    cli(argv)
+
+
+if __name__ == "__main__":
+    main()
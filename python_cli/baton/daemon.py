@@ -0,0 +1,191 @@
+"""
+A long lived baton process serving the git hooks through a Unix socket or a named pipe (see client.py).
+It pays the imports once and keeps the meta pairing cache warm between commits.
+Every request is run in the folder and with the git variables (e.g. GIT_INDEX_FILE) of the hook that has sent it,
+and with a `git cat-file` process of its own, since that process caches the index it has read first.
+The daemon is opt-in: start it with `baton daemon start`, the hooks run in-process when it is not running.
+"""
+
+import os, sys, io, contextlib, traceback, subprocess, time
+from multiprocessing.connection import Listener, Client
+from baton.client import (DAEMON_COMMANDS, IS_WINDOWS, FORWARDED_ENVIRONMENT,
+    get_daemon_address, get_daemon_family, get_daemon_key_path)
+import baton.git_hooks as git_hooks
+from baton.git_objects import CatFile
+
+STOP_REQUEST = "stop"
+PING_REQUEST = "ping"
+
+
+@contextlib.contextmanager
+def _request_environment(env : 'dict[str, str]'):
+    """
+    Sets the forwarded variables for the git commands started during the request, unsetting those the hook did not have.
+    The requests are served one at a time, so changing the environment of the daemon is fine.
+    """
+    saved = { name: os.environ.get(name) for name in FORWARDED_ENVIRONMENT }
+    for name in FORWARDED_ENVIRONMENT:
+        if name in env:
+            os.environ[name] = env[name]
+        else:
+            os.environ.pop(name, None)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+class DaemonState:
+    def __init__(self, project_directory : str):
+        self.project_directory = project_directory
+        self.meta_pairing_cache = git_hooks.load_meta_pairing_cache(project_directory)
+
+    def run(self, argv : 'list[str]', cwd : str = None, env : 'dict[str, str]' = None) -> 'tuple[int, str]':
+        """Runs one of the DAEMON_COMMANDS in the folder and with the git variables of the hook, returning the exit code and the output"""
+        directory = cwd or self.project_directory
+        output = io.StringIO()
+        with _request_environment(env or {}), contextlib.redirect_stdout(output):
+            if argv[0] == "git_precommit":
+                # The config is read on every request, since it may have changed since the last one
+                file_size_limits = git_hooks.load_file_size_limits(directory)
+                with CatFile(directory) as cat_file:
+                    exit_code = git_hooks.precommit(directory, file_size_limits=file_size_limits,
+                        cat_file=cat_file, meta_pairing_cache=self.meta_pairing_cache)
+        return exit_code, output.getvalue()
+
+    def reset(self):
+        """Drops the warm state, in case it got into a bad state"""
+        self.meta_pairing_cache = git_hooks.load_meta_pairing_cache(self.project_directory)
+
+
+def _write_key(project_directory : str) -> bytes:
+    """A new key is generated on every start, readable only by the current user"""
+    key = os.urandom(32)
+    key_path = get_daemon_key_path(project_directory)
+    os.makedirs(os.path.dirname(key_path), exist_ok=True)
+    if os.path.exists(key_path):
+        os.remove(key_path)
+    file = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    try:
+        os.write(file, key)
+    finally:
+        os.close(file)
+    return key
+
+
+def _send(project_directory : str, request : dict):
+    with open(get_daemon_key_path(project_directory), 'rb') as file:
+        authkey = file.read()
+    with Client(get_daemon_address(project_directory), get_daemon_family(), authkey=authkey) as connection:
+        connection.send(request)
+        return connection.recv()
+
+
+def is_running(project_directory : str) -> bool:
+    try:
+        return _send(project_directory, { "argv": [PING_REQUEST] }) == PING_REQUEST
+    except Exception:
+        return False
+
+
+def stop(project_directory : str) -> bool:
+    """Returns whether there has been a daemon to stop"""
+    try:
+        _send(project_directory, { "argv": [STOP_REQUEST] })
+        return True
+    except Exception:
+        return False
+
+
+def serve(project_directory : str):
+    """Serves the requests one at a time until asked to stop"""
+    address = get_daemon_address(project_directory)
+
+    # A socket file left behind by a daemon that has crashed
+    if not IS_WINDOWS and os.path.exists(address):
+        if is_running(project_directory):
+            print(f"The daemon is already running at {address}")
+            return
+        os.remove(address)
+
+    authkey = _write_key(project_directory)
+    state = DaemonState(project_directory)
+
+    try:
+        with Listener(address, get_daemon_family(), authkey=authkey) as listener:
+            print(f"Listening at {address}")
+            sys.stdout.flush()
+
+            while True:
+                try:
+                    connection = listener.accept()
+                except Exception:
+                    # Failed authentication or a client that has gone away
+                    continue
+
+                with connection:
+                    try:
+                        request = connection.recv()
+                        argv = request["argv"]
+                    except Exception:
+                        continue
+
+                    if argv[0] == STOP_REQUEST:
+                        connection.send(None)
+                        break
+
+                    if argv[0] == PING_REQUEST:
+                        connection.send(PING_REQUEST)
+                        continue
+
+                    if argv[0] not in DAEMON_COMMANDS:
+                        connection.send(None)
+                        continue
+
+                    try:
+                        exit_code, output = state.run(argv, request.get("cwd"), request.get("env"))
+                        response = { "exit_code": exit_code, "output": output }
+                    except Exception:
+                        traceback.print_exc()
+                        state.reset()
+                        # The client will run the command in-process
+                        response = None
+
+                    try:
+                        connection.send(response)
+                    except Exception:
+                        pass
+    finally:
+        if not IS_WINDOWS and os.path.exists(address):
+            os.remove(address)
+
+
+def start_detached(project_directory : str, timeout_seconds : float = 10) -> bool:
+    """Starts the daemon as a background process, logging to .git/baton/daemon.log. Returns whether it came up."""
+    log_path = os.path.join(git_hooks.get_baton_git_directory(project_directory), "daemon.log")
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    with open(log_path, 'a') as log_file:
+        kwargs = {}
+        if IS_WINDOWS:
+            kwargs["creationflags"] = subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+
+        subprocess.Popen([sys.executable, "-m", "baton.daemon", project_directory],
+            cwd=project_directory, stdin=subprocess.DEVNULL, stdout=log_file, stderr=log_file, **kwargs)
+
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if is_running(project_directory):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+if __name__ == "__main__":
+    serve(os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else "."))
@@ -0,0 +1,201 @@
+"""
+Tells which files under a folder change, with inotify on Linux, and by looking at the modification times
+and the sizes of all of the files every so often elsewhere, or if inotify cannot be used.
+The paths for which `is_ignored(path, is_directory)` is true are not reported, and the ignored folders are not looked into.
+"""
+
+import os, sys, time, errno, select, struct
+
+DEFAULT_POLL_INTERVAL = 0.5
+
+
+class PollingWatcher:
+    def __init__(self, directory : str, is_ignored, interval : float = DEFAULT_POLL_INTERVAL):
+        self.directory = directory
+        self.is_ignored = is_ignored
+        self.interval = interval
+        self._snapshot = self._scan()
+        self._last_poll = time.monotonic()
+
+    def _scan(self) -> 'dict[str, tuple[int, int]]':
+        result = {}
+        directories = [self.directory]
+        while directories:
+            directory = directories.pop()
+            try:
+                iterator = os.scandir(directory)
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    try:
+                        is_directory = entry.is_dir(follow_symlinks=False)
+                        if self.is_ignored(entry.path, is_directory):
+                            continue
+                        if is_directory:
+                            directories.append(entry.path)
+                        else:
+                            stat = entry.stat(follow_symlinks=False)
+                            result[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                    except OSError:
+                        # Deleted while being looked at
+                        continue
+        return result
+
+    def wait(self, timeout : float = None) -> 'set[str]':
+        """The paths of the files added, changed or deleted, once there are any, or an empty set after the timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            sleep_seconds = max(0.0, self._last_poll + self.interval - time.monotonic())
+            if deadline is not None:
+                sleep_seconds = min(sleep_seconds, max(0.0, deadline - time.monotonic()))
+            time.sleep(sleep_seconds)
+
+            if self._last_poll + self.interval <= time.monotonic():
+                self._last_poll = time.monotonic()
+                snapshot = self._scan()
+                changes = { path for path, state in snapshot.items() if self._snapshot.get(path) != state }
+                changes.update(path for path in self._snapshot if path not in snapshot)
+                self._snapshot = snapshot
+                if changes:
+                    return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    # See inotify(7)
+    IN_MODIFY      = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW  = 0x00004000
+    IN_IGNORED     = 0x00008000
+    IN_ISDIR       = 0x40000000
+    IN_ONLYDIR     = 0x01000000
+    EVENT_HEADER = struct.Struct("iIII")
+
+    WATCH_MASK = IN_CLOSE_WRITE | IN_MODIFY | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+    def __init__(self, directory : str, is_ignored):
+        import ctypes
+
+        self.directory = directory
+        self.is_ignored = is_ignored
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._ctypes = ctypes
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            self._raise_errno("inotify_init1")
+        # watch descriptor -> folder
+        self._directories : 'dict[int, str]' = {}
+        try:
+            self._watch_tree(directory)
+        except OSError:
+            self.close()
+            raise
+
+    def _raise_errno(self, function : str, path : str = None):
+        error = self._ctypes.get_errno()
+        raise OSError(error, f"{function}: {os.strerror(error)}", path)
+
+    def _watch_tree(self, directory : str) -> 'list[str]':
+        """Watches the folder and the folders in it, returning the files found in them"""
+        files = []
+        directories = [directory]
+        while directories:
+            directory = directories.pop()
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), self.WATCH_MASK)
+            if descriptor < 0:
+                # Deleted in the meantime. Running out of watches (ENOSPC) is worth giving up on though.
+                if self._ctypes.get_errno() == errno.ENOENT:
+                    continue
+                self._raise_errno("inotify_add_watch", directory)
+            self._directories[descriptor] = directory
+            try:
+                iterator = os.scandir(directory)
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    is_directory = entry.is_dir(follow_symlinks=False)
+                    if self.is_ignored(entry.path, is_directory):
+                        continue
+                    if is_directory:
+                        directories.append(entry.path)
+                    else:
+                        files.append(entry.path)
+        return files
+
+    def _read_events(self) -> 'set[str]':
+        changes = set()
+        while True:
+            try:
+                buffer = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changes
+
+            offset = 0
+            while offset < len(buffer):
+                descriptor, mask, _, length = self.EVENT_HEADER.unpack_from(buffer, offset)
+                name = buffer[offset + self.EVENT_HEADER.size:offset + self.EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += self.EVENT_HEADER.size + length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    # Some events have been lost, so anything may have changed
+                    changes.add(self.directory)
+                    continue
+                directory = self._directories.get(descriptor)
+                if directory is None:
+                    continue
+                if mask & self.IN_IGNORED:
+                    del self._directories[descriptor]
+                    continue
+                if not name:
+                    continue
+
+                path = os.path.join(directory, os.fsdecode(name))
+                is_directory = bool(mask & self.IN_ISDIR)
+                if self.is_ignored(path, is_directory):
+                    continue
+                if is_directory:
+                    if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        # The files may have been created before the folder is watched
+                        changes.update(self._watch_tree(path))
+                    changes.add(path)
+                else:
+                    changes.add(path)
+
+    def wait(self, timeout : float = None) -> 'set[str]':
+        """The paths of the files added, changed or deleted, once there are any, or an empty set after the timeout"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            readable, _, _ = select.select([self._fd], [], [], remaining)
+            if readable:
+                changes = self._read_events()
+                if changes:
+                    return changes
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def create_watcher(directory : str, is_ignored, poll : bool = False, interval : float = DEFAULT_POLL_INTERVAL):
+    """An InotifyWatcher if possible and not asked to poll, a PollingWatcher otherwise"""
+    if not poll and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(directory, is_ignored)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(directory, is_ignored, interval)
@@ -0,0 +1,267 @@
+"""
+Keeps the files generated by Kari that have not changed from being touched when the code is generated again.
+Kari clears its output folders and writes every file anew, which makes Unity reimport and recompile all of them.
+So before Kari runs, the contents of every output folder are moved aside into a stash folder outside of the sources
+(e.g. `Build/obj/kari_unity_stash/<the path of the output folder in the sources>`), where neither Kari nor Unity see them.
+The output folders themselves stay, so that Unity does not drop their .meta files if it refreshes in the meantime.
+Once Kari is done, the old files identical to the new ones are moved back over them, keeping their modification times,
+along with the .meta files of everything that is still there. What is left of the stash is then deleted.
+"""
+
+import os, re, errno, shutil, filecmp
+
+META_EXTENSION = ".meta"
+
+
+class SyncReport:
+    def __init__(self):
+        self.unchanged : 'list[str]' = []
+        self.changed   : 'list[str]' = []
+        self.added     : 'list[str]' = []
+        self.deleted   : 'list[str]' = []
+
+    def __str__(self):
+        return (f"{len(self.unchanged)} unchanged, {len(self.changed)} changed, "
+            + f"{len(self.added)} added, {len(self.deleted)} deleted")
+
+
+def find_output_directories(directory : str, name : str) -> 'list[str]':
+    """The folders with the given name under the folder, not looking inside of them, nor in those Unity ignores"""
+    result = []
+    for root, directories, _ in os.walk(directory):
+        if name in directories:
+            result.append(os.path.join(root, name))
+        directories[:] = [d for d in directories if d != name and not d.startswith('.') and not d.endswith('~')]
+    return result
+
+
+def _move(source : str, destination : str):
+    """Renames the file or the folder, copying it if the stash is on another drive than the sources"""
+    try:
+        os.replace(source, destination)
+    except OSError as error:
+        if error.errno != errno.EXDEV:
+            raise
+        if os.path.isdir(destination):
+            shutil.rmtree(destination)
+        shutil.move(source, destination)
+
+
+def _move_contents(source_directory : str, destination_directory : str):
+    """Moves everything in the folder into the other one, which is created if needed"""
+    os.makedirs(destination_directory, exist_ok=True)
+    for entry in os.scandir(source_directory):
+        _move(entry.path, os.path.join(destination_directory, entry.name))
+
+
+def _clear(directory : str):
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+def stash(output_directories : 'list[str]', source_directory : str, stash_root : str) -> 'list[tuple[str, str]]':
+    """
+    Moves the contents of the output folders into the stash folder, at the same paths relative to it as they have relative to the sources.
+    Returns the pairs of the output folders and of the folders their contents have been moved to.
+    """
+    stashes = []
+    for output_directory in output_directories:
+        stash_directory = os.path.join(stash_root, os.path.relpath(output_directory, source_directory))
+        if os.path.isdir(stash_directory):
+            shutil.rmtree(stash_directory)
+        _move_contents(output_directory, stash_directory)
+        stashes.append((output_directory, stash_directory))
+    return stashes
+
+
+def recover_stashes(source_directory : str, stash_root : str, name : str):
+    """Puts back the contents of the output folders stashed by a run that was interrupted before they were synced"""
+    if not os.path.isdir(stash_root):
+        return
+    for root, directories, _ in os.walk(stash_root):
+        if name in directories:
+            stash_directory = os.path.join(root, name)
+            output_directory = os.path.join(source_directory, os.path.relpath(stash_directory, stash_root))
+            # The sources the folder was in are gone
+            if not os.path.isdir(os.path.dirname(output_directory)):
+                shutil.rmtree(stash_directory)
+            else:
+                unstash(output_directory, stash_directory)
+        directories[:] = [d for d in directories if d != name]
+    shutil.rmtree(stash_root)
+
+
+def unstash(output_directory : str, stash_directory : str):
+    """Puts the contents of the folder back as they were, dropping whatever has been generated in their place"""
+    if os.path.isdir(output_directory):
+        _clear(output_directory)
+    _move_contents(stash_directory, output_directory)
+    os.rmdir(stash_directory)
+
+
+def _is_same_file(old_path : str, new_path : str) -> bool:
+    return os.path.getsize(old_path) == os.path.getsize(new_path) and filecmp.cmp(old_path, new_path, shallow=False)
+
+
+def sync(output_directory : str, stash_directory : str, report : SyncReport = None) -> SyncReport:
+    """
+    Moves back the files of the stash that are identical to the ones generated in their place,
+    and the .meta files of the files and folders that are still there, then deletes the stash.
+    If nothing has been generated in the folder, it is no longer needed, so it is deleted along with its .meta.
+    """
+    report = report or SyncReport()
+
+    if not os.path.isdir(output_directory) or len(os.listdir(output_directory)) == 0:
+        for root, _, files in os.walk(stash_directory):
+            relative_root = os.path.relpath(root, stash_directory)
+            report.deleted += [os.path.normpath(os.path.join(output_directory, relative_root, file))
+                for file in files if not file.endswith(META_EXTENSION)]
+        shutil.rmtree(stash_directory)
+        if os.path.isdir(output_directory):
+            os.rmdir(output_directory)
+        meta_path = output_directory + META_EXTENSION
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        return report
+
+    new_paths = set()
+    for root, directories, files in os.walk(output_directory):
+        relative_root = os.path.relpath(root, output_directory)
+        for name in directories + files:
+            new_paths.add(os.path.normpath(os.path.join(relative_root, name)))
+        for file in files:
+            if file.endswith(META_EXTENSION):
+                continue
+            new_path = os.path.join(root, file)
+            old_path = os.path.join(stash_directory, relative_root, file)
+            if not os.path.isfile(old_path):
+                report.added.append(new_path)
+            elif _is_same_file(old_path, new_path):
+                _move(old_path, new_path)
+                report.unchanged.append(new_path)
+            else:
+                report.changed.append(new_path)
+
+    for root, _, files in os.walk(stash_directory):
+        relative_root = os.path.relpath(root, stash_directory)
+        for file in files:
+            relative_path = os.path.normpath(os.path.join(relative_root, file))
+            if file.endswith(META_EXTENSION):
+                # The meta of a file or a folder that is still there, unless Kari has written one itself
+                if relative_path[:-len(META_EXTENSION)] in new_paths and relative_path not in new_paths:
+                    _move(os.path.join(root, file), os.path.join(output_directory, relative_path))
+            elif relative_path not in new_paths:
+                report.deleted.append(os.path.join(output_directory, relative_path))
+
+    shutil.rmtree(stash_directory)
+    return report
+
+
+COMBINED_FILE_NAME = "Generated.cs"
+USING_REGEX = re.compile(r'using\s+(?:static\s+)?[\w.]+(?:\s*=\s*[\w.<>, ]+)?\s*;')
+# What cannot be moved into another file: directives that have to come first in a file, assembly attributes
+# that have to come before the namespaces, file scoped namespaces, and the types that Unity needs to find by file name.
+UNCOMBINABLE_REGEX = re.compile(
+    r'^\s*(?:#define|#undef|extern\s+alias|global\s+using|\[\s*assembly\s*:|namespace\s+[\w.]+\s*;)'
+    + r'|:\s*(?:UnityEngine\.)?(?:MonoBehaviour|ScriptableObject)\b',
+    re.MULTILINE)
+
+
+def _split_usings(text : str) -> 'tuple[tuple[str], str]':
+    """The using directives at the top of the file and the rest of it, None if they cannot be told apart"""
+    usings = []
+    lines = text.splitlines(keepends=True)
+    for index, line in enumerate(lines):
+        line = line.strip()
+        if not line or line.startswith("//") or line.startswith("#pragma") or line.startswith("#nullable"):
+            continue
+        if USING_REGEX.fullmatch(line):
+            usings.append(line)
+            lines[index] = ""
+            continue
+        if line.startswith("using ") or line.startswith("#"):
+            return None
+        break
+    return tuple(sorted(set(usings), key=lambda using: using.rstrip(";"))), "".join(lines)
+
+
+def _get_combined_file_name(usings : 'tuple[str]', file_name : str) -> str:
+    # Named after the usings, even if there is a single group, so that a group appearing does not rename the others,
+    # which would give them new .meta files
+    import hashlib
+    suffix = hashlib.sha1("\n".join(usings).encode('utf-8')).hexdigest()[:8]
+    name, extension = os.path.splitext(file_name)
+    return f"{name}.{suffix}{extension}"
+
+
+def combine_sources(directory : str, file_name : str = COMBINED_FILE_NAME) -> 'tuple[int, list[str]]':
+    """
+    Combines the C# files under the folder with the same using directives into a file at its root, e.g. `Generated.<hash>.cs`.
+    The files with the same usings mean the same thing when combined, the rest could become ambiguous.
+    The usings go at the top, then the files in the order of their paths, so that the same files always give the same contents.
+    The files that cannot be combined safely are left as they are, and so are the groups whose file would overwrite one of them.
+    Returns the number of files combined and the paths of those left.
+    """
+    sources = []
+    for root, _, files in os.walk(directory):
+        for file in files:
+            if file.endswith(".cs"):
+                path = os.path.join(root, file)
+                sources.append((os.path.relpath(path, directory).replace(os.sep, '/'), path))
+    sources.sort()
+
+    # usings -> (the paths of the files, the sections)
+    groups : 'dict[tuple[str], tuple[list[str], list[str]]]' = {}
+    left = []
+    for relative_path, path in sources:
+        with open(path, 'r', encoding='utf-8-sig') as file:
+            text = file.read()
+        split = None if UNCOMBINABLE_REGEX.search(text) else _split_usings(text)
+        if split is None:
+            left.append(path)
+            continue
+        usings, body = split
+        if not body.endswith("\n"):
+            body += "\n"
+        section = f"// {relative_path}\n{body}"
+        # The pragmas apply to the end of the file, so they are undone after every section
+        if "#pragma warning" in body:
+            section += "#pragma warning restore\n"
+        if "#nullable" in body:
+            section += "#nullable restore\n"
+        paths, sections = groups.setdefault(usings, ([], []))
+        paths.append(path)
+        sections.append(section)
+
+    combined_files : 'dict[str, tuple[tuple[str], list[str]]]' = {}
+    combined_paths = []
+    left_paths = { os.path.normcase(path) for path in left }
+    for usings, (paths, sections) in groups.items():
+        combined_path = os.path.join(directory, _get_combined_file_name(usings, file_name))
+        if os.path.normcase(combined_path) in left_paths:
+            left += paths
+            continue
+        combined_files[combined_path] = (usings, sections)
+        combined_paths += paths
+
+    if len(combined_paths) == 0:
+        return 0, left
+
+    for path in combined_paths:
+        os.remove(path)
+    # The folders emptied by the files being combined
+    for root, _, _ in sorted(os.walk(directory), key=lambda item: len(item[0]), reverse=True):
+        if root != directory and not os.listdir(root):
+            os.rmdir(root)
+
+    for combined_path, (usings, sections) in combined_files.items():
+        with open(combined_path, 'w', encoding='utf-8', newline='\n') as file:
+            file.write("// Generated by Kari, combined into a single file by baton\n")
+            for using in usings:
+                file.write(using + "\n")
+            for section in sections:
+                file.write("\n" + section)
+    return len(combined_paths), left
@@ -0,0 +1,145 @@
+"""
+Tells which paths .gitattributes puts under LFS (`filter=lfs`), with all of its patterns compiled into a single regex.
+The compiled regex is cached in .git/baton, keyed by the sha of the .gitattributes blob, so it is only rebuilt when the file changes.
+Only the .gitattributes at the root of the repository is considered.
+"""
+
+import os, re, json
+
+LFS_ATTRIBUTES_CACHE_VERSION = 1
+
+
+def translate_pattern(pattern : str) -> str:
+    """
+    Translates a .gitattributes pattern into a regex matching the whole path.
+    The rules are those of .gitignore: a pattern without a slash matches the name at any depth,
+    a pattern with a slash is relative to the root, `**` matches any number of folders.
+    """
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    result = []
+    i = 0
+    length = len(pattern)
+    while i < length:
+        c = pattern[i]
+        if pattern.startswith('**/', i) and (i == 0 or pattern[i - 1] == '/'):
+            result.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == length:
+            result.append('/.*')
+            i += 3
+        elif c == '*':
+            result.append('[^/]*')
+            i += 1
+        elif c == '?':
+            result.append('[^/]')
+            i += 1
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                result.append(re.escape(c))
+                i += 1
+                continue
+            contents = pattern[i + 1:end]
+            if contents[0] == '!':
+                contents = '^' + contents[1:]
+            result.append('[' + contents.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif c == '\\' and i + 1 < length:
+            result.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            result.append(re.escape(c))
+            i += 1
+
+    regex = ''.join(result)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return regex
+
+
+def parse_filter_patterns(text : str) -> 'list[tuple[str, bool]]':
+    """Returns (pattern, is_lfs) for every line that sets or unsets the `filter` attribute, in file order"""
+    patterns = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split()
+        pattern, attributes = fields[0], fields[1:]
+
+        # Negative patterns are forbidden, patterns for folders do not apply to the files in them
+        if pattern.startswith('!') or pattern.endswith('/'):
+            continue
+
+        for attribute in attributes:
+            if attribute.startswith('filter='):
+                patterns.append((pattern, attribute == 'filter=lfs'))
+            elif attribute in ('-filter', '!filter'):
+                patterns.append((pattern, False))
+    return patterns
+
+
+class LfsMatcher:
+    """
+    The later lines of .gitattributes override the earlier ones, so the patterns are joined in reverse order:
+    the first alternative that matches is the last line that applies, and its group tells whether it sets lfs.
+    """
+
+    def __init__(self, source : str, values : 'list[bool]'):
+        self.source = source
+        self.values = values
+        self.regex  = re.compile(source) if source else None
+
+    @staticmethod
+    def build(text : str) -> 'LfsMatcher':
+        patterns = parse_filter_patterns(text)
+        alternatives = []
+        values = []
+        for index, (pattern, is_lfs) in enumerate(reversed(patterns)):
+            alternatives.append(f'(?P<p{index}>{translate_pattern(pattern)})\\Z')
+            values.append(is_lfs)
+        return LfsMatcher('|'.join(alternatives), values)
+
+    def is_lfs(self, path : str) -> bool:
+        if self.regex is None:
+            return False
+        match = self.regex.match(path)
+        if match is None:
+            return False
+        return self.values[int(match.lastgroup[1:])]
+
+
+# The matchers built by this process, by the sha of .gitattributes, which keeps them around in the daemon
+_matchers : 'dict[str, LfsMatcher]' = {}
+
+def get_lfs_matcher(cache_directory : str, attributes_sha : str, read_attributes) -> LfsMatcher:
+    """
+    Returns the matcher for the .gitattributes blob with the given sha, building it with the text
+    returned by `read_attributes()` only if it is neither in memory nor in the cache file.
+    """
+    matcher = _matchers.get(attributes_sha)
+    if matcher is not None:
+        return matcher
+
+    cache_path = os.path.join(cache_directory, "lfs_attributes.json")
+    try:
+        with open(cache_path, 'r') as file:
+            data = json.load(file)
+        if data["version"] == LFS_ATTRIBUTES_CACHE_VERSION and data["sha"] == attributes_sha:
+            matcher = LfsMatcher(data["source"], data["values"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    if matcher is None:
+        matcher = LfsMatcher.build(read_attributes())
+        os.makedirs(cache_directory, exist_ok=True)
+        temp_path = cache_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ "version": LFS_ATTRIBUTES_CACHE_VERSION, "sha": attributes_sha,
+                "source": matcher.source, "values": matcher.values }, file)
+        os.replace(temp_path, cache_path)
+
+    _matchers[attributes_sha] = matcher
+    return matcher
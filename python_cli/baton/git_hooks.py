@@ -1,26 +1,473 @@
-from git import Repo
-from git.diff import Diff, DiffIndex
-import os
+import os, subprocess, re, fnmatch
+from baton.git_objects import (CatFile, TreeEntry, write_index_tree,
+    batch_check, batch_read, parse_lfs_pointer_size, LFS_POINTER_MAX_SIZE)
 
 OK_EXIT_CODE = 0
 META_DISCREPANCY_EXIT_CODE = 1
 FILE_TOO_LARGE_EXIT_CODE = 2
-FILE_SIZE_LIMIT_BYTES = 1024 * 1024 * 100
+DUPLICATE_GUID_EXIT_CODE = 3
+NOT_IN_LFS_EXIT_CODE = 4
+FILE_SIZE_LIMIT_BYTES = 1024 * 1024 * 100           # GitHub rejects blobs over 100MB
+LFS_FILE_SIZE_LIMIT_BYTES = 1024 * 1024 * 1024 * 2  # GitHub rejects LFS objects over 2GB
+
+# Staged blobs at least this large that no LFS pattern covers are checked for being binary
+LFS_BINARY_SIZE_THRESHOLD_BYTES = 1024 * 1024
+# Git considers a file binary if there is a NUL in this many first bytes
+BINARY_SNIFF_BYTES = 8000
+
+# Overrides of the size limit per path pattern are read from the git config, as values of `<fnmatch pattern> <size>`, e.g.
+#   [baton]
+#       sizeLimit = Game/Assets/Audio/* 500m
+# The first match wins. The limit applies to the real size of the staged file, which for files tracked by LFS is the size of the LFS object.
+SIZE_LIMIT_CONFIG_KEY = 'baton.sizeLimit'
+# The config checked in at the root of the repository, with the limits shared by everyone, is read after the git config
+SHARED_CONFIG_FILE_NAME = '.gitconfig'
+SIZE_SUFFIXES = { 'k': 1024, 'm': 1024 * 1024, 'g': 1024 * 1024 * 1024 }
+
+UNITY_ASSETS_PREFIX = 'Game/Assets'
 
 
 def update_submodules(project_directory):
     """Updates the submodules"""
+    from git import Repo
     repo = Repo(project_directory)
     repo.submodule_update()
 
 
-def precommit(project_directory):
-    repo = Repo(project_directory)
+# Hidden Assets: https://docs.unity3d.com/Manual/SpecialFolders.html
+def is_ignored_by_unity(path : str) -> bool:
+    parts = path.split('/')
+    for p in parts:
+        if len(p) < 1: continue
+        if p[0] == '.':  return True
+        if p[-1] == '~': return True
+        if p == 'cvs':   return True
+        if os.path.splitext(p)[1] == '.tmp': return True
+    return False
+
+def is_in_assets(path : str) -> bool:
+    return path.startswith(UNITY_ASSETS_PREFIX)
+
+def is_meta(file : str) -> bool:
+    return file.endswith('.meta') \
+        and len(file) > 5  # simply '.meta' is still a valid file?
+
+def strip_meta(filename : str) -> str:
+    return filename[:-5]
+
+
+class StagedChange:
+    """A single record of `git diff --cached --raw`, i.e. a change from HEAD to the index"""
+    def __init__(self, status : str, path : str, old_path : str, mode : str, sha : str):
+        self.status   = status    # A, D, M, R, C, T, U or X, without the similarity score
+        self.path     = path      # the path in the index
+        self.old_path = old_path  # the path in HEAD, differs from `path` only for renames and copies
+        self.mode     = mode      # the mode in the index, 160000 stands for a submodule
+        self.sha      = sha       # the sha of the blob in the index
+
+    def is_submodule(self) -> bool:
+        return self.mode == '160000'
+
+    def __repr__(self):
+        return f"StagedChange({self.status}, {self.path}, {self.old_path}, {self.mode}, {self.sha})"
+
+
+STREAM_CHUNK_SIZE = 1 << 16
+
+def _iter_nul_separated(stream):
+    """Yields NUL-terminated tokens from a binary stream without reading it all at once"""
+    remainder = b''
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        tokens = (remainder + chunk).split(b'\0')
+        remainder = tokens.pop()
+        yield from tokens
+    if remainder:
+        yield remainder
+
+
+def iter_staged_changes(project_directory : str):
+    """
+    Streams the changes between HEAD and the index, parsing `git diff --cached --raw -z` as it is produced.
+    The output format is `:old_mode new_mode old_sha new_sha status NUL path NUL`,
+    with a second path following for renames and copies.
+    """
+    process = subprocess.Popen(
+        ["git", "diff", "--cached", "--raw", "-z", "-M", "--no-abbrev", "--no-color", "HEAD"],
+        cwd=project_directory, stdout=subprocess.PIPE)
+
+    try:
+        tokens = _iter_nul_separated(process.stdout)
+        for header in tokens:
+            # :100644 100644 <old sha> <new sha> <status>
+            fields = header.decode('ascii').split(' ')
+            mode   = fields[1]
+            sha    = fields[3]
+            status = fields[4][0]
+            path   = next(tokens).decode('utf-8', 'surrogateescape')
+
+            if status == 'R' or status == 'C':
+                old_path = path
+                path = next(tokens).decode('utf-8', 'surrogateescape')
+            else:
+                old_path = path
+
+            yield StagedChange(status, path, old_path, mode, sha)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, process.args)
+
+
+META_PAIRING_CACHE_HEADER = 'baton meta pairing cache v2'
+META_PAIRING_CACHE_MAX_ENTRIES = 1 << 16
+# Stands for a directory missing from HEAD or from the index in the keys of the cache
+NO_TREE = '-'
+
+def get_baton_git_directory(project_directory : str) -> str:
+    """The directory within .git where baton keeps its caches"""
+    return os.path.join(project_directory, ".git", "baton")
+
+
+class MetaPairingCache:
+    """
+    The set of the pairs of shas (the tree in HEAD, the tree in the index) of the Assets directories
+    whose staged changes have passed the meta pairing check.
+    The two shas fix the whole contents of the directory before and after the changes,
+    so a pair that has passed once never needs to be looked at again, e.g. when a commit is retried.
+    """
+
+    def __init__(self, file_path : str):
+        self.file_path = file_path
+        self.keys : 'dict[str, None]' = {}  # a dict to keep the insertion order
+        self.is_dirty = False
+
+    @staticmethod
+    def load(file_path : str) -> 'MetaPairingCache':
+        cache = MetaPairingCache(file_path)
+        try:
+            with open(file_path, 'r') as file:
+                if file.readline().rstrip('\n') == META_PAIRING_CACHE_HEADER:
+                    cache.keys = dict.fromkeys(line.rstrip('\n') for line in file)
+        except OSError:
+            pass
+        return cache
+
+    @staticmethod
+    def _get_key(head_sha : str, index_sha : str) -> str:
+        return f"{head_sha or NO_TREE} {index_sha or NO_TREE}"
+
+    def contains(self, head_sha : str, index_sha : str) -> bool:
+        return self._get_key(head_sha, index_sha) in self.keys
+
+    def add(self, head_sha : str, index_sha : str):
+        key = self._get_key(head_sha, index_sha)
+        if key not in self.keys:
+            self.keys[key] = None
+            self.is_dirty = True
+
+    def save(self):
+        if not self.is_dirty:
+            return
+
+        # Drop the oldest entries, which are the least likely to come up again
+        keys = list(self.keys)
+        if len(keys) > META_PAIRING_CACHE_MAX_ENTRIES:
+            keys = keys[-META_PAIRING_CACHE_MAX_ENTRIES:]
+
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(META_PAIRING_CACHE_HEADER + '\n')
+            for key in keys:
+                file.write(key + '\n')
+        os.replace(temp_path, self.file_path)
+        self.is_dirty = False
+
+
+def check_changed_files_pairing(directory_path : str, added : 'set[str]', deleted : 'set[str]', has_added_files) -> bool:
+    """
+    Checks that the files added to a single directory come with their metas and that the deleted ones go with them,
+    printing the discrepancies. `added` and `deleted` are the names of the files, the ones ignored by Unity left out.
+    `has_added_files(name)` tells whether files have been added to the subdirectory, which a new folder meta needs.
+    """
+    ok = True
+
+    # New metas and files
+    for name in sorted(added):
+        path = directory_path + '/' + name
+        if is_meta(name):
+            stripped = strip_meta(name)
+            if stripped in added and not is_meta(stripped):
+                continue
+
+            # Check the empty directory case
+            if os.path.splitext(stripped)[1] == '':
+                if has_added_files(stripped):
+                    continue
+                # TODO: create the .keep file automatically?
+                print(f"Detected redundant meta, potentially for an empty directory {strip_meta(path)}")
+                print("To fix, create a file inside of it, like an empty '.keep' file")
+            else:
+                print("Redundant meta: " + path)
+            ok = False
+
+        elif name + '.meta' not in added:
+            print("Missing meta for: " + path)
+            ok = False
 
+    # Old metas and files
+    for name in sorted(deleted):
+        path = directory_path + '/' + name
+        if is_meta(name):
+            stripped = strip_meta(name)
+            if stripped in deleted and not is_meta(stripped):
+                continue
+            print("Missing meta: " + path)
+            ok = False
+
+        elif name + '.meta' not in deleted:
+            print("Redundant meta for deleted file: " + path)
+            ok = False
+
+    return ok
+
+
+def _split_tree_entries(entries : 'list[TreeEntry]') -> 'tuple[dict[str, str], dict[str, str]]':
+    """Maps the names of the files (including symlinks and submodules) and of the subdirectories to their shas"""
+    files = {}
+    directories = {}
+    for entry in entries or ():
+        if entry.is_tree():
+            directories[entry.name] = entry.sha
+        else:
+            files[entry.name] = entry.sha
+    return files, directories
+
+
+def check_index_pairing(project_directory : str, cat_file : CatFile, cache : MetaPairingCache) -> bool:
+    """
+    Checks the meta pairing of the files added and deleted in Assets, comparing the trees of HEAD and of the index.
+    Only the directories whose tree differs between the two are read, and those whose pair of trees has passed before are skipped too,
+    so the cost depends on the amount of directories changed, not on the size of Assets.
+    """
+    try:
+        root_tree = write_index_tree(project_directory)
+    except subprocess.CalledProcessError as error:
+        print(f"Could not check the meta files, since the index cannot be written out as a tree: {error.output}")
+        return False
+
+    def get_tree_sha(name : str) -> str:
+        sha, type, _ = cat_file.read(name)
+        return sha if type == 'tree' else None
+
+    def read_entries(sha : str) -> 'list[TreeEntry]':
+        return cat_file.read_tree(sha) if sha else []
+
+    def check(directory_path : str, head_sha : str, index_sha : str) -> bool:
+        if cache.contains(head_sha, index_sha):
+            return True
+        head_files, head_directories = _split_tree_entries(read_entries(head_sha))
+        index_files, index_directories = _split_tree_entries(read_entries(index_sha))
+
+        # Modified files keep their metas, so only the added and the deleted ones matter
+        added = set(name for name in index_files if name not in head_files and not is_ignored_by_unity(name))
+        deleted = set(name for name in head_files if name not in index_files and not is_ignored_by_unity(name))
+
+        def has_added_files(name : str) -> bool:
+            # Changes to the files Unity ignores count as well, since the folder is not empty
+            head_subtree, index_subtree = head_directories.get(name), index_directories.get(name)
+            if head_subtree == index_subtree:
+                return False
+            subtree_head_files, _ = _split_tree_entries(read_entries(head_subtree))
+            subtree_index_files, _ = _split_tree_entries(read_entries(index_subtree))
+            path = directory_path + '/' + name
+            return any(file not in subtree_head_files for file in subtree_index_files) \
+                or any(is_ignored_by_unity(path + '/' + file) for file in subtree_head_files if file not in subtree_index_files)
+
+        ok = check_changed_files_pairing(directory_path, added, deleted, has_added_files)
+
+        for name in sorted(set(head_directories).union(index_directories)):
+            if is_ignored_by_unity(name):
+                continue
+            head_subtree, index_subtree = head_directories.get(name), index_directories.get(name)
+            # Directories identical to the ones in HEAD have no staged changes
+            if head_subtree == index_subtree:
+                continue
+            if not check(directory_path + '/' + name, head_subtree, index_subtree):
+                ok = False
+
+        if ok:
+            cache.add(head_sha, index_sha)
+        return ok
+
+    head_tree = get_tree_sha(f"HEAD:{UNITY_ASSETS_PREFIX}")
+    index_tree = get_tree_sha(f"{root_tree}:{UNITY_ASSETS_PREFIX}")
+    if head_tree == index_tree:
+        return True
+    return check(UNITY_ASSETS_PREFIX, head_tree, index_tree)
+
+
+def format_size(size_bytes : int) -> str:
+    return f'{size_bytes / (1024 * 1024):.1f}MB'
+
+
+def compile_file_size_limits(file_size_limits : 'list[tuple[str, int]]'):
+    """Returns a function mapping (path, is_lfs) to the size limit that applies to the file."""
+    compiled = [(re.compile(fnmatch.translate(pattern)), limit) for pattern, limit in file_size_limits]
+
+    def get_limit(path : str, is_lfs : bool) -> int:
+        for regex, limit in compiled:
+            if regex.match(path):
+                return limit
+        return LFS_FILE_SIZE_LIMIT_BYTES if is_lfs else FILE_SIZE_LIMIT_BYTES
+
+    return get_limit
+
+
+def parse_size(text : str) -> int:
+    """Parses a size in bytes, with an optional k, m or g suffix like in the git config. Raises ValueError if it is not one."""
+    text = text.strip().lower()
+    multiplier = SIZE_SUFFIXES.get(text[-1:], 1)
+    if multiplier != 1:
+        text = text[:-1]
+    return int(text) * multiplier
+
+
+def load_file_size_limits(project_directory : str) -> 'list[tuple[str, int]]':
+    """
+    Reads the overrides of the size limit, as (pattern, limit in bytes), from the `baton.sizeLimit` values of the git config,
+    then from the config checked in at the root of the repository. The malformed values are reported and skipped.
+    """
+    limits = []
+    for config in ([], ["-f", SHARED_CONFIG_FILE_NAME]):
+        # Fails if the key is not set or the file does not exist
+        result = subprocess.run(["git", "config"] + config + ["--get-all", SIZE_LIMIT_CONFIG_KEY],
+            cwd=project_directory, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode != 0:
+            continue
+        for value in result.stdout.decode('utf-8').splitlines():
+            pattern, _, size = value.strip().rpartition(' ')
+            try:
+                if pattern == '':
+                    raise ValueError()
+                limits.append((pattern.strip(), parse_size(size)))
+            except ValueError:
+                print(f"Ignoring `{SIZE_LIMIT_CONFIG_KEY} = {value}`, which is not of the form `<pattern> <size>`")
+    return limits
+
+
+def get_staged_file_sizes(project_directory : str, shas : 'list[str]') -> 'dict[str, tuple[int, bool]]':
+    """
+    Maps the blob shas to (size, is_lfs), resolving all sizes with a single batched lookup.
+    Blobs small enough to be LFS pointers are read in a second batch, and if they are pointers,
+    the size of the object they point to is reported instead.
+    """
+    sizes = {}
+    possible_pointers = []
+    for sha, (type, size) in batch_check(project_directory, shas).items():
+        sizes[sha] = (size, False)
+        if size <= LFS_POINTER_MAX_SIZE:
+            possible_pointers.append(sha)
+
+    for sha, contents in batch_read(project_directory, possible_pointers).items():
+        lfs_size = parse_lfs_pointer_size(contents)
+        if lfs_size is not None:
+            sizes[sha] = (lfs_size, True)
+
+    return sizes
+
+
+def check_staged_guids(project_directory : str, staged_metas : 'list[StagedChange]', removed_paths : 'set[str]') -> bool:
+    """
+    Checks that the GUIDs of the staged .meta files are not used by any other .meta file, printing the duplicates.
+    The staged GUIDs are read from the index in one batch, and compared against the persisted GUID index of the workspace,
+    which is brought up to date first, only reading the .meta files whose size or modification time has changed.
+    """
+    if len(staged_metas) == 0:
+        return True
+
+    from baton.guid_index import load_updated_guid_index, read_guid_from_bytes
+
+    contents = batch_read(project_directory, [change.sha for change in staged_metas])
+    staged_guids = { change.path: read_guid_from_bytes(contents.get(change.sha, b'')) for change in staged_metas }
+
+    # Renamed, deleted and new .meta files would otherwise be reported wrong or missed
+    index = load_updated_guid_index(project_directory, os.path.join(project_directory, UNITY_ASSETS_PREFIX))
+
+    staged_paths_by_guid : 'dict[str, list[str]]' = {}
+    for path, guid in staged_guids.items():
+        if guid is not None:
+            staged_paths_by_guid.setdefault(guid, []).append(path)
+
+    ok = True
+    for guid, paths in sorted(staged_paths_by_guid.items()):
+        # The staged .meta files count with their staged GUIDs, and the removed ones do not count at all
+        other_paths = [path for path in index.get_paths(guid) if path not in staged_guids and path not in removed_paths]
+        all_paths = sorted(set(paths).union(other_paths))
+        if len(all_paths) > 1:
+            print(f"Duplicate guid {guid} in: " + ", ".join(all_paths))
+            ok = False
+    return ok
+
+
+def check_lfs_tracking(project_directory : str, changes : 'list[StagedChange]',
+    sizes : 'dict[str, tuple[int, bool]]', cat_file : CatFile) -> bool:
+    """
+    Checks that the staged files matching an LFS pattern of .gitattributes have actually gone through the LFS filter,
+    and that the large binary files match an LFS pattern, printing the offending files.
+    """
+    from baton.git_attributes import get_lfs_matcher
+
+    # The staged version of .gitattributes is the one that is going to be committed
+    attributes_sha, _, attributes = cat_file.read(':.gitattributes')
+    if attributes_sha is None:
+        return True
+    matcher = get_lfs_matcher(get_baton_git_directory(project_directory), attributes_sha,
+        lambda: attributes.decode('utf-8', 'replace'))
+
+    ok = True
+    for change in changes:
+        if change.sha not in sizes:
+            continue
+        size, is_lfs = sizes[change.sha]
+        if is_lfs:
+            continue
+
+        if matcher.is_lfs(change.path):
+            print(f"{change.path} should be stored in LFS, but is staged as a regular blob. "
+                + f"Make sure git-lfs is installed (`git lfs install`) and restage it with `git add --renormalize {change.path}`")
+            ok = False
+
+        elif size >= LFS_BINARY_SIZE_THRESHOLD_BYTES:
+            if b'\0' in cat_file.read_head(change.sha, BINARY_SNIFF_BYTES):
+                print(f"{change.path} is a {format_size(size)} binary file not covered by any LFS pattern in .gitattributes. "
+                    + "Track it with `git lfs track`")
+                ok = False
+
+    return ok
+
+
+def load_meta_pairing_cache(project_directory : str) -> MetaPairingCache:
+    return MetaPairingCache.load(os.path.join(get_baton_git_directory(project_directory), "meta_pairing_cache"))
+
+
+def precommit(project_directory, file_size_limits : 'list[tuple[str, int]]' = None,
+    cat_file : CatFile = None, meta_pairing_cache : MetaPairingCache = None):
+    """
+    Validates the staged changes, returning one of the exit codes.
+    The size limits are read from the git config, unless given.
+    The daemon passes in the long lived `cat_file` and `meta_pairing_cache`, otherwise they are created for this call.
+    """
     # ---------------------------------------------------
     # The Algorithm:
     # ---------------------------------------------------
-    # 1. Staged files larger than 100MB are not allowed.
+    # 1. Staged files larger than 100MB (or the limit for their path in the `baton.sizeLimit` config) are not allowed.
+    #    For the files tracked by LFS, the size of the LFS object is what counts.
     #
     # 2. Every file in the index that:
     #       - is in the Game/Assets folder,
@@ -40,157 +487,94 @@ def precommit(project_directory):
     #  then we create a .gitkeep and add it to the commit (or just create it and throw error).
     #
     # 4. Every folder of the tree must have a corresponding .meta
+    #    (the hook does not enforce it, since it only looks at the staged files: run `baton meta audit`)
+    #
+    # 5. The GUIDs of the added and modified .meta files must not be used by other .meta files.
+    #
+    # 6. The added and modified files that .gitattributes puts under LFS must be staged as LFS pointers,
+    #    and large binary files must be covered by an LFS pattern.
     #
     # If anything goes wrong, fail, reverting the commit.
-
-    META : int = 0
-    FILE : int = 1
-
-    # Hidden Assets: https://docs.unity3d.com/Manual/SpecialFolders.html
-    # TODO: 
-    # The iteration and filtering I'm doing is awkward. 
-    # I'm sure there is a way to iterate the diff tree.
-    def is_ignored_by_unity(file : Diff) -> bool:
-        parts = file.a_path.split('/')
-        for p in parts:
-            if len(p) < 1: continue
-            if p[0] == '.':  return True
-            if p[-1] == '~': return True
-            if p == 'cvs':   return True
-            if os.path.splitext(p)[1] == '.tmp': return True
-        return False
-
-    def is_in_assets(file : Diff) -> bool:
-        return file.a_path.startswith('Game/Assets')
-
-    def is_meta(file : str) -> bool:
-        return file.endswith('.meta') \
-            and len(file) > 5  # simply '.meta' is still a valid file? 
-
-    def strip_meta(filename : str) -> str:
-        return filename[:-5]
-
-    def is_empty(collection) -> bool:
-        return len(collection) == 0
-
-    class IterHelper:
-        def __init__(self):
-            self.extra_files     : dict[str, int] = {}
-            self.undeleted_files : dict[str, int] = {}
-            self.changed_folders : dict[str, bool] = {}
-
-        def _update_with(self, dictionary, key, type):
-            if key in dictionary:
-                value = dictionary.get(key)
-                assert(value != type)
-                dictionary.pop(key)
-            else:
-                dictionary[key] = type
-
-        def update_add(self, path):
-            if is_meta(path):
-                stripped = strip_meta(path)
-                self._update_with(self.extra_files, stripped, META)
-                self._update_add_folder_of(os.path.dirname(stripped))
-            else:
-                self._update_with(self.extra_files, path, FILE)
-                self._update_add_folder_of(os.path.dirname(path))
-
-        def update_delete(self, path):
-            if is_meta(path):
-                stripped = strip_meta(path)
-                self._update_with(self.undeleted_files, stripped, META)
-            else:
-                self._update_with(self.undeleted_files, path, FILE)
-
-        def _update_add_folder_of(self, key):
-            self.changed_folders[key] = True
-
-        def has_added_folder_of(self, key):
-            return self.changed_folders.get(key)
-
-        def preupdate_and_check(self, file : Diff):
-            if is_in_assets(file):
-                if is_ignored_by_unity(file):
-                    self._update_add_folder_of(os.path.dirname(file.a_path))
-                    return False
-                return True
-            return False
-
-    index = repo.index
-    diff : DiffIndex = index.diff(repo.head.commit)
-    helper = IterHelper()
-
-    # 'D' stands for deleted, because it was added to the index and we're comparing the index to the commit
-    # which means that for new files, in order to get from the index to the latest commit we would need 
-    # to remove that new file, which is why 'D' gives new files while 'A' gives deleted files.
-    for file in diff.iter_change_type('D'):
-        if helper.preupdate_and_check(file):
-            helper.update_add(file.a_path)
-        
-    # Same thing for deleted
-    for file in diff.iter_change_type('A'):
-        if helper.preupdate_and_check(file):
-            helper.update_delete(file.a_path)
-
-    # Renaming = deleting the older one and adding a newer one
-    for file in diff.iter_change_type('R'):
-        if helper.preupdate_and_check(file):
-            helper.update_add(file.a_path)
-            helper.update_delete(file.b_path)
-
-
-    failed_added = False
-
-    # New metas and files
-    for file_path, type in helper.extra_files.items():
-        if type == META:
-            # Check the empty directory case
-            if os.path.splitext(file_path)[1] == '':
-                if not helper.has_added_folder_of(file_path):
-                    # TODO: create the .keep file automatically?
-                    print(f"Detected redundant meta, potentially for an empty directory {file_path}")
-                    print("To fix, create a file inside of it, like an empty '.keep' file")
-                    failed_added = True
-            else:
-                print("Redundant meta: " + file_path + ".meta")
-                failed_added = True
-        else:
-            print("Missing meta for: " + file_path)
-            failed_added = True
-
-
-    # Old metas and files
-    for file_path, type in helper.undeleted_files.items():
-        if type == META:
-            print("Missing meta: " + file_path + ".meta")
-        else:
-            print("Redundant meta for deleted file: " + file_path)
+    #
+    # The meta pairing (2 and 3) only applies to the files added and deleted by the commit, like the check on the diff used to:
+    # a file and its meta must be added together and deleted together, a folder meta may only be added along with files in the folder.
+    # It is found by comparing the trees of HEAD and of the index, only descending into the directories that differ.
+    # The pairs of trees that have passed are cached in .git/baton, so they are never revisited.
+    # A rename counts as a deletion of the old path and an addition of the new one, each in its own directory,
+    # whereas the check on the diff decided whether to count both by the new path alone:
+    # moving a file out of Assets or into a folder ignored by Unity without its meta now fails,
+    # and moving a file into Assets from outside of it together with its meta now passes.
+    # The staged changes are then read in a single pass over the raw diff, collecting the candidates for the size check,
+    # whose sizes are then looked up in one batch.
+
+    cache = meta_pairing_cache
+    if cache is None:
+        cache = load_meta_pairing_cache(project_directory)
+
+    owns_cat_file = cat_file is None
+    if owns_cat_file:
+        cat_file = CatFile(project_directory)
+
+    try:
+        return _check_staged_changes(project_directory, file_size_limits, cat_file, cache)
+    finally:
+        if owns_cat_file:
+            cat_file.close()
+
+
+def _check_staged_changes(project_directory : str, file_size_limits : 'list[tuple[str, int]]',
+    cat_file : CatFile, cache : MetaPairingCache) -> int:
+
+    is_pairing_ok = check_index_pairing(project_directory, cat_file, cache)
+    cache.save()
 
     # Fail the first check
-    if failed_added or not is_empty(helper.undeleted_files):
+    if not is_pairing_ok:
         print('fail: meta discrepancy')
         return META_DISCREPANCY_EXIT_CODE
 
+    # Added and modified files, in the order they came in
+    size_check_candidates : 'list[StagedChange]' = []
+    # The .meta files whose GUIDs have to be checked, and the paths that are gone from the index
+    staged_metas : 'list[StagedChange]' = []
+    removed_paths : 'set[str]' = set()
+
+    for change in iter_staged_changes(project_directory):
+        if (change.status == 'A' or change.status == 'M') and not change.is_submodule():
+            size_check_candidates.append(change)
+        if change.status in ('A', 'M', 'R', 'C') and is_in_assets(change.path) and is_meta(change.path):
+            staged_metas.append(change)
+        if change.status == 'D' or change.status == 'R':
+            removed_paths.add(change.old_path)
+
+    sizes = get_staged_file_sizes(project_directory, [change.sha for change in size_check_candidates])
+    if file_size_limits is None:
+        file_size_limits = load_file_size_limits(project_directory)
+    get_limit = compile_file_size_limits(file_size_limits)
     is_a_file_too_large = False
 
-    def is_file_too_large(file : Diff):
-        # This gives incorrect results for non-text files, which kind of defeats the purpose
-        # But not really. It works in a test repo for some reason.
-        return file.a_blob.size > FILE_SIZE_LIMIT_BYTES  # 100MB
-
-    for file in diff.iter_change_type('D'):
-        if is_file_too_large(file):
-            is_a_file_too_large = True
-            print(f'Added file {file.a_path} is over 100MB')
-
-    for file in diff.iter_change_type('M'):
-        if is_file_too_large(file):
-            is_a_file_too_large = True
-            print(f'Modified file {file.a_path} is over 100MB')
+    # The added files are reported before the modified ones
+    for status, description in (('A', 'Added'), ('M', 'Modified')):
+        for change in size_check_candidates:
+            if change.status != status or change.sha not in sizes:
+                continue
+            size, is_lfs = sizes[change.sha]
+            limit = get_limit(change.path, is_lfs)
+            if size > limit:
+                is_a_file_too_large = True
+                kind = 'LFS object of the file' if is_lfs else 'file'
+                print(f'{description} {kind} {change.path} is {format_size(size)}, which is over {format_size(limit)}')
 
     if is_a_file_too_large:
         print('fail: file too large')
         return FILE_TOO_LARGE_EXIT_CODE
 
-    return OK_EXIT_CODE
\ No newline at end of file
+    if not check_staged_guids(project_directory, staged_metas, removed_paths):
+        print('fail: duplicate guid')
+        return DUPLICATE_GUID_EXIT_CODE
+
+    if not check_lfs_tracking(project_directory, size_check_candidates, sizes, cat_file):
+        print('fail: files missing from LFS')
+        return NOT_IN_LFS_EXIT_CODE
+
+    return OK_EXIT_CODE
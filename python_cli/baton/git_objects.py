@@ -0,0 +1,189 @@
+"""Low level access to the git object database through long lived `git cat-file` processes."""
+
+import subprocess
+
+TREE_MODE = '40000'
+SUBMODULE_MODE = '160000'
+
+
+class TreeEntry:
+    def __init__(self, mode : str, name : str, sha : str):
+        self.mode = mode
+        self.name = name
+        self.sha  = sha
+
+    def is_tree(self) -> bool:
+        return self.mode == TREE_MODE
+
+    def __repr__(self):
+        return f"TreeEntry({self.mode}, {self.name}, {self.sha})"
+
+
+def parse_tree(data : bytes) -> 'list[TreeEntry]':
+    """Parses the binary representation of a tree object: `mode SP name NUL sha(20 bytes)`, repeated."""
+    entries = []
+    position = 0
+    length = len(data)
+    while position < length:
+        space = data.index(b' ', position)
+        nul   = data.index(b'\0', space)
+        mode  = data[position:space].decode('ascii')
+        name  = data[space + 1:nul].decode('utf-8', 'surrogateescape')
+        sha   = data[nul + 1:nul + 21].hex()
+        entries.append(TreeEntry(mode, name, sha))
+        position = nul + 21
+    return entries
+
+
+class CatFile:
+    """
+    Wraps a single `git cat-file --batch` process, which is kept alive for the lifetime of the object,
+    so that reading many objects costs a round trip through a pipe rather than a process each.
+    """
+
+    def __init__(self, project_directory : str):
+        self.project_directory = project_directory
+        self._process = None
+
+    def _get_process(self):
+        if self._process is None:
+            self._process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                cwd=self.project_directory, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        return self._process
+
+    def read(self, name : str) -> 'tuple[str, str, bytes]':
+        """Returns (sha, type, contents) of the object, or (None, None, None) if it does not exist.
+        `name` may be anything `git rev-parse` understands, e.g. `HEAD:Game/Assets`."""
+        process = self._get_process()
+        process.stdin.write(name.encode('utf-8') + b'\n')
+        process.stdin.flush()
+
+        # <sha> <type> <size> LF <contents> LF, or <name> missing LF
+        header = process.stdout.readline()
+        if not header:
+            raise RuntimeError(f"git cat-file exited unexpectedly while reading {name}")
+        fields = header.split()
+        if len(fields) != 3:
+            return None, None, None
+
+        size = int(fields[2])
+        contents = process.stdout.read(size)
+        process.stdout.read(1)
+        return fields[0].decode('ascii'), fields[1].decode('ascii'), contents
+
+    def read_head(self, name : str, count : int) -> bytes:
+        """
+        Returns up to `count` first bytes of the object, or None if it does not exist.
+        The rest goes through the pipe too, but is discarded a chunk at a time rather than kept in memory.
+        """
+        process = self._get_process()
+        process.stdin.write(name.encode('utf-8') + b'\n')
+        process.stdin.flush()
+
+        header = process.stdout.readline()
+        if not header:
+            raise RuntimeError(f"git cat-file exited unexpectedly while reading {name}")
+        fields = header.split()
+        if len(fields) != 3:
+            return None
+
+        size = int(fields[2])
+        contents = process.stdout.read(min(count, size))
+        remaining = size - len(contents) + 1
+        while remaining > 0:
+            remaining -= len(process.stdout.read(min(remaining, 1 << 20)))
+        return contents
+
+    def read_tree(self, name : str) -> 'list[TreeEntry]':
+        """Returns the entries of the tree, or None if it does not exist or is not a tree."""
+        _, type, contents = self.read(name)
+        if type != 'tree':
+            return None
+        return parse_tree(contents)
+
+    def close(self):
+        if self._process is not None:
+            self._process.stdin.close()
+            self._process.stdout.close()
+            self._process.wait()
+            self._process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def write_index_tree(project_directory : str) -> str:
+    """
+    Writes the index out as tree objects, returning the sha of the root tree.
+    This is cheap thanks to the cache-tree extension of the index, and the objects would be written by the commit anyway.
+    Raises CalledProcessError, with the error of git as the output, if it cannot be done, e.g. if there are unmerged entries.
+    """
+    result = subprocess.run(["git", "write-tree"], cwd=project_directory, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stderr.decode('utf-8', 'replace').strip())
+    return result.stdout.decode('ascii').strip()
+
+
+def batch_check(project_directory : str, shas : 'list[str]') -> 'dict[str, tuple[str, int]]':
+    """
+    Looks up the type and size of all of the given objects with a single `git cat-file --batch-check`.
+    Objects that do not exist are left out of the result.
+    """
+    if len(shas) == 0:
+        return {}
+
+    result = subprocess.run(
+        ["git", "cat-file", "--batch-check"],
+        cwd=project_directory, input="\n".join(shas).encode('ascii') + b'\n', stdout=subprocess.PIPE, check=True)
+
+    # <sha> <type> <size> LF, or <sha> missing LF
+    infos = {}
+    for line in result.stdout.splitlines():
+        fields = line.decode('ascii').split(' ')
+        if len(fields) == 3:
+            infos[fields[0]] = (fields[1], int(fields[2]))
+    return infos
+
+
+def batch_read(project_directory : str, shas : 'list[str]') -> 'dict[str, bytes]':
+    """Reads the contents of all of the given objects with a single `git cat-file --batch`."""
+    if len(shas) == 0:
+        return {}
+
+    result = subprocess.run(
+        ["git", "cat-file", "--batch"],
+        cwd=project_directory, input="\n".join(shas).encode('ascii') + b'\n', stdout=subprocess.PIPE, check=True)
+
+    output = result.stdout
+    contents = {}
+    position = 0
+    while position < len(output):
+        header_end = output.index(b'\n', position)
+        fields = output[position:header_end].split()
+        position = header_end + 1
+        if len(fields) != 3:
+            continue
+        size = int(fields[2])
+        contents[fields[0].decode('ascii')] = output[position:position + size]
+        position += size + 1
+    return contents
+
+
+LFS_POINTER_MAX_SIZE = 1024
+LFS_POINTER_VERSION_LINE = b'version https://git-lfs.github.com/spec/v1\n'
+
+def parse_lfs_pointer_size(contents : bytes) -> int:
+    """Returns the size of the object an LFS pointer file points to, or None if the contents are not a pointer."""
+    if len(contents) > LFS_POINTER_MAX_SIZE or not contents.startswith(LFS_POINTER_VERSION_LINE):
+        return None
+    for line in contents.splitlines():
+        if line.startswith(b'size '):
+            try:
+                return int(line[5:])
+            except ValueError:
+                return None
+    return None
@@ -0,0 +1,131 @@
+"""
+An index of the GUIDs of all .meta files in Assets, both ways: path -> GUID and GUID -> paths.
+It is persisted in .git/baton, and updating it only reads the .meta files whose size or modification time has changed.
+"""
+
+import os, re, json, mmap
+from baton.git_hooks import get_baton_git_directory, is_ignored_by_unity, is_meta
+
+GUID_INDEX_VERSION = 1
+GUID_REGEX = re.compile(rb'^guid:\s*([0-9a-fA-F]{32})', re.MULTILINE)
+GUID_QUERY_REGEX = re.compile(r'^[0-9a-fA-F]{32}$')
+
+
+def read_guid_from_bytes(contents) -> str:
+    """Finds the `guid: ...` line, which Unity puts right after the `fileFormatVersion` line"""
+    match = GUID_REGEX.search(contents)
+    if match is None:
+        return None
+    return match[1].decode('ascii').lower()
+
+
+def read_guid(file_path : str) -> str:
+    with open(file_path, 'rb') as file:
+        try:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                return read_guid_from_bytes(contents)
+        except ValueError:
+            # Empty files cannot be mapped
+            return None
+
+
+def is_guid(query : str) -> bool:
+    return GUID_QUERY_REGEX.match(query) is not None
+
+
+class GuidIndex:
+    def __init__(self, file_path : str):
+        self.file_path = file_path
+        # path relative to the project, separated with '/' -> (mtime_ns, size, guid)
+        self.entries : 'dict[str, tuple[int, int, str]]' = {}
+        self._paths_by_guid : 'dict[str, list[str]]' = None
+        self.is_dirty = False
+
+    @staticmethod
+    def load(file_path : str) -> 'GuidIndex':
+        index = GuidIndex(file_path)
+        try:
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+            if data.get("version") == GUID_INDEX_VERSION:
+                index.entries = { path: tuple(entry) for path, entry in data["entries"].items() }
+        except (OSError, ValueError, KeyError):
+            pass
+        return index
+
+    def exists(self) -> bool:
+        return os.path.exists(self.file_path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ "version": GUID_INDEX_VERSION, "entries": self.entries }, file)
+        os.replace(temp_path, self.file_path)
+        self.is_dirty = False
+
+    def update(self, project_directory : str, assets_directory : str) -> int:
+        """Brings the index up to date with the workspace, returning the number of .meta files that had to be read"""
+        old_entries = self.entries
+        new_entries = {}
+        read_count = 0
+
+        relative_assets_directory = os.path.relpath(assets_directory, project_directory).replace(os.sep, '/')
+        directories = [(assets_directory, relative_assets_directory)]
+        while directories:
+            directory, relative_directory = directories.pop()
+            with os.scandir(directory) as iterator:
+                for entry in iterator:
+                    if is_ignored_by_unity(entry.name):
+                        continue
+                    relative_path = relative_directory + '/' + entry.name
+                    if entry.is_dir(follow_symlinks=False):
+                        directories.append((entry.path, relative_path))
+                        continue
+                    if not is_meta(entry.name):
+                        continue
+
+                    stat = entry.stat(follow_symlinks=False)
+                    old_entry = old_entries.get(relative_path)
+                    if old_entry is not None and old_entry[0] == stat.st_mtime_ns and old_entry[1] == stat.st_size:
+                        new_entries[relative_path] = old_entry
+                        continue
+
+                    new_entries[relative_path] = (stat.st_mtime_ns, stat.st_size, read_guid(entry.path))
+                    read_count += 1
+
+        self.is_dirty = self.is_dirty or read_count > 0 or len(new_entries) != len(old_entries)
+        self.entries = new_entries
+        self._paths_by_guid = None
+        return read_count
+
+    def get_guid(self, path : str) -> str:
+        entry = self.entries.get(path)
+        return entry[2] if entry is not None else None
+
+    def _get_paths_by_guid(self) -> 'dict[str, list[str]]':
+        if self._paths_by_guid is None:
+            paths_by_guid = {}
+            for path, entry in self.entries.items():
+                if entry[2] is not None:
+                    paths_by_guid.setdefault(entry[2], []).append(path)
+            self._paths_by_guid = paths_by_guid
+        return self._paths_by_guid
+
+    def get_paths(self, guid : str) -> 'list[str]':
+        return self._get_paths_by_guid().get(guid.lower(), [])
+
+    def get_duplicates(self) -> 'dict[str, list[str]]':
+        paths_by_guid = self._get_paths_by_guid()
+        return { guid: sorted(paths) for guid, paths in sorted(paths_by_guid.items()) if len(paths) > 1 }
+
+
+def get_guid_index_path(project_directory : str) -> str:
+    return os.path.join(get_baton_git_directory(project_directory), "guid_index.json")
+
+def load_updated_guid_index(project_directory : str, assets_directory : str) -> GuidIndex:
+    index = GuidIndex.load(get_guid_index_path(project_directory))
+    index.update(project_directory, assets_directory)
+    if index.is_dirty or not index.exists():
+        index.save()
+    return index
@@ -1,25 +1,33 @@
-from colorama import init, Fore, Back, Style
-init()
+# colorama is imported on the first message, so that importing the logger costs nothing
+_colorama = None
+
+def _colors():
+    global _colorama
+    if _colorama is None:
+        import colorama
+        colorama.init()
+        _colorama = colorama
+    return _colorama
 
 def log(message : str):
-    print(Fore.WHITE)
+    print(_colors().Fore.WHITE)
     print(message)
 
 def log_success(message : str):
-    print(Fore.GREEN)
+    print(_colors().Fore.GREEN)
     print(message)
 
 def log_error(message : str):
-    print(Fore.RED)
+    print(_colors().Fore.RED)
     print(message)
 
 def log_warning(message : str):
-    print(Fore.YELLOW)
+    print(_colors().Fore.YELLOW)
     print(message)
 
 def log_info(message : str):
-    print(Fore.CYAN)
+    print(_colors().Fore.CYAN)
     print(message)
 
 def log_reset():
-    print(Style.RESET_ALL)
\ No newline at end of file
+    print(_colors().Style.RESET_ALL)
\ No newline at end of file
@@ -0,0 +1,117 @@
+"""Checks the .meta files of the whole Assets folder in the workspace, as opposed to the precommit hook, which only sees the index."""
+
+import os, subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from baton.git_hooks import is_ignored_by_unity, is_meta, strip_meta
+
+
+class MetaAuditReport:
+    def __init__(self):
+        self.orphan_metas     : 'list[str]' = []  # .meta files without the asset
+        self.missing_metas    : 'list[str]' = []  # files without a .meta
+        self.metaless_folders : 'list[str]' = []  # folders without a .meta
+        self.directory_count = 0
+        self.file_count = 0
+
+    def is_ok(self) -> bool:
+        return len(self.orphan_metas) == 0 and len(self.missing_metas) == 0 and len(self.metaless_folders) == 0
+
+    def extend(self, other : 'MetaAuditReport'):
+        self.orphan_metas     += other.orphan_metas
+        self.missing_metas    += other.missing_metas
+        self.metaless_folders += other.metaless_folders
+        self.directory_count  += other.directory_count
+        self.file_count       += other.file_count
+
+    def sort(self):
+        self.orphan_metas.sort()
+        self.missing_metas.sort()
+        self.metaless_folders.sort()
+
+    def to_dict(self) -> dict:
+        return {
+            "orphan_metas":     self.orphan_metas,
+            "missing_metas":    self.missing_metas,
+            "metaless_folders": self.metaless_folders,
+            "directory_count":  self.directory_count,
+            "file_count":       self.file_count,
+        }
+
+
+def _scan_directory(directory : str, relative_directory : str) -> 'tuple[MetaAuditReport, list[tuple[str, str]]]':
+    """Checks a single directory, returning the problems and the subdirectories that should be scanned next"""
+    report = MetaAuditReport()
+    report.directory_count = 1
+    subdirectories = []
+
+    with os.scandir(directory) as iterator:
+        entries = [entry for entry in iterator if not is_ignored_by_unity(entry.name)]
+    names = set(entry.name for entry in entries)
+
+    for entry in entries:
+        name = entry.name
+        relative_path = relative_directory + '/' + name
+
+        if entry.is_dir(follow_symlinks=False):
+            if name + '.meta' not in names:
+                report.metaless_folders.append(relative_path)
+            # Nested repositories (submodules) are audited on their own
+            if not os.path.exists(os.path.join(entry.path, '.git')):
+                subdirectories.append((entry.path, relative_path))
+            continue
+
+        report.file_count += 1
+        if is_meta(name):
+            if strip_meta(name) not in names:
+                report.orphan_metas.append(relative_path)
+        elif name + '.meta' not in names:
+            report.missing_metas.append(relative_path)
+
+    return report, subdirectories
+
+
+def _get_ignored_by_git(project_directory : str, paths : 'list[str]') -> 'set[str]':
+    """Returns the paths that git ignores, with a single `git check-ignore` call"""
+    if len(paths) == 0:
+        return set()
+
+    result = subprocess.run(
+        ["git", "check-ignore", "--stdin", "-z"],
+        cwd=project_directory, input='\0'.join(paths).encode('utf-8') + b'\0', stdout=subprocess.PIPE)
+
+    # 0 means some paths are ignored, 1 means none are.
+    if result.returncode not in (0, 1):
+        raise subprocess.CalledProcessError(result.returncode, result.args)
+
+    return set(path.decode('utf-8') for path in result.stdout.split(b'\0') if path)
+
+
+def audit(project_directory : str, assets_directory : str, jobs : int = None) -> MetaAuditReport:
+    """
+    Scans the Assets folder with a pool of threads, one directory per task,
+    applying the same rules as the precommit hook plus the one that every folder must have a .meta.
+    The paths in the report are relative to the project directory, separated with '/'.
+    """
+    report = MetaAuditReport()
+    relative_assets_directory = os.path.relpath(assets_directory, project_directory).replace(os.sep, '/')
+
+    # os.scandir releases the GIL, so threads are enough to keep the disk busy
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = { executor.submit(_scan_directory, assets_directory, relative_assets_directory) }
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory_report, subdirectories = future.result()
+                report.extend(directory_report)
+                for path, relative_path in subdirectories:
+                    pending.add(executor.submit(_scan_directory, path, relative_path))
+
+    # Only the problematic paths are checked against gitignore, which is way cheaper than checking all of them.
+    ignored = _get_ignored_by_git(project_directory, report.orphan_metas + report.missing_metas + report.metaless_folders)
+    if ignored:
+        report.orphan_metas     = [path for path in report.orphan_metas if path not in ignored]
+        report.missing_metas    = [path for path in report.missing_metas if path not in ignored]
+        report.metaless_folders = [path for path in report.metaless_folders if path not in ignored]
+    report.sort()
+
+    return report
@@ -0,0 +1,142 @@
+"""
+Keeps what is known of the Kari plugins in a file in the build output: the project of each plugin,
+and for each configuration it has been built in, the output, the hash of the sources and whether the last build succeeded.
+The commands that only need the plugins read it, instead of listing the plugins folder and guessing where the outputs are.
+It is kept with the build output, so that deleting the output (`baton kari nuke`) also forgets what was built.
+"""
+
+import os, json, time, threading
+
+PLUGIN_REGISTRY_VERSION = 1
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+class PluginRegistry:
+    """
+    name -> { "project": the .csproj, "builds": { configuration -> { "output", "inputs", "status", "built_at" } } },
+    with the paths relative to the root folder. Can be used from multiple threads.
+    """
+
+    def __init__(self, file_path : str, root_directory : str):
+        self.file_path = file_path
+        self.root_directory = os.path.abspath(root_directory)
+        self.plugins : 'dict[str, dict]' = {}
+        # Whether it has been read from the file
+        self.exists = False
+        try:
+            with open(file_path, 'r') as file:
+                data = json.load(file)
+            if data.get("version") == PLUGIN_REGISTRY_VERSION:
+                self.plugins = data["plugins"]
+                self.exists = True
+        except (OSError, ValueError, KeyError):
+            pass
+        self._lock = threading.Lock()
+
+    def _to_relative(self, path : str) -> str:
+        return os.path.relpath(path, self.root_directory).replace(os.sep, '/')
+
+    def _to_absolute(self, path : str) -> str:
+        return os.path.normpath(os.path.join(self.root_directory, path))
+
+    @property
+    def names(self) -> 'list[str]':
+        return sorted(self.plugins)
+
+    def get_project_path(self, name : str) -> str:
+        return self._to_absolute(self.plugins[name]["project"])
+
+    def get_build(self, name : str, configuration : str) -> dict:
+        """What is known of the last build of the plugin in the configuration, with the output as an absolute path. None if not built."""
+        plugin = self.plugins.get(name)
+        build = plugin and plugin["builds"].get(configuration)
+        if build is None:
+            return None
+        return dict(build, output=self._to_absolute(build["output"]))
+
+    def discover(self, plugins_directory : str) -> bool:
+        """
+        Adds the plugins in the folder (a folder with a project of the same name each), and forgets those no longer there.
+        Returns whether anything has changed.
+        """
+        found = {}
+        for entry in sorted(os.scandir(plugins_directory), key=lambda entry: entry.name):
+            if entry.is_dir():
+                found[entry.name] = os.path.join(entry.path, f"{entry.name}.csproj")
+        with self._lock:
+            changed = False
+            for name in [name for name in self.plugins if name not in found]:
+                del self.plugins[name]
+                changed = True
+            for name, project_path in found.items():
+                if name not in self.plugins or self.plugins[name]["project"] != self._to_relative(project_path):
+                    self.plugins[name] = { "project": self._to_relative(project_path), "builds": {} }
+                    changed = True
+            return changed
+
+    def register(self, name : str, project_path : str):
+        with self._lock:
+            self.plugins[name] = { "project": self._to_relative(project_path), "builds": {} }
+            self._save()
+
+    def record_build(self, name : str, configuration : str, output_path : str, inputs : str, ok : bool):
+        """Remembers how the build of the plugin went, and saves the registry"""
+        with self._lock:
+            plugin = self.plugins.get(name)
+            if plugin is None:
+                return
+            plugin["builds"][configuration] = {
+                "output": self._to_relative(output_path),
+                "inputs": inputs,
+                "status": STATUS_OK if ok else STATUS_FAILED,
+                "built_at": time.time(),
+            }
+            self._save()
+
+    def get_usable_outputs(self, configuration : str, get_output_path = None,
+        get_inputs_hash = None) -> 'tuple[list[str], dict[str, str], list[str]]':
+        """
+        The outputs of the plugins last built successfully in the configuration, which are still there,
+        the reasons the other plugins cannot be used, by name,
+        and the names of the plugins whose output is used, but whose sources have changed since it was built,
+        which `get_inputs_hash(project_path)` tells, giving the hash to compare with the recorded one.
+        For the plugins without a recorded build, e.g. built before there was a registry,
+        `get_output_path(project_path)` tells where their output would be, which is used if it exists,
+        though whether it is stale cannot be told.
+        """
+        outputs = []
+        unusable = {}
+        stale = []
+        for name in self.names:
+            build = self.get_build(name, configuration)
+            if build is None:
+                output_path = get_output_path(self.get_project_path(name)) if get_output_path is not None else None
+                if output_path is not None and os.path.isfile(output_path):
+                    outputs.append(output_path)
+                else:
+                    unusable[name] = "it has not been built"
+            elif build["status"] != STATUS_OK:
+                unusable[name] = "its last build has failed"
+            elif not os.path.isfile(build["output"]):
+                unusable[name] = f"{build['output']} does not exist"
+            else:
+                outputs.append(build["output"])
+                # Not known if it was built without the build manifest
+                if get_inputs_hash is not None and build["inputs"] is not None \
+                        and build["inputs"] != get_inputs_hash(self.get_project_path(name)):
+                    stale.append(name)
+        return outputs, unusable, stale
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        temp_path = self.file_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({ "version": PLUGIN_REGISTRY_VERSION, "plugins": self.plugins }, file, indent=2)
+        os.replace(temp_path, self.file_path)
+        self.exists = True
@@ -0,0 +1,253 @@
+"""
+Runs commands given as argv lists, streaming their stdout and stderr as lines as they come,
+and records the wall time, the peak memory and the exit status of each in the timeline.
+
+Every command is started in its own process group, so that a timeout, Ctrl-C or a failure of a concurrent command
+can stop it along with all of the processes it has started (e.g. the MSBuild nodes of dotnet), instead of leaving them behind.
+The peak memory is that of the largest process of the tree that has been waited on,
+known on Linux and macOS from `wait4`, and on Windows from pywin32.
+"""
+
+import os, sys, signal, subprocess, threading, time
+import baton.timing as timing
+
+IS_WINDOWS = sys.platform.startswith('win')
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+# The seconds given to a process tree to exit after being asked to, before it is killed
+TERMINATE_GRACE_SECONDS = 3
+# The seconds the output is still read for after the command has exited. Processes it leaves running,
+# like the reused MSBuild nodes, keep the pipes open, so their end cannot be waited for.
+OUTPUT_DRAIN_SECONDS = 2
+
+
+def format_command(args : 'list[str]') -> str:
+    """The command as it would be typed in the shell"""
+    if IS_WINDOWS:
+        return subprocess.list2cmdline(args)
+    import shlex
+    return shlex.join(args)
+
+
+class ProcessTimeoutError(subprocess.CalledProcessError):
+    """The command did not finish in time, and has been stopped"""
+
+    def __init__(self, returncode : int, cmd, timeout : float, output : str = None):
+        super().__init__(returncode, cmd, output)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command '{self.cmd}' timed out after {self.timeout} seconds"
+
+
+class ProcessResult:
+    def __init__(self, args : 'list[str]'):
+        self.args         = args
+        self.returncode   : int = None
+        self.wall_seconds = 0.0
+        # None where it cannot be known
+        self.peak_memory_bytes : int = None
+        self.timeout      : float = None
+        self.timed_out    = False
+        self.cancelled    = False
+        # The lines of stdout and stderr in the order they came, if they were captured
+        self.output       : 'list[str]' = None
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not self.timed_out and not self.cancelled
+
+    def check(self):
+        """Raises CalledProcessError if the command has failed, ProcessTimeoutError if it has timed out"""
+        if self.ok:
+            return
+        output = "\n".join(self.output) if self.output is not None else None
+        command = format_command(self.args)
+        if self.timed_out:
+            raise ProcessTimeoutError(self.returncode, command, self.timeout, output)
+        raise subprocess.CalledProcessError(self.returncode, command, output)
+
+
+def _print_line(stream : str, line : str):
+    file = sys.stderr if stream == STDERR else sys.stdout
+    file.write(line + "\n")
+    file.flush()
+
+
+# The processes running at the moment, so that they can all be stopped at once
+_running : 'set[RunningProcess]' = set()
+_running_lock = threading.Lock()
+# Keeps the lines of the commands running concurrently from interleaving
+_output_lock = threading.Lock()
+
+
+class RunningProcess:
+    """
+    A started command. Its stdout and stderr are read by a thread each, which is what keeps a command
+    from blocking on a full pipe while the other one is being read.
+    `on_line(stream, line)` is called for every line, without the line ending, one call at a time.
+    """
+
+    def __init__(self, args : 'list[str]', cwd : str = None, env : 'dict[str, str]' = None,
+            on_line = _print_line, capture : bool = False):
+        self.result = ProcessResult(args)
+        if capture:
+            self.result.output = []
+        self._on_line = on_line
+        self._cancel_lock = threading.Lock()
+        self._start = time.perf_counter()
+
+        kwargs = {}
+        if IS_WINDOWS:
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP
+        else:
+            kwargs["start_new_session"] = True
+        self.popen = subprocess.Popen(args, cwd=cwd, env=env,
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)
+
+        self._readers = [
+            threading.Thread(target=self._read, args=(self.popen.stdout, STDOUT), daemon=True),
+            threading.Thread(target=self._read, args=(self.popen.stderr, STDERR), daemon=True),
+        ]
+        for reader in self._readers:
+            reader.start()
+        with _running_lock:
+            _running.add(self)
+
+    def _read(self, pipe, stream : str):
+        with pipe:
+            for line in iter(pipe.readline, b''):
+                text = line.decode('utf-8', errors='replace').rstrip('\r\n')
+                with _output_lock:
+                    if self.result.output is not None:
+                        self.result.output.append(text)
+                    if self._on_line is not None:
+                        self._on_line(stream, text)
+
+    def _wait_for_exit(self):
+        if IS_WINDOWS:
+            self.popen.wait()
+            try:
+                import win32process
+                memory = win32process.GetProcessMemoryInfo(int(self.popen._handle))
+                self.result.peak_memory_bytes = memory["PeakWorkingSetSize"]
+            except (ImportError, OSError):
+                pass
+            return
+
+        while True:
+            try:
+                _, status, usage = os.wait4(self.popen.pid, 0)
+                break
+            except ChildProcessError:
+                # Already waited on by Popen
+                self.popen.wait()
+                return
+        self.popen.returncode = os.waitstatus_to_exitcode(status)
+        # Kilobytes on Linux, bytes on macOS
+        self.result.peak_memory_bytes = usage.ru_maxrss if sys.platform == 'darwin' else usage.ru_maxrss * 1024
+
+    def wait(self, timeout : float = None) -> ProcessResult:
+        """
+        Waits for the command to exit and for the rest of its output to be read.
+        After `timeout` seconds the process tree is stopped. So is it if the wait is interrupted, e.g. by Ctrl-C.
+        """
+        timer = None
+        if timeout is not None:
+            self.result.timeout = timeout
+            def on_timeout():
+                self.result.timed_out = True
+                self.cancel()
+            timer = threading.Timer(timeout, on_timeout)
+            timer.daemon = True
+            timer.start()
+
+        try:
+            self._wait_for_exit()
+            deadline = time.monotonic() + OUTPUT_DRAIN_SECONDS
+            for reader in self._readers:
+                reader.join(max(0, deadline - time.monotonic()))
+        except BaseException:
+            self.cancel()
+            self.popen.wait()
+            raise
+        finally:
+            if timer is not None:
+                timer.cancel()
+            with _running_lock:
+                _running.discard(self)
+            self.result.returncode = self.popen.returncode
+            self.result.wall_seconds = time.perf_counter() - self._start
+        return self.result
+
+    def cancel(self):
+        """Stops the process and all of the processes it has started, asking them to exit first"""
+        with self._cancel_lock:
+            if self.result.cancelled or self.popen.returncode is not None:
+                return
+            if not self.result.timed_out:
+                self.result.cancelled = True
+            _terminate_tree(self.popen)
+
+
+def _terminate_tree(popen : subprocess.Popen):
+    if IS_WINDOWS:
+        # taskkill without /F asks the windows to close, which console programs ignore
+        subprocess.run(["taskkill", "/T", "/F", "/PID", str(popen.pid)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return
+
+    try:
+        os.killpg(popen.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    def kill_later():
+        deadline = time.monotonic() + TERMINATE_GRACE_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                # Signal 0 only tells whether any process of the group is left
+                os.killpg(popen.pid, 0)
+            except ProcessLookupError:
+                return
+            time.sleep(0.05)
+        try:
+            os.killpg(popen.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    threading.Thread(target=kill_later, daemon=True).start()
+
+
+def cancel_all():
+    """Stops all of the commands running at the moment"""
+    with _running_lock:
+        running = list(_running)
+    for process in running:
+        process.cancel()
+
+
+def _set_record(record : timing.TimingRecord, result : ProcessResult):
+    record.peak_memory_bytes = result.peak_memory_bytes
+    if result.timed_out:
+        record.status = "timeout"
+    elif result.cancelled:
+        record.status = "cancelled"
+    else:
+        record.status = f"exit {result.returncode}"
+
+
+def run(args : 'list[str]', cwd : str = None, env : 'dict[str, str]' = None, timeout : float = None,
+        on_line = _print_line, capture : bool = False, check : bool = True) -> ProcessResult:
+    """
+    Runs the command, printing its output as it comes unless `on_line` says otherwise.
+    Raises CalledProcessError if it fails and `check` is set, ProcessTimeoutError if it times out.
+    """
+    with timing.process(format_command(args)) as record:
+        result = RunningProcess(args, cwd, env, on_line, capture).wait(timeout)
+        _set_record(record, result)
+    if check:
+        result.check()
+    return result
+
@@ -1,48 +1,163 @@
 # Some credit: https://github.com/jhandley/pyvcproj
 """Visual Studio Solution File."""
 
-import io, os, re, codecs
-from dataclasses import dataclass
+import io, os, re, codecs, mmap, json, hashlib, glob
 
 class SolutionFileError(Exception):
     pass
 
-@dataclass
-class GlobalSection:
-    def __init__(self, match, lines : 'list[str]'):
-        self.name : str = match[1]
-        self.when : str = match[2]
-        self.lines = lines
-
-    HEADER_REGEX = re.compile(r"""\s*GlobalSection\(([^\)]+)\) = (.+)""")
-    END_REGEX    = re.compile(r"""\s*EndGlobalSection""")
 
-    @staticmethod
-    def parse(line : str, file : io.BufferedReader) -> 'GlobalSection':
-        header_match = GlobalSection.HEADER_REGEX.match(line)
-        if not header_match: return None
+class SolutionReader:
+    """
+    Walks the lines of a memory mapped solution file. The regexes are matched against the mapped bytes in place,
+    only the captured parts get decoded. Only offsets are tracked, the line numbers are worked out for the errors.
+    """
+
+    UTF8_BOM = b'\xef\xbb\xbf'
+
+    def __init__(self, buffer, filename : str):
+        self.buffer     = buffer
+        self.filename   = filename
+        self.length     = len(buffer)
+        # The start of the next line
+        self.position   = len(SolutionReader.UTF8_BOM) if buffer[:3] == SolutionReader.UTF8_BOM else 0
+        # The current line, without the line break
+        self.line_start = 0
+        self.line_end   = 0
+
+    def next_line(self) -> bool:
+        """Moves on to the next line, returning False at the end of the file"""
+        if self.position >= self.length:
+            return False
+
+        end = self.buffer.find(b'\n', self.position)
+        if end == -1:
+            end = self.length
+        self.line_start = self.position
+        self.position = end + 1
+        if end > self.line_start and self.buffer[end - 1] == 13: # '\r'
+            end -= 1
+        self.line_end = end
+        return True
+
+    def find_line(self, marker : bytes, start : int) -> 'tuple[int, int]':
+        """
+        Finds the first line from `start`, which is the start of a line, that is `marker` between whitespace.
+        Returns the offsets of its start and of the start of the following line, or None if there is none.
+        """
+        buffer = self.buffer
+        search_start = start
+        while True:
+            found = buffer.find(marker, search_start)
+            if found == -1:
+                return None
+
+            line_start = buffer.rfind(b'\n', start, found) + 1 or start
+            line_end = buffer.find(b'\n', found)
+            next_line_start = line_end + 1
+            if line_end == -1:
+                line_end = next_line_start = self.length
+            if buffer[line_start:line_end].strip() == marker:
+                return line_start, next_line_start
+            search_start = found + len(marker)
+
+    def find_block(self, end_marker : bytes, what : str) -> 'tuple[int, int]':
+        """
+        Finds the next line that is `end_marker` and moves onto it, without looking at the lines in between.
+        Returns the offsets of the lines in between, which end with a line break.
+        """
+        found = self.find_line(end_marker, self.position)
+        if found is None:
+            raise self.error_at(self.length, f"Unexpected end of file while reading {what}")
+
+        block_start = self.position
+        self.position = found[0]
+        self.next_line()
+        return block_start, found[0]
+
+    def expect_line(self, what : str):
+        if not self.next_line():
+            raise self.error_at(self.length, f"Unexpected end of file while reading {what}")
+
+    def match(self, regex : 're.Pattern[bytes]') -> 're.Match[bytes]':
+        return regex.match(self.buffer, self.line_start, self.line_end)
+
+    def is_blank(self) -> bool:
+        return self.buffer[self.line_start:self.line_end].strip() == b''
+
+    def line(self) -> str:
+        """The current line, without the line ending"""
+        return self.buffer[self.line_start:self.line_end].decode('utf-8')
+
+    def error(self, message : str) -> SolutionFileError:
+        """An error on the current line"""
+        return self.error_at(self.line_start, message)
+
+    def error_at(self, offset : int, message : str) -> SolutionFileError:
+        """An error on the line at `offset`, or on the last line if it is the end of the file"""
+        if offset >= self.length:
+            line_number = self.buffer[:].count(b'\n') + (0 if self.buffer[self.length - 1] == 10 else 1) # '\n'
+        else:
+            # mmap objects cannot count, the error path can afford the copy
+            line_number = self.buffer[:offset].count(b'\n') + 1
+        return SolutionFileError(f"{self.filename}:{line_number}: {message}")
+
+
+def decode_lines(block : bytes) -> 'list[str]':
+    lines = block.decode('utf-8').split('\n')
+    # The block ends with a line break, which leaves an empty string at the end
+    lines.pop()
+    return [line.rstrip('\r') + "\n" for line in lines]
+
+
+def _decode(match : 're.Match[bytes]', group : int) -> str:
+    return match[group].decode('utf-8')
 
-        lines = []
-        result = GlobalSection(header_match, lines)
 
-        while True:
-            line = file.readline().decode('utf-8')
-            if line is None:
-                raise SolutionFileError(f"Unexpected end of file while reading global section {result.name}")
-            
-            end_match = GlobalSection.END_REGEX.match(line)
-            if end_match:
-                break
+class GlobalSection:
+    """
+    The lines of a section read from a file are only decoded when they are first accessed,
+    until then they stay a range of the mapped file.
+    """
+
+    __slots__ = ('name', 'when', '_lines', '_buffer', '_start', '_end')
+
+    def __init__(self, name : str, when : str, lines : 'list[str]' = None, buffer = None, start : int = 0, end : int = 0):
+        self.name : str = name
+        self.when : str = when
+        self._lines   = lines
+        self._buffer  = buffer
+        self._start   = start
+        self._end     = end
+
+    @property
+    def lines(self) -> 'list[str]':
+        if self._lines is None:
+            self._lines = decode_lines(self._buffer[self._start:self._end])
+            self._buffer = None
+        return self._lines
+
+    @lines.setter
+    def lines(self, lines : 'list[str]'):
+        self._lines = lines
+        self._buffer = None
+
+    HEADER_REGEX = re.compile(rb"""\s*GlobalSection\(([^\)]+)\) = (.+)""")
+    END_MARKER   = b"EndGlobalSection"
 
-            lines.append(line)
+    @staticmethod
+    def parse(reader : SolutionReader) -> 'GlobalSection':
+        header_match = reader.match(GlobalSection.HEADER_REGEX)
+        if not header_match: return None
 
-        return result
+        name = _decode(header_match, 1)
+        # The sections can be long, e.g. ProjectConfigurationPlatforms has a few lines per project,
+        # so their end is found with a single search
+        start, end = reader.find_block(GlobalSection.END_MARKER, f"global section {name}")
+        return GlobalSection(name, _decode(header_match, 2), None, reader.buffer, start, end)
 
     def write_to(self, file : codecs.StreamWriter):
         GlobalSection.static_write_to(file, self.name, self.when, self.lines)
-        # file.write(f"\tGlobalSection({self.name}) = {self.when}\n")
-        # for line in self.lines: file.write(line)
-        # file.write("\tEndGlobalSection\n")
 
     @staticmethod
     def static_write_to(file : codecs.StreamWriter, name, when, lines):
@@ -51,199 +166,446 @@ class GlobalSection:
         file.write("\tEndGlobalSection\n")
 
 
-@dataclass
 class Project:
-    def __init__(self, match, dependencies):
-        self.solution_guid : str = match[1]
-        self.name          : str = match[2]
-        self.relative_path : str = match[3]
-        self.guid          : str = match[4]
+    __slots__ = ('solution_guid', 'name', 'relative_path', 'guid', 'dependencies', 'other_sections_lines')
+
+    def __init__(self, match, dependencies, other_sections_lines = None):
+        solution_guid, name, relative_path, guid = match.group(1, 2, 3, 4)
+        self.solution_guid : str = solution_guid.decode('utf-8')
+        self.name          : str = name.decode('utf-8')
+        self.relative_path : str = relative_path.decode('utf-8')
+        self.guid          : str = guid.decode('utf-8')
         self.dependencies  = dependencies
-
-    
-    HEADER_REGEX        = re.compile(r'Project\("\{([^\}]+)\}"\)[\s=]+"([^\"]+)",\s"([^\"]+)", "(\{[^\}]+\})"')
-    END_REGEX           = re.compile(r"""\s*EndProject""")
-    END_PROJECT_SECTION = re.compile(r"""\s*EndProjectSection""")
-    DEPENDENCY_REGEX    = re.compile(r"""\s*(\{[A-Za-z0-9-]+\})\s*=\s*(\{[A-Za-z0-9-]+\})""")
-    DEPENDENCIES_SECTION_REGEX = re.compile(r"""\s*ProjectSection\(ProjectDependencies\) = postProject""")
+        # The project sections other than the dependencies, e.g. SolutionItems, kept as is
+        self.other_sections_lines : 'list[str]' = other_sections_lines if other_sections_lines is not None else []
+
+    HEADER_REGEX        = re.compile(rb'Project\("\{([^\}]+)\}"\)[\s=]+"([^\"]+)",\s"([^\"]+)", "(\{[^\}]+\})"')
+    # The whole project, from its header to the first EndProject line
+    REGEX               = re.compile(HEADER_REGEX.pattern + rb"""[^\n]*\n((?:[^\n]*\n)*?)[ \t]*EndProject[ \t]*\r?(?:\n|\Z)""")
+    DEPENDENCY_REGEX    = re.compile(rb"""(\{[A-Za-z0-9-]+\})[ \t]*=""")
+    # The sections are matched whole, from their header to their EndProjectSection line
+    DEPENDENCIES_SECTION_REGEX = re.compile(
+        rb"""[ \t]*ProjectSection\(ProjectDependencies\) = postProject[ \t]*\r?\n"""
+        rb"""((?:[ \t]*\{[A-Za-z0-9-]+\}[ \t]*=[ \t]*\{[A-Za-z0-9-]+\}[ \t]*\r?\n)*)"""
+        rb"""[ \t]*EndProjectSection[ \t]*\r?\n""")
+    SECTION_REGEX       = re.compile(
+        rb"""[ \t]*ProjectSection\((?!ProjectDependencies\))[^\)]+\) = [^\n]*\n"""
+        rb"""(?:(?![ \t]*EndProjectSection)[^\n]*\n)*"""
+        rb"""[ \t]*EndProjectSection[^\n]*\n""")
 
     @staticmethod
-    def parse(line : str, file : io.BufferedReader) -> 'Project':
-        header_match = Project.HEADER_REGEX.match(line)
-        if not header_match: return None
-        
-        dependencies = []
-        result = Project(header_match, dependencies)
-        
-        line = file.readline().decode('utf-8')
-        dependencies_section_match = Project.DEPENDENCIES_SECTION_REGEX.match(line)
-        if dependencies_section_match:
-            while True:
-                line = file.readline().decode('utf-8')
-                if line is None:
-                    raise SolutionFileError(f"Unexpected end of file while reading project {result.name}")
-
-                dependency_match = Project.DEPENDENCY_REGEX.match(line)
-                if dependency_match:
-                    # Both first and second matches contain the id of the project
-                    dependencies.append(dependency_match[1])
-                    continue
-
-                dependencies_end_match = Project.END_PROJECT_SECTION.match(line)
-                if dependencies_end_match:
-                    break
-
-                raise SolutionFileError(f"Expected either end of section or another dependency while reading project {result.name}")
-                
-        project_end_match = Project.END_REGEX.match(line)
-        if not project_end_match:
-            raise SolutionFileError(f"Expected end of project file while reading project {result.name}")
+    def parse(reader : SolutionReader) -> 'Project':
+        """Reads the project that starts on the next line, if there is one"""
+        buffer = reader.buffer
+        project_match = Project.REGEX.match(buffer, reader.position)
+        if not project_match: return None
 
+        dependencies = []
+        other_sections_lines = []
+        result = Project(project_match, dependencies, other_sections_lines)
+
+        # The body is matched section by section, which also catches a missing EndProject:
+        # the header of the next project, that the match went on to, is not a section
+        position, body_end = project_match.span(5)
+        while position < body_end:
+            section_match = Project.DEPENDENCIES_SECTION_REGEX.match(buffer, position, body_end)
+            if section_match:
+                # Both sides of the line contain the id of the project
+                guids = Project.DEPENDENCY_REGEX.findall(buffer, section_match.start(1), section_match.end(1))
+                dependencies += [guid.decode('utf-8') for guid in guids]
+                position = section_match.end()
+                continue
+
+            section_match = Project.SECTION_REGEX.match(buffer, position, body_end)
+            if section_match:
+                other_sections_lines += decode_lines(section_match[0])
+                position = section_match.end()
+                continue
+
+            raise reader.error_at(position, f"Expected end of project file while reading project {result.name}")
+
+        reader.position = project_match.end()
         return result
 
-    def write_to(self, file : codecs.StreamWriter, path_to_previous_solution : str, solution_guid : str):
+    def write_to(self, file : codecs.StreamWriter, path_to_previous_solution : str = None, solution_guid : str = None):
         new_path = os.path.join(path_to_previous_solution, self.relative_path) if path_to_previous_solution else self.relative_path
-        solution_guid = solution_guid or self.solution_guid
-        
+        solution_guid = solution_guid or "{" + self.solution_guid + "}"
+
         file.write(f'Project("{solution_guid}") = "{self.name}", "{new_path}", "{self.guid}"\n')
 
         if len(self.dependencies) > 0:
             file.write("\tProjectSection(ProjectDependencies) = postProject\n")
-            
+
             for guid in self.dependencies:
                 file.write(f'\t\t{guid} = {guid}\n')
 
             file.write("\tEndProjectSection\n")
 
+        for line in self.other_sections_lines:
+            file.write(line)
+
         file.write("EndProject\n")
 
-        
+
 class Solution(object):
     """Visual C++ solution file (.sln)."""
 
-    def __init__(self, projects : 'list[Project]', global_sections : 'dict[str, GlobalSection]', filename : str = None):
+    DEFAULT_HEADER_LINES = [
+        "\n",
+        "Microsoft Visual Studio Solution File, Format Version 11.00\n",
+        "# Visual Studio 2010\n",
+    ]
+
+    def __init__(self, projects : 'list[Project]', global_sections : 'dict[str, GlobalSection]', filename : str = None,
+        header_lines : 'list[str]' = None, buffer = None):
         """Create a Solution instance for solution file *name*."""
         self.projects        = projects or []
         self.global_sections = global_sections or {}
         self.filename        = filename
+        # Everything before the Global block that is not a project, e.g. the format version, VisualStudioVersion
+        self.header_lines    = header_lines or list(Solution.DEFAULT_HEADER_LINES)
+        # The mapped file, which the global sections decode their lines from when they are accessed
+        self.buffer          = buffer
+        self._projects_by_guid : 'dict[str, Project]' = None
+        self._projects_by_name : 'dict[str, Project]' = None
 
     @staticmethod
     def read(filename : str) -> 'Solution':
+        """
+        Reads the solution, keeping the file mapped until `close` is called, or until the solution is garbage collected.
+        The lines of the global sections are decoded when they are accessed, the other parts are read right away.
+        """
+        with open(filename, 'rb') as f:
+            # Empty files cannot be mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                raise SolutionFileError(f"{filename}: The file is empty")
+
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return Solution.parse(SolutionReader(buffer, filename))
+        except BaseException:
+            buffer.close()
+            raise
+
+    def close(self):
+        """Decodes the global sections that have not been accessed yet and unmaps the file"""
+        if self.buffer is None:
+            return
+        for section in self.global_sections.values():
+            section.lines
+        self.buffer.close()
+        self.buffer = None
+
+    def __enter__(self) -> 'Solution':
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def find_project(self, name : str = None, guid : str = None, path : str = None) -> Project:
+        """
+        Returns the project with the given name, GUID (case insensitive, braces optional) or path, or None.
+        The path is either as written in the solution or relative to the current directory.
+        """
+        if guid is not None:
+            if self._projects_by_guid is None:
+                self._projects_by_guid = { project.guid.upper(): project for project in self.projects }
+            guid = guid.upper()
+            if not guid.startswith('{'):
+                guid = '{' + guid + '}'
+            return self._projects_by_guid.get(guid)
+
+        if name is not None:
+            if self._projects_by_name is None:
+                self._projects_by_name = {}
+                for project in self.projects:
+                    self._projects_by_name.setdefault(project.name, project)
+            return self._projects_by_name.get(name)
+
+        if path is not None:
+            directory = os.path.dirname(self.filename) if self.filename else ''
+            path = os.path.normcase(os.path.normpath(path))
+            for project in self.projects:
+                relative_path = os.path.normpath(project.relative_path.replace('\\', os.sep))
+                if path in (os.path.normcase(relative_path), os.path.normcase(os.path.join(directory, relative_path))):
+                    return project
+            return None
+
+        raise ValueError("Either the name, the guid or the path of the project is required")
+
+    def dependencies_of(self, project : Project) -> 'list[Project]':
+        """The projects in this solution that the project depends on, as listed in its ProjectDependencies section"""
+        dependencies = []
+        for guid in project.dependencies:
+            dependency = self.find_project(guid=guid)
+            if dependency is not None:
+                dependencies.append(dependency)
+        return dependencies
+
+    @staticmethod
+    def parse(reader : SolutionReader) -> 'Solution':
         projects = []
         global_sections = {}
+        header_lines = []
+
+        # Read the Projects section
+        while True:
+            project = Project.parse(reader)
+            if project is not None:
+                projects.append(project)
+                continue
+
+            # We're reading the project sections, so the file cannot end just yet
+            reader.expect_line("projects")
+
+            # Global section start
+            if reader.match(Solution.GLOBAL_REGEX):
+                break
+
+            # The project has no EndProject after it
+            header_match = reader.match(Project.HEADER_REGEX)
+            if header_match:
+                raise reader.error_at(reader.length, f"Unexpected end of file while reading project {_decode(header_match, 2)}")
+
+            header_lines.append(reader.line() + "\n")
+
+        # Read the Globals sections
+        while True:
+            reader.expect_line("the global sections, missing EndGlobal")
+
+            if reader.match(Solution.END_GLOBAL_REGEX):
+                break
+
+            section = GlobalSection.parse(reader)
+            if section is not None:
+                global_sections[section.name] = section
+                continue
+
+            if reader.is_blank():
+                continue
+
+            # No lines outside globals are allowed
+            raise reader.error(f"Unexpected input {reader.line()}")
+
+        return Solution(projects, global_sections, reader.filename, header_lines, reader.buffer)
+
+    GLOBAL_REGEX     = re.compile(rb"""Global\s*$""")
+    END_GLOBAL_REGEX = re.compile(rb"""EndGlobal\s*$""")
 
-        with open(filename, 'rb') as f:
-            line = f.readline()
-
-            # Expect the first line to be empty
-            # if line != '\n' and line != '\:
-            #     raise SolutionFileError(f'The first line must be empty, got {line}')
-            
-            # Read the Projects section
-            while True:
-                line = f.readline().decode('utf-8')
-
-                # We're reading the project sections, so the file cannot end just yet
-                if line is None:
-                    raise SolutionFileError('Unexpected end of file while reading prjects')
-
-                # Global section start
-                if line.startswith("Global"):
-                    break
-
-                project = Project.parse(line, f)
-                if project is not None:
-                    projects.append(project)
-                
-            # Read the Globals sections
-            while True:                          
-                line = f.readline().decode('utf-8')
-
-                if line is None:
-                    raise SolutionFileError("Missing end global")
-
-                if line.startswith("EndGlobal"):
-                    break
-
-                section = GlobalSection.parse(line, f)
-                if section is not None:
-                    global_sections[section.name] = section
-                    continue
-                
-                # No lines outside globals are allowed
-                raise SolutionFileError(f"Unexpected input {line}")
-        
-        return Solution(projects, global_sections, filename)
-        
     def write_file(self, filename : str):
         """Save solution file."""
         with codecs.open(filename, "wb", "utf-8-sig") as file:
             self.write_to(file)
-    
+
     @staticmethod
-    def write_header_to(file):
-        file.write("\n")
-        file.write("Microsoft Visual Studio Solution File, Format Version 11.00\n")
-        file.write("# Visual Studio 2010\n")
+    def write_header_to(file, header_lines : 'list[str]' = None):
+        for line in header_lines or Solution.DEFAULT_HEADER_LINES:
+            file.write(line)
 
     def write_to(self, file):
-        self.write_header_to(file)
+        self.write_header_to(file, self.header_lines)
 
         for project in self.projects:
             project.write_to(file)
 
         file.write("Global\n")
-        
+
         for global_section in self.global_sections.values():
             global_section.write_to(file)
 
         file.write("EndGlobal\n")
 
 
-def combine_solutions(inputs : 'list[str]', output : str) -> None:
-    solutions = [Solution.read(file) for file in inputs]
+SOLUTION_CONFIGURATIONS_SECTION = 'SolutionConfigurationPlatforms'
+PROJECT_CONFIGURATIONS_SECTION  = 'ProjectConfigurationPlatforms'
+SOLUTION_PROPERTIES_SECTION     = 'SolutionProperties'
+
+
+def expand_solution_patterns(patterns : 'list[str]') -> 'list[str]':
+    """
+    Returns the solution files matched by the glob patterns, e.g. `*/*.sln`, in the order of the patterns,
+    each pattern's matches sorted. The patterns without wildcards are kept as is, even if the file does not exist.
+    """
+    paths = {}
+    for pattern in patterns:
+        if any(character in pattern for character in '*?['):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                paths.setdefault(os.path.normpath(path), None)
+        else:
+            paths.setdefault(os.path.normpath(pattern), None)
+    return list(paths.keys())
+
+
+def _get_line_key(line : str) -> str:
+    """The left side of `key = value` lines, which is the GUID of the project in the sections that list projects"""
+    key, separator, _ = line.partition('=')
+    return key.strip() if separator else line.strip()
+
+def _get_project_guid(key : str) -> str:
+    """The GUID of a line of ProjectConfigurationPlatforms, e.g. `{GUID}.Debug|Any CPU.ActiveCfg`"""
+    return key[:key.find('}') + 1].upper()
+
+
+def combine_solutions(inputs : 'list[str]') -> str:
+    """
+    Returns the text of the solution with the projects and the global sections of all of the input solutions.
+    A project included by multiple solutions, i.e. with the same GUID, is only taken from the first one,
+    and so are the lines with the same key in the global sections. The output does not depend on anything
+    but the order of the inputs: the projects and their configurations come in the order of the inputs,
+    the solution configurations are sorted.
+    """
+    solutions = []
+    try:
+        for file in inputs:
+            solutions.append(Solution.read(file))
+        return _combine_solutions(solutions)
+    finally:
+        for solution in solutions:
+            solution.close()
+
+
+def _combine_solutions(solutions : 'list[Solution]') -> str:
     solution_guid = "{FAE04EC0-301F-11D3-BF4B-00C04F79EFBC}"
 
-    with codecs.open(output, "wb", "utf-8-sig") as file:
+    # GUID -> (project, the directory of its solution)
+    projects : 'dict[str, tuple[Project, str]]' = {}
+    for solution in solutions:
+        dirname = os.path.dirname(solution.filename)
+        for project in solution.projects:
+            projects.setdefault(project.guid.upper(), (project, dirname))
+
+    solution_configurations : 'dict[str, str]' = {}
+    # GUID -> key -> line, the keys of a project in the order of the first solution that has them
+    project_configurations : 'dict[str, dict[str, str]]' = { guid: {} for guid in projects }
+    # name -> (when, key -> line)
+    other_sections : 'dict[str, tuple[str, dict[str, str]]]' = {}
+
+    for solution in solutions:
+        for section in solution.global_sections.values():
+            if section.name == SOLUTION_CONFIGURATIONS_SECTION:
+                for line in section.lines:
+                    solution_configurations.setdefault(_get_line_key(line), line)
+
+            elif section.name == PROJECT_CONFIGURATIONS_SECTION:
+                for line in section.lines:
+                    key = _get_line_key(line)
+                    lines = project_configurations.get(_get_project_guid(key))
+                    # The configurations of the projects that no solution includes are dropped
+                    if lines is not None:
+                        lines.setdefault(key, line)
+
+            # Written with fixed contents below
+            elif section.name == SOLUTION_PROPERTIES_SECTION:
+                continue
+
+            else:
+                _, lines = other_sections.setdefault(section.name, (section.when, {}))
+                for line in section.lines:
+                    lines.setdefault(_get_line_key(line), line)
+
+    with io.StringIO() as file:
 
         Solution.write_header_to(file)
 
-        for solution in solutions:
-            dirname = os.path.dirname(solution.filename)
-            for project in solution.projects:
-                project.write_to(file, dirname, solution_guid)
-        
-        file.write("Globals\n")
-
-        PROJECT_CONF = 'ProjectConfigurationPlatforms'
-        PROJECT_CONF_WHEN = 'postSolution'
-        project_conf_lines = []
-        for solution in solutions:
-            if PROJECT_CONF in solution.global_sections:
-                section = solution.global_sections.pop(PROJECT_CONF)
-                project_conf_lines += section.lines
+        for project, dirname in projects.values():
+            project.write_to(file, dirname, solution_guid)
 
-        SOLUTION_CONF = 'SolutionConfigurationPlatforms'
-        SOLUTION_CONF_WHEN = 'preSolution'
-        unique_solution_configurations = set()
-        for solution in solutions:
-            if SOLUTION_CONF in solution.global_sections:
-                section = solution.global_sections.pop(SOLUTION_CONF)
-                unique_solution_configurations.update(section.lines)
-
-        GlobalSection.static_write_to(file, SOLUTION_CONF, SOLUTION_CONF_WHEN, unique_solution_configurations)
-        GlobalSection.static_write_to(file, 'SolutionProperties', 'preSolution', ['\t\tHideSolutionNode = FALSE\n'])
-        GlobalSection.static_write_to(file, PROJECT_CONF, PROJECT_CONF_WHEN, project_conf_lines)
-        
-        merged_others : dict[str, GlobalSection] = {}
-        for solution in solutions:
-            for key in solution.global_sections.keys():
-                if key in merged_others:
-                    merged_others[key].lines += solution.global_sections[key].lines
-                else:
-                    merged_others[key] = solution.global_sections[key]
-        for global_section in merged_others.values():
-            global_section.write_to(file)
+        file.write("Global\n")
+
+        GlobalSection.static_write_to(file, SOLUTION_CONFIGURATIONS_SECTION, 'preSolution',
+            [solution_configurations[key] for key in sorted(solution_configurations)])
+        GlobalSection.static_write_to(file, SOLUTION_PROPERTIES_SECTION, 'preSolution', ['\t\tHideSolutionNode = FALSE\n'])
+        GlobalSection.static_write_to(file, PROJECT_CONFIGURATIONS_SECTION, 'postSolution',
+            [line for lines in project_configurations.values() for line in lines.values()])
+
+        for name, (when, lines) in other_sections.items():
+            GlobalSection.static_write_to(file, name, when, lines.values())
+
+        file.write("EndGlobal\n")
 
-        file.write("EndGlobals\n")
-        
\ No newline at end of file
+        return file.getvalue()
+
+
+SOLUTION_STAMP_VERSION = 1
+
+def _hash_file(file_path : str) -> str:
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+def _get_fingerprint(file_path : str, old_fingerprint : 'list' = None) -> 'list':
+    """
+    Returns [mtime_ns, size, sha256] of the file, or None if it does not exist.
+    The hash of the old fingerprint is reused if the file has the same modification time and size.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    if old_fingerprint is not None and old_fingerprint[0] == stat.st_mtime_ns and old_fingerprint[1] == stat.st_size:
+        return old_fingerprint
+    return [stat.st_mtime_ns, stat.st_size, _hash_file(file_path)]
+
+def _same_contents(a : 'list', b : 'list') -> bool:
+    return a is not None and b is not None and a[2] == b[2]
+
+
+def write_if_changed(file_path : str, contents : bytes) -> bool:
+    """
+    Writes the file only if its contents differ, so that its modification time only changes with its contents.
+    The new contents are written to a temporary file first, so that the file is never seen half written.
+    Returns whether the file has been written.
+    """
+    try:
+        with open(file_path, 'rb') as file:
+            if file.read() == contents:
+                return False
+    except OSError:
+        pass
+
+    temp_path = file_path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(contents)
+    os.replace(temp_path, file_path)
+    return True
+
+
+def update_combined_solution(inputs : 'list[str]', output : str, stamp_path : str) -> bool:
+    """
+    Combines the input solutions into the output one, unless the stamp file says that neither the inputs
+    nor the output have changed since the last time. Changes are told by the sha256 of the files,
+    which are only hashed again if their size or modification time has changed.
+    Returns whether the output has been written.
+    """
+    stamp = {}
+    try:
+        with open(stamp_path, 'r') as file:
+            stamp = json.load(file)
+        if stamp.get("version") != SOLUTION_STAMP_VERSION or stamp.get("output_path") != output:
+            stamp = {}
+    except (OSError, ValueError):
+        pass
+
+    old_inputs = stamp.get("inputs", {})
+    inputs_fingerprints = { path: _get_fingerprint(path, old_inputs.get(path)) for path in inputs }
+    output_fingerprint = _get_fingerprint(output, stamp.get("output"))
+
+    is_up_to_date = (list(old_inputs.keys()) == inputs
+        and all(_same_contents(old_inputs[path], inputs_fingerprints[path]) for path in inputs)
+        and _same_contents(stamp.get("output"), output_fingerprint))
+
+    is_written = False
+    if not is_up_to_date:
+        contents = combine_solutions(inputs).encode('utf-8-sig')
+        is_written = write_if_changed(output, contents)
+        output_fingerprint = _get_fingerprint(output, None if is_written else output_fingerprint)
+
+    # Also records the new modification times of the files that were touched without being changed
+    os.makedirs(os.path.dirname(stamp_path), exist_ok=True)
+    write_if_changed(stamp_path, json.dumps({
+        "version": SOLUTION_STAMP_VERSION,
+        "output_path": output,
+        "inputs": inputs_fingerprints,
+        "output": output_fingerprint,
+    }, indent=4).encode('utf-8'))
+
+    return is_written
@@ -0,0 +1,81 @@
+"""Measures the import time of baton and of the modules its commands load lazily, see `baton -startup_profile`."""
+
+import subprocess, sys
+
+# The modules that only some of the commands import
+COMMAND_MODULES = [
+    "colorama",
+    "baton.git_objects",
+    "baton.git_hooks",
+    "baton.meta_audit",
+    "baton.guid_index",
+    "baton.git_attributes",
+    "baton.daemon",
+    "baton.solution",
+    "baton.plugin_template",
+    "baton.build_graph",
+    "baton.build_cache",
+    "baton.process",
+    "baton.telemetry",
+    "baton.generated_output",
+    "baton.file_watcher",
+    "baton.plugin_registry",
+]
+
+
+class ImportTime:
+    def __init__(self, name : str, self_us : int, cumulative_us : int, depth : int):
+        self.name          = name
+        self.self_us       = self_us
+        self.cumulative_us = cumulative_us
+        self.depth         = depth
+
+
+def measure_imports(statement : str) -> 'list[ImportTime]':
+    """Runs the statement in a fresh interpreter with `-X importtime`, returning every import it has done"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+
+    # import time: self [us] | cumulative | imported package
+    # import time:       123 |        456 |   baton.logger
+    times = []
+    for line in result.stderr.decode('utf-8', 'replace').splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        stripped_name = name.lstrip()
+        depth = (len(name) - len(stripped_name)) // 2
+        times.append(ImportTime(stripped_name, int(fields[0]), int(fields[1]), depth))
+    return times
+
+
+def _find(times : 'list[ImportTime]', name : str) -> ImportTime:
+    for time in times:
+        if time.name == name:
+            return time
+    return None
+
+
+def print_startup_profile(top_count : int = 15):
+    cli_times = measure_imports("import baton.baton")
+    cli_time = _find(cli_times, "baton.baton")
+
+    print(f"Importing baton.baton: {cli_time.cumulative_us / 1000:.1f}ms")
+    print()
+    print(f"The {top_count} slowest modules by self time:")
+    print(f"{'self ms':>9} {'cumulative ms':>14}  module")
+    for time in sorted(cli_times, key=lambda t: t.self_us, reverse=True)[:top_count]:
+        print(f"{time.self_us / 1000:9.1f} {time.cumulative_us / 1000:14.1f}  {time.name}")
+
+    print()
+    print("The additional cost of the modules loaded by the commands:")
+    print(f"{'cumulative ms':>14}  module")
+    for module in COMMAND_MODULES:
+        times = measure_imports(f"import baton.baton; import {module}")
+        time = _find(times, module)
+        # Already imported by baton.baton, so free
+        cumulative_us = time.cumulative_us if time is not None else 0
+        print(f"{cumulative_us / 1000:14.1f}  {module}")
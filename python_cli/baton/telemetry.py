@@ -0,0 +1,179 @@
+"""
+Keeps the history of the runs of the slower commands in a SQLite database in the build folder:
+the wall time, the status, the host and the commit of every run, the time of each of its phases and processes,
+and the hits and misses of its caches. `baton stats` reports on it.
+"""
+
+import os, socket, sqlite3, statistics
+import baton.timing as timing
+
+TELEMETRY_SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id            INTEGER PRIMARY KEY,
+    command       TEXT NOT NULL,
+    started_at    REAL NOT NULL,
+    wall_seconds  REAL NOT NULL,
+    status        TEXT NOT NULL,
+    host          TEXT,
+    commit_sha    TEXT,
+    cache_hits    INTEGER NOT NULL,
+    cache_misses  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_command ON runs (command, started_at);
+CREATE TABLE IF NOT EXISTS steps (
+    run_id            INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name              TEXT NOT NULL,
+    category          TEXT NOT NULL,
+    depth             INTEGER NOT NULL,
+    wall_seconds      REAL NOT NULL,
+    cpu_seconds       REAL NOT NULL,
+    status            TEXT NOT NULL,
+    peak_memory_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS steps_by_run ON steps (run_id);
+CREATE TABLE IF NOT EXISTS caches (
+    run_id  INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    name    TEXT NOT NULL,
+    hits    INTEGER NOT NULL,
+    misses  INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS caches_by_run ON caches (run_id);
+"""
+
+
+def connect(database_path : str) -> sqlite3.Connection:
+    """Opens the database, creating it if needed. A database of an older schema is started over."""
+    os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+    connection = sqlite3.connect(database_path, timeout=10)
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    if version != TELEMETRY_SCHEMA_VERSION:
+        with connection:
+            for table in ("caches", "steps", "runs"):
+                connection.execute(f"DROP TABLE IF EXISTS {table}")
+            connection.executescript(SCHEMA)
+            connection.execute(f"PRAGMA user_version = {TELEMETRY_SCHEMA_VERSION}")
+    connection.execute("PRAGMA foreign_keys = ON")
+    return connection
+
+
+def read_head_sha(project_directory : str) -> str:
+    """The sha of the commit checked out, read from .git without running git. None if it cannot be found."""
+    git_directory = os.path.join(project_directory, ".git")
+    try:
+        # In worktrees and submodules .git is a file pointing to the actual folder
+        if os.path.isfile(git_directory):
+            with open(git_directory, 'r') as file:
+                content = file.read().strip()
+            if not content.startswith("gitdir:"):
+                return None
+            git_directory = os.path.join(project_directory, content[len("gitdir:"):].strip())
+
+        with open(os.path.join(git_directory, "HEAD"), 'r') as file:
+            head = file.read().strip()
+        if not head.startswith("ref:"):
+            return head
+        ref = head[len("ref:"):].strip()
+
+        ref_path = os.path.join(git_directory, *ref.split('/'))
+        if os.path.isfile(ref_path):
+            with open(ref_path, 'r') as file:
+                return file.read().strip()
+        with open(os.path.join(git_directory, "packed-refs"), 'r') as file:
+            for line in file:
+                fields = line.split()
+                if len(fields) == 2 and fields[1] == ref:
+                    return fields[0]
+    except OSError:
+        pass
+    return None
+
+
+def record_run(database_path : str, command : str, timeline : timing.Timeline, status : str, project_directory : str) -> int:
+    """Appends the run, with the records of the timeline, returning its id"""
+    hits = sum(counts[0] for counts in timeline.cache_counts.values())
+    misses = sum(counts[1] for counts in timeline.cache_counts.values())
+    wall_seconds = max((record.wall_seconds for record in timeline.records if record.depth == 0), default=0.0)
+
+    connection = connect(database_path)
+    try:
+        with connection:
+            cursor = connection.execute(
+                "INSERT INTO runs (command, started_at, wall_seconds, status, host, commit_sha, cache_hits, cache_misses) "
+                + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (command, timeline.started_at, wall_seconds, status, socket.gethostname(),
+                    read_head_sha(project_directory), hits, misses))
+            run_id = cursor.lastrowid
+            connection.executemany(
+                "INSERT INTO steps (run_id, name, category, depth, wall_seconds, cpu_seconds, status, peak_memory_bytes) "
+                + "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(run_id, record.name, record.category, record.depth, record.wall_seconds, record.cpu_seconds,
+                    record.status, record.peak_memory_bytes) for record in timeline.records])
+            connection.executemany("INSERT INTO caches (run_id, name, hits, misses) VALUES (?, ?, ?, ?)",
+                [(run_id, name, counts[0], counts[1]) for name, counts in timeline.cache_counts.items()])
+    finally:
+        connection.close()
+    return run_id
+
+
+class Run:
+    __slots__ = ('id', 'command', 'started_at', 'wall_seconds', 'status', 'host', 'commit_sha', 'cache_hits', 'cache_misses')
+
+    def __init__(self, row : tuple):
+        (self.id, self.command, self.started_at, self.wall_seconds, self.status,
+            self.host, self.commit_sha, self.cache_hits, self.cache_misses) = row
+
+
+def get_commands(connection : sqlite3.Connection) -> 'list[str]':
+    return [row[0] for row in connection.execute("SELECT DISTINCT command FROM runs ORDER BY command")]
+
+def get_runs(connection : sqlite3.Connection, command : str) -> 'list[Run]':
+    """All of the runs of the command, the oldest first"""
+    rows = connection.execute(
+        "SELECT id, command, started_at, wall_seconds, status, host, commit_sha, cache_hits, cache_misses "
+        + "FROM runs WHERE command = ? ORDER BY started_at, id", (command,))
+    return [Run(row) for row in rows]
+
+def _in_runs(runs : 'list[Run]') -> str:
+    return ",".join(str(run.id) for run in runs)
+
+def get_step_seconds(connection : sqlite3.Connection, runs : 'list[Run]') -> 'dict[str, list[float]]':
+    """The wall times of the steps of the runs, apart from the whole commands, by name"""
+    result = {}
+    rows = connection.execute(f"SELECT name, wall_seconds FROM steps WHERE depth > 0 AND run_id IN ({_in_runs(runs)})")
+    for name, seconds in rows:
+        result.setdefault(name, []).append(seconds)
+    return result
+
+def get_cache_counts(connection : sqlite3.Connection, runs : 'list[Run]') -> 'dict[str, tuple[int, int]]':
+    """The hits and misses of the caches over the runs, by name"""
+    rows = connection.execute(
+        f"SELECT name, SUM(hits), SUM(misses) FROM caches WHERE run_id IN ({_in_runs(runs)}) GROUP BY name ORDER BY name")
+    return { name: (hits, misses) for name, hits, misses in rows }
+
+
+def percentile(values : 'list[float]', fraction : float) -> float:
+    """Interpolated between the closest values, e.g. 0.5 is the median"""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def get_rolling_medians(runs : 'list[Run]', window : int) -> 'list[float]':
+    """
+    For every run, the median wall time of the successful runs before it, up to `window` of them.
+    None for the runs without any before them. The failed runs are left out, since they tend to stop early.
+    """
+    medians = []
+    previous = []
+    for run in runs:
+        medians.append(statistics.median(previous[-window:]) if previous else None)
+        if run.status == "ok":
+            previous.append(run.wall_seconds)
+    return medians
+
+def is_regression(run : Run, median : float, threshold : float) -> bool:
+    return median is not None and run.status == "ok" and run.wall_seconds > median * (1 + threshold)
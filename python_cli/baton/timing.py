@@ -0,0 +1,123 @@
+"""
+Records the wall time, the CPU time and the exit status of the phases of the commands and of the processes they run,
+and how often the caches of the commands were hit.
+The records are printed as a table with `baton -timings ...` and exported as a Chrome trace with `baton -trace_file path ...`,
+which can be opened in chrome://tracing or https://ui.perfetto.dev. Some commands also keep them, see telemetry.py.
+"""
+
+import os, time, json, threading
+from contextlib import contextmanager
+
+PHASE = "phase"
+PROCESS = "process"
+
+
+def _cpu_seconds() -> float:
+    """CPU time of this process plus the children that have been waited on"""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class TimingRecord:
+    def __init__(self, name : str, category : str, depth : int):
+        self.name         = name
+        self.category     = category
+        self.depth        = depth
+        self.thread_id    = threading.get_ident()
+        self.start        = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.cpu_seconds  = 0.0
+        self.status       = "ok"
+        # Of the processes, where it is known
+        self.peak_memory_bytes : int = None
+
+    def to_trace_event(self, origin : float) -> dict:
+        args = { "cpu_ms": round(self.cpu_seconds * 1000, 3), "status": self.status }
+        if self.peak_memory_bytes is not None:
+            args["peak_memory_kb"] = self.peak_memory_bytes // 1024
+        return {
+            "name": self.name,
+            "cat":  self.category,
+            "ph":   "X",
+            "ts":   (self.start - origin) * 1_000_000,
+            "dur":  self.wall_seconds * 1_000_000,
+            "pid":  os.getpid(),
+            "tid":  self.thread_id,
+            "args": args,
+        }
+
+
+class Timeline:
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.started_at = time.time()
+        self.records : 'list[TimingRecord]' = []
+        # The name of a cache -> [hits, misses]
+        self.cache_counts : 'dict[str, list[int]]' = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _get_depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    @contextmanager
+    def measure(self, name : str, category : str = PHASE):
+        """
+        Measures the body of the with statement. The status is "ok" unless an exception escapes,
+        or the body sets it through the yielded record, e.g. to the exit code of a process.
+        The CPU time of the phases that run concurrently with others includes theirs too.
+        """
+        depth = self._get_depth()
+        record = TimingRecord(name, category, depth)
+        with self._lock:
+            self.records.append(record)
+
+        self._local.depth = depth + 1
+        cpu_start = _cpu_seconds()
+        try:
+            yield record
+        except SystemExit as exception:
+            if exception.code:
+                record.status = f"exit {exception.code}"
+            raise
+        except BaseException as exception:
+            record.status = type(exception).__name__
+            raise
+        finally:
+            record.cpu_seconds  = _cpu_seconds() - cpu_start
+            record.wall_seconds = time.perf_counter() - record.start
+            self._local.depth = depth
+
+    def count_cache(self, name : str, hit : bool):
+        with self._lock:
+            counts = self.cache_counts.setdefault(name, [0, 0])
+            counts[0 if hit else 1] += 1
+
+    def print_summary(self):
+        print(f"{'wall ms':>10} {'cpu ms':>10}  {'status':<20} name")
+        for record in self.records:
+            indent = "  " * record.depth
+            print(f"{record.wall_seconds * 1000:10.1f} {record.cpu_seconds * 1000:10.1f}  {record.status:<20} {indent}{record.name}")
+        for name, (hits, misses) in self.cache_counts.items():
+            print(f"cache {name}: {hits} hits, {misses} misses")
+
+    def write_chrome_trace(self, file_path : str):
+        with open(file_path, "w") as file:
+            json.dump({
+                "traceEvents": [record.to_trace_event(self.origin) for record in self.records],
+                "displayTimeUnit": "ms",
+            }, file)
+
+
+# The timeline of the current baton invocation
+timeline = Timeline()
+
+def phase(name : str):
+    return timeline.measure(name, PHASE)
+
+def process(command : str):
+    return timeline.measure(command, PROCESS)
+
+def cache(name : str, hit : bool):
+    """Counts a lookup in the cache, e.g. whether a project was up to date"""
+    timeline.count_cache(name, hit)
@@ -0,0 +1,87 @@
+"""
+Measures the cold start of the baton CLI: the wall time of running a few cheap commands in fresh processes.
+The medians are compared against the budget in cold_start_budget.json, failing if any is exceeded.
+
+    python benchmarks/cold_start.py [-runs 10] [-json] [-update_budget]
+"""
+
+import argparse, json, os, statistics, subprocess, sys, time
+
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cold_start_budget.json")
+PYTHON_CLI_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Commands that do next to nothing, so that the time is all startup.
+# The interpreter alone is measured too, to tell apart the cost of baton from the cost of python.
+COMMANDS = {
+    "python":              ["-c", "pass"],
+    "baton --help":        ["-m", "baton.baton", "--help"],
+    "baton kari --help":   ["-m", "baton.baton", "kari", "--help"],
+    "baton meta --help":   ["-m", "baton.baton", "meta", "--help"],
+    "baton-client --help": ["-m", "baton.client", "--help"],
+}
+
+# How much slower than the budget a run may be before it counts as a regression
+TOLERANCE = 1.25
+
+
+def measure(arguments : 'list[str]', runs : int) -> 'list[float]':
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = PYTHON_CLI_DIRECTORY + os.pathsep + environment.get("PYTHONPATH", "")
+
+    # Warm up the file system cache and the bytecode cache, which is what cold start means in practice
+    subprocess.run([sys.executable] + arguments, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, env=environment, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-runs", type=int, default=10)
+    parser.add_argument("-json", action="store_true", help="Print the results as json")
+    parser.add_argument("-update_budget", action="store_true", help="Write the measured medians as the new budget")
+    args = parser.parse_args()
+
+    results = {}
+    for name, arguments in COMMANDS.items():
+        timings = measure(arguments, args.runs)
+        results[name] = { "median_ms": round(statistics.median(timings), 1), "min_ms": round(min(timings), 1) }
+
+    budget = {}
+    if os.path.exists(BUDGET_PATH):
+        with open(BUDGET_PATH) as file:
+            budget = json.load(file)
+
+    # The budget is relative to the bare interpreter, so that it holds across machines
+    python_ms = results["python"]["median_ms"]
+    regressions = []
+    for name, result in results.items():
+        result["overhead_ms"] = round(result["median_ms"] - python_ms, 1)
+        allowed = budget.get(name)
+        if allowed is not None and name != "python" and result["overhead_ms"] > allowed * TOLERANCE:
+            regressions.append(name)
+
+    if args.json:
+        print(json.dumps({ "results": results, "budget_ms": budget, "regressions": regressions }, indent=2))
+    else:
+        print(f"{'command':<22} {'median ms':>10} {'min ms':>8} {'overhead ms':>12} {'budget ms':>10}")
+        for name, result in results.items():
+            allowed = budget.get(name, "")
+            print(f"{name:<22} {result['median_ms']:>10} {result['min_ms']:>8} {result['overhead_ms']:>12} {allowed:>10}")
+        for name in regressions:
+            print(f"Regression: '{name}' is over its budget")
+
+    if args.update_budget:
+        with open(BUDGET_PATH, "w") as file:
+            json.dump({ name: result["overhead_ms"] for name, result in results.items() if name != "python" }, file, indent=4)
+            file.write("\n")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
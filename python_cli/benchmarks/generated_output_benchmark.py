@@ -0,0 +1,151 @@
+"""
+Benchmarks the code generated for Unity with one file per type and with a single file per assembly (`baton kari unity -single_file`).
+
+For each size, Kari is imitated by writing that many generated files over the assemblies, a type each, in nested folders.
+The code is generated once, then again with a single type changed, going through the same stash and sync as `baton kari unity`.
+Unity cannot be run here, so what it would have to import stands in for the import time:
+the files and the .meta files there are, and the files and the bytes rewritten by the regeneration, which Unity reimports.
+The milliseconds taken by the combining and the syncing are measured as well.
+
+    python benchmarks/generated_output_benchmark.py -sizes 200 2000 -output results.json
+"""
+
+import argparse, json, os, shutil, statistics, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import baton.generated_output as generated_output
+
+GENERATED_NAME = "Generated"
+USINGS = ["using System;", "using System.Collections.Generic;", "using SomeProject.Common;"]
+
+
+def write_generated(source_directory : str, file_count : int, assembly_count : int, changed_index : int = None):
+    """Writes the files as Kari would, the one at `changed_index` coming out different"""
+    for index in range(file_count):
+        assembly = f"Assembly{index % assembly_count}"
+        directory = os.path.join(source_directory, assembly, GENERATED_NAME, f"Plugin{index % 4}")
+        os.makedirs(directory, exist_ok=True)
+        value = "changed" if index == changed_index else "original"
+        with open(os.path.join(directory, f"Type{index}.cs"), "w", encoding="utf-8", newline="\n") as file:
+            file.write("\n".join(USINGS) + "\n\n")
+            file.write(f"namespace SomeProject.{assembly}\n{{\n")
+            file.write(f"    public static partial class Type{index}Extensions\n    {{\n")
+            for member in range(10):
+                file.write(f'        public static string Member{member}() => "{value} {index} {member}";\n')
+            file.write("    }\n}\n")
+
+
+def write_metas(source_directory : str):
+    """Writes a .meta for every file and folder in the output folders, as Unity would"""
+    for output_directory in generated_output.find_output_directories(source_directory, GENERATED_NAME):
+        open(output_directory + generated_output.META_EXTENSION, "w").close()
+        for root, directories, files in os.walk(output_directory):
+            for name in directories + files:
+                if not name.endswith(generated_output.META_EXTENSION):
+                    open(os.path.join(root, name) + generated_output.META_EXTENSION, "w").close()
+
+
+def count_files(source_directory : str) -> 'tuple[int, int]':
+    """The numbers of the generated files and of the .meta files"""
+    files = metas = 0
+    for root, _, names in os.walk(source_directory):
+        for name in names:
+            if name.endswith(generated_output.META_EXTENSION):
+                metas += 1
+            else:
+                files += 1
+    return files, metas
+
+
+def generate(source_directory : str, file_count : int, assembly_count : int, single_file : bool,
+        changed_index : int = None) -> 'tuple[generated_output.SyncReport, float, float]':
+    """Generates the code like `baton kari unity` does, returning what has changed and the milliseconds of combining and syncing"""
+    stash_root = source_directory + "Stash"
+    stashes = generated_output.stash(generated_output.find_output_directories(source_directory, GENERATED_NAME),
+        source_directory, stash_root)
+    write_generated(source_directory, file_count, assembly_count, changed_index)
+
+    start = time.perf_counter()
+    if single_file:
+        for output_directory in generated_output.find_output_directories(source_directory, GENERATED_NAME):
+            generated_output.combine_sources(output_directory)
+    combine_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    report = generated_output.SyncReport()
+    for output_directory, stash_directory in stashes:
+        generated_output.sync(output_directory, stash_directory, report)
+    shutil.rmtree(stash_root, ignore_errors=True)
+    sync_ms = (time.perf_counter() - start) * 1000
+    return report, combine_ms, sync_ms
+
+
+def run_mode(directory : str, file_count : int, assembly_count : int, single_file : bool, runs : int) -> dict:
+    combine = []
+    sync = []
+    for run in range(runs):
+        source_directory = os.path.join(directory, f"Source{run}")
+        generate(source_directory, file_count, assembly_count, single_file)
+        write_metas(source_directory)
+        files, metas = count_files(source_directory)
+
+        report, combine_ms, sync_ms = generate(source_directory, file_count, assembly_count, single_file, changed_index=file_count // 2)
+        combine.append(combine_ms)
+        sync.append(sync_ms)
+        rewritten = report.changed + report.added
+        rewritten_bytes = sum(os.path.getsize(path) for path in rewritten)
+        shutil.rmtree(source_directory)
+
+    return {
+        "files": files,
+        "metas": metas,
+        "rewritten_files": len(rewritten),
+        "rewritten_kb": round(rewritten_bytes / 1024, 1),
+        "combine_median_ms": round(statistics.median(combine), 2),
+        "sync_median_ms": round(statistics.median(sync), 2),
+        "combine_ms": [round(t, 2) for t in combine],
+        "sync_ms": [round(t, 2) for t in sync],
+    }
+
+
+def run(args) -> dict:
+    results = []
+    directory = tempfile.mkdtemp(prefix="baton-generated-output-benchmark-")
+    try:
+        for file_count in args.sizes:
+            for single_file in (False, True):
+                result = { "generated_files": file_count, "assemblies": args.assemblies, "single_file": single_file }
+                result.update(run_mode(directory, file_count, args.assemblies, single_file, args.runs))
+                results.append(result)
+                mode = "single file" if single_file else "file per type"
+                print(f"{file_count:>7} types, {mode:>13}: {result['files']:>6} files, {result['metas']:>6} metas,"
+                    + f" {result['rewritten_files']:>3} files ({result['rewritten_kb']:>7}kB) rewritten after a change,"
+                    + f" combine {result['combine_median_ms']:>8}ms, sync {result['sync_median_ms']:>8}ms",
+                    file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    parameters = { key: value for key, value in vars(args).items() if key != "output" }
+    return { "parameters": parameters, "python": sys.version.split()[0], "results": results }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-sizes", type=int, nargs="+", default=[200, 2000], help="The numbers of generated files to benchmark")
+    parser.add_argument("-assemblies", type=int, default=8, help="The number of assemblies the files are spread over")
+    parser.add_argument("-runs", type=int, default=5)
+    parser.add_argument("-output", type=str, default=None, help="The json file to write the results to")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+    else:
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Benchmarks the precommit hook on synthetic Unity repositories.
+
+For each size, a throwaway git repository is created with that many assets (and their .meta files)
+spread over nested folders under Game/Assets and committed. Then a change set is staged:
+new assets, renames, deletions and optionally large blobs, and `git_hooks.precommit` is timed on it,
+both cold (no meta pairing cache) and warm (the cache left by the previous run).
+
+    python benchmarks/precommit_benchmark.py -sizes 1000 10000 -output results.json
+    python benchmarks/precommit_benchmark.py -sizes 1000 10000 -compare results.json
+
+The repositories are generated from a seed, so the results of two versions of baton are comparable.
+"""
+
+import argparse, contextlib, io, json, os, random, shutil, statistics, subprocess, sys, tempfile, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import baton.git_hooks as git_hooks
+
+GIT_ENVIRONMENT = {
+    "GIT_AUTHOR_NAME": "baton", "GIT_AUTHOR_EMAIL": "baton@localhost",
+    "GIT_COMMITTER_NAME": "baton", "GIT_COMMITTER_EMAIL": "baton@localhost",
+}
+EXTENSIONS = [".cs", ".prefab", ".mat", ".asset", ".shader", ".txt"]
+
+
+def git(repository : str, *arguments : str):
+    environment = dict(os.environ)
+    environment.update(GIT_ENVIRONMENT)
+    subprocess.run(["git"] + list(arguments), cwd=repository, env=environment, check=True,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def write_file(path : str, contents : bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(contents)
+
+
+def write_meta(path : str, rng : random.Random):
+    guid = "%032x" % rng.getrandbits(128)
+    write_file(path + ".meta", f"fileFormatVersion: 2\nguid: {guid}\n".encode("ascii"))
+
+
+class SyntheticRepository:
+    """Lays out the assets in folders of `files_per_folder` files and `folders_per_folder` subfolders"""
+
+    def __init__(self, directory : str, rng : random.Random, files_per_folder : int, folders_per_folder : int):
+        self.directory = directory
+        self.rng = rng
+        self.files_per_folder = files_per_folder
+        self.folders_per_folder = folders_per_folder
+        self.assets : 'list[str]' = []    # relative to the repository, without the .meta
+        self.folders : 'list[str]' = ["Game/Assets"]
+        self._next_folder = 0
+        self._files_in_current_folder = 0
+        self._counter = 0
+
+    def _current_folder(self) -> str:
+        if self._files_in_current_folder >= self.files_per_folder:
+            parent = self.folders[self._next_folder // self.folders_per_folder]
+            folder = f"{parent}/Folder{len(self.folders)}"
+            self.folders.append(folder)
+            write_meta(os.path.join(self.directory, folder), self.rng)
+            self._next_folder += 1
+            self._files_in_current_folder = 0
+        self._files_in_current_folder += 1
+        return self.folders[-1]
+
+    def add_asset(self) -> str:
+        self._counter += 1
+        extension = self.rng.choice(EXTENSIONS)
+        path = f"{self._current_folder()}/Asset{self._counter}{extension}"
+        full_path = os.path.join(self.directory, path)
+        write_file(full_path, f"asset {self._counter} {self.rng.getrandbits(64)}\n".encode("ascii") * 8)
+        write_meta(full_path, self.rng)
+        self.assets.append(path)
+        return path
+
+    def rename_asset(self, path : str):
+        new_path = path[:path.rindex("/")] + "/Renamed" + path[path.rindex("/") + 1:]
+        for suffix in ("", ".meta"):
+            os.rename(os.path.join(self.directory, path + suffix), os.path.join(self.directory, new_path + suffix))
+
+    def delete_asset(self, path : str):
+        for suffix in ("", ".meta"):
+            os.remove(os.path.join(self.directory, path + suffix))
+
+    def add_large_blob(self, index : int, size : int):
+        path = os.path.join(self.directory, "Game", "Assets", f"Large{index}.bytes")
+        write_file(path, self.rng.randbytes(size))
+        write_meta(path, self.rng)
+
+
+def build_repository(directory : str, args, asset_count : int) -> SyntheticRepository:
+    rng = random.Random(args.seed)
+    repository = SyntheticRepository(directory, rng, args.files_per_folder, args.folders_per_folder)
+
+    git(directory, "init", "-q")
+    for _ in range(asset_count):
+        repository.add_asset()
+    git(directory, "add", "-A")
+    git(directory, "commit", "-q", "-m", "Initial")
+
+    # The change set
+    existing = list(repository.assets)
+    rng.shuffle(existing)
+    for path in existing[:args.renames]:
+        repository.rename_asset(path)
+    for path in existing[args.renames:args.renames + args.deletions]:
+        repository.delete_asset(path)
+    for _ in range(args.additions):
+        repository.add_asset()
+    for index in range(args.large_blobs):
+        repository.add_large_blob(index, args.large_blob_size)
+    git(directory, "add", "-A")
+
+    return repository
+
+
+def time_precommit(directory : str, clear_cache : bool) -> 'tuple[float, int]':
+    if clear_cache:
+        shutil.rmtree(git_hooks.get_baton_git_directory(directory), ignore_errors=True)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        exit_code = git_hooks.precommit(directory)
+        elapsed = time.perf_counter() - start
+    return elapsed * 1000, exit_code
+
+
+def run(args) -> dict:
+    results = []
+    for asset_count in args.sizes:
+        directory = tempfile.mkdtemp(prefix="baton-benchmark-")
+        try:
+            build_start = time.perf_counter()
+            build_repository(directory, args, asset_count)
+            build_seconds = time.perf_counter() - build_start
+
+            cold = [time_precommit(directory, clear_cache=True) for _ in range(args.runs)]
+            warm = [time_precommit(directory, clear_cache=False) for _ in range(args.runs)]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        result = {
+            "assets": asset_count,
+            "exit_code": cold[0][1],
+            "cold_median_ms": round(statistics.median(t for t, _ in cold), 2),
+            "warm_median_ms": round(statistics.median(t for t, _ in warm), 2),
+            "cold_ms": [round(t, 2) for t, _ in cold],
+            "warm_ms": [round(t, 2) for t, _ in warm],
+            "build_seconds": round(build_seconds, 2),
+        }
+        results.append(result)
+        print(f"{asset_count:>8} assets: cold {result['cold_median_ms']:>9}ms, warm {result['warm_median_ms']:>9}ms, exit code {result['exit_code']}",
+            file=sys.stderr)
+
+    parameters = { key: value for key, value in vars(args).items() if key not in ("output", "compare") }
+    return { "parameters": parameters, "python": sys.version.split()[0], "results": results }
+
+
+def compare(current : dict, baseline : dict):
+    baseline_by_size = { result["assets"]: result for result in baseline["results"] }
+    def change_set(parameters : dict) -> dict:
+        return { key: value for key, value in parameters.items() if key != "sizes" }
+    if change_set(current["parameters"]) != change_set(baseline["parameters"]):
+        print("Warning: the parameters differ from the baseline")
+    print(f"{'assets':>8} {'cold ms':>10} {'baseline':>10} {'ratio':>7} {'warm ms':>10} {'baseline':>10} {'ratio':>7}")
+    for result in current["results"]:
+        other = baseline_by_size.get(result["assets"])
+        if other is None:
+            continue
+        cold_ratio = result["cold_median_ms"] / max(other["cold_median_ms"], 1e-9)
+        warm_ratio = result["warm_median_ms"] / max(other["warm_median_ms"], 1e-9)
+        print(f"{result['assets']:>8} {result['cold_median_ms']:>10} {other['cold_median_ms']:>10} {cold_ratio:>7.2f}"
+            + f" {result['warm_median_ms']:>10} {other['warm_median_ms']:>10} {warm_ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-sizes", type=int, nargs="+", default=[1000, 10000], help="The numbers of assets to benchmark")
+    parser.add_argument("-files_per_folder", type=int, default=50)
+    parser.add_argument("-folders_per_folder", type=int, default=8)
+    parser.add_argument("-additions", type=int, default=200, help="The number of assets added in the change set")
+    parser.add_argument("-renames", type=int, default=100)
+    parser.add_argument("-deletions", type=int, default=100)
+    parser.add_argument("-large_blobs", type=int, default=0)
+    parser.add_argument("-large_blob_size", type=int, default=1024 * 1024)
+    parser.add_argument("-runs", type=int, default=5)
+    parser.add_argument("-seed", type=int, default=0)
+    parser.add_argument("-output", type=str, default=None, help="The json file to write the results to")
+    parser.add_argument("-compare", type=str, default=None, help="A json file with the results to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Runs the precommit hook on small scripted change sets and checks its exit codes.
+
+Each scenario commits a few assets to a throwaway git repository, stages a change set and runs `git_hooks.precommit` on it.
+The expected exit codes are the verdicts of the original check on the GitPython diff, except for the CHANGED_VERDICTS.
+With `-reference`, the `git_hooks.py` of that revision of baton is run side by side on the same repositories
+(it needs GitPython if it is an old one), so any two versions of the hook can be compared.
+
+    python benchmarks/precommit_scenarios.py
+    python benchmarks/precommit_scenarios.py -reference 17fa7bb
+"""
+
+import argparse, contextlib, io, os, shutil, subprocess, sys, tempfile, types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import baton.git_hooks as git_hooks
+
+GIT_ENVIRONMENT = {
+    "GIT_AUTHOR_NAME": "baton", "GIT_AUTHOR_EMAIL": "baton@localhost",
+    "GIT_COMMITTER_NAME": "baton", "GIT_COMMITTER_EMAIL": "baton@localhost",
+}
+ASSETS = "Game/Assets"
+
+
+def git(repository : str, *arguments : str) -> str:
+    environment = dict(os.environ)
+    environment.update(GIT_ENVIRONMENT)
+    result = subprocess.run(["git"] + list(arguments), cwd=repository, env=environment, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return result.stdout.decode('utf-8')
+
+
+class Repository:
+    def __init__(self, directory : str):
+        self.directory = directory
+        self._counter = 0
+
+    def write(self, path : str, contents : str = None):
+        self._counter += 1
+        full_path = os.path.join(self.directory, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, "w") as file:
+            file.write(contents if contents is not None else f"{path} {self._counter}\n")
+
+    def add_asset(self, path : str):
+        self.write(path)
+        self.write(path + ".meta", f"fileFormatVersion: 2\nguid: {self._counter:032x}\n")
+
+    def add_folder_meta(self, path : str):
+        self.write(path + ".meta", f"fileFormatVersion: 2\nguid: {self._counter + 1:032x}\nfolderAsset: yes\n")
+
+    def remove(self, path : str):
+        full_path = os.path.join(self.directory, path)
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+        else:
+            os.remove(full_path)
+
+    def move(self, path : str, new_path : str):
+        full_path = os.path.join(self.directory, new_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        os.rename(os.path.join(self.directory, path), full_path)
+
+
+def initial_assets(repository : Repository):
+    """The committed state every scenario starts from"""
+    repository.add_folder_meta(f"{ASSETS}/A")
+    repository.add_asset(f"{ASSETS}/A/Texture.png")
+    repository.add_folder_meta(f"{ASSETS}/B")
+    repository.add_asset(f"{ASSETS}/B/Script.cs")
+    repository.add_asset(f"{ASSETS}/B/Prefab.prefab")
+    repository.add_folder_meta(f"{ASSETS}/B/Nested")
+    repository.add_asset(f"{ASSETS}/B/Nested/Material.mat")
+    repository.add_asset(f"{ASSETS}/B/Nested/Shader.shader")
+    repository.write("README.md")
+
+
+# name -> (change set, exit code of the check on the GitPython diff)
+SCENARIOS = {
+    "add_both":                 (lambda r: r.add_asset(f"{ASSETS}/B/New.cs"), 0),
+    "add_file_only":            (lambda r: r.write(f"{ASSETS}/B/New.cs"), 1),
+    "add_meta_only":            (lambda r: r.write(f"{ASSETS}/B/New.cs.meta"), 1),
+    "add_ignored":              (lambda r: (r.write(f"{ASSETS}/B/.hidden"), r.write(f"{ASSETS}/B/Docs~/Notes.txt")), 0),
+    "add_outside_assets":       (lambda r: r.write("Tools/script.py"), 0),
+    "modify":                   (lambda r: r.write(f"{ASSETS}/B/Script.cs", "changed\n"), 0),
+    "delete_both":              (lambda r: (r.remove(f"{ASSETS}/A/Texture.png"), r.remove(f"{ASSETS}/A/Texture.png.meta")), 0),
+    "delete_file_only":         (lambda r: r.remove(f"{ASSETS}/B/Script.cs"), 1),
+    "delete_meta_only":         (lambda r: r.remove(f"{ASSETS}/B/Script.cs.meta"), 1),
+    "delete_folder_keep_meta":  (lambda r: r.remove(f"{ASSETS}/B/Nested"), 0),
+    "delete_folder_and_meta":   (lambda r: (r.remove(f"{ASSETS}/B/Nested"), r.remove(f"{ASSETS}/B/Nested.meta")), 1),
+    "delete_folder_meta_only":  (lambda r: r.remove(f"{ASSETS}/B/Nested.meta"), 1),
+    "new_folder_no_meta":       (lambda r: r.add_asset(f"{ASSETS}/C/Texture.png"), 0),
+    "new_folder_with_meta":     (lambda r: (r.add_folder_meta(f"{ASSETS}/C"), r.add_asset(f"{ASSETS}/C/Texture.png")), 0),
+    "new_empty_folder_meta":    (lambda r: r.add_folder_meta(f"{ASSETS}/C"), 1),
+    "new_nested_folders":       (lambda r: (r.add_folder_meta(f"{ASSETS}/C"), r.add_asset(f"{ASSETS}/C/D/Texture.png")), 1),
+    "rename_both":              (lambda r: (r.move(f"{ASSETS}/B/Script.cs", f"{ASSETS}/B/Renamed.cs"),
+                                    r.move(f"{ASSETS}/B/Script.cs.meta", f"{ASSETS}/B/Renamed.cs.meta")), 0),
+    "rename_file_only":         (lambda r: r.move(f"{ASSETS}/B/Script.cs", f"{ASSETS}/B/Renamed.cs"), 1),
+    "move_to_other_folder":     (lambda r: (r.move(f"{ASSETS}/B/Script.cs", f"{ASSETS}/A/Script.cs"),
+                                    r.move(f"{ASSETS}/B/Script.cs.meta", f"{ASSETS}/A/Script.cs.meta")), 0),
+    "move_folder_with_meta":    (lambda r: (r.move(f"{ASSETS}/B/Nested", f"{ASSETS}/A/Nested"),
+                                    r.move(f"{ASSETS}/B/Nested.meta", f"{ASSETS}/A/Nested.meta")), 1),
+    "move_folder_keep_meta":    (lambda r: r.move(f"{ASSETS}/B/Nested", f"{ASSETS}/A/Nested"), 0),
+    "move_out_of_assets":       (lambda r: r.move(f"{ASSETS}/B/Script.cs", "Tools/Script.cs"), 1),
+    "move_into_ignored_folder": (lambda r: r.move(f"{ASSETS}/B/Script.cs", f"{ASSETS}/B/Docs~/Script.cs"), 1),
+    "move_into_assets":         (lambda r: (r.move("README.md", f"{ASSETS}/B/README.md"), r.write(f"{ASSETS}/B/README.md.meta")), 0),
+}
+
+# The check on the diff decided whether a rename counts by its new path alone, these scenarios are decided differently now
+CHANGED_VERDICTS = { "move_out_of_assets", "move_into_ignored_folder", "move_into_assets" }
+
+
+def load_reference(revision : str):
+    """Loads the hook of another revision of baton as a module"""
+    source = git(os.path.dirname(os.path.abspath(__file__)), "show", f"{revision}:./../baton/git_hooks.py")
+    module = types.ModuleType(f"git_hooks_{revision}")
+    exec(compile(source, f"{revision}:baton/git_hooks.py", "exec"), module.__dict__)
+    return module
+
+
+def run_precommit(hooks, directory : str) -> 'tuple[int, str]':
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        exit_code = hooks.precommit(directory)
+    return exit_code, output.getvalue()
+
+
+def run_scenario(change_set, hooks_by_name : dict) -> 'dict[str, tuple[int, str]]':
+    results = {}
+    for name, hooks in hooks_by_name.items():
+        directory = tempfile.mkdtemp(prefix="baton-scenario-")
+        try:
+            repository = Repository(directory)
+            git(directory, "init", "-q")
+            initial_assets(repository)
+            git(directory, "add", "-A")
+            git(directory, "commit", "-q", "-m", "Initial")
+            change_set(repository)
+            git(directory, "add", "-A")
+            results[name] = run_precommit(hooks, directory)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-reference", type=str, default=None, help="The revision of baton to run side by side")
+    parser.add_argument("-verbose", action="store_true", help="Print the output of the hook")
+    parser.add_argument("scenarios", nargs="*", help="The scenarios to run, all of them by default")
+    args = parser.parse_args()
+
+    hooks_by_name = { "current": git_hooks }
+    if args.reference:
+        hooks_by_name[args.reference] = load_reference(args.reference)
+
+    failures = 0
+    for name in args.scenarios or SCENARIOS:
+        change_set, expected = SCENARIOS[name]
+        results = run_scenario(change_set, hooks_by_name)
+        ok = results["current"][0] == expected
+        if name not in CHANGED_VERDICTS:
+            ok = ok and all(exit_code == expected for exit_code, _ in results.values())
+        if not ok:
+            failures += 1
+        codes = ", ".join(f"{hooks_name} {exit_code}" for hooks_name, (exit_code, _) in results.items())
+        changed = " (changed)" if name in CHANGED_VERDICTS else ""
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<26} expected {expected}{changed}, {codes}")
+        if args.verbose or not ok:
+            for hooks_name, (_, output) in results.items():
+                for line in output.splitlines():
+                    print(f"         {hooks_name}: {line}")
+
+    print(f"{failures} of {len(args.scenarios or SCENARIOS)} scenarios failed")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
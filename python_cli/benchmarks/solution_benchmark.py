@@ -0,0 +1,150 @@
+"""
+Benchmarks reading and writing .sln files on synthetic solutions.
+
+For each size, a solution with that many projects is generated, each project depending on a few of the previous ones,
+with the usual configuration lines for every project. Then `Solution.read` and `Solution.write_to` are timed on it,
+and the memory taken by the solution read is measured, before and after decoding its global sections.
+
+    python benchmarks/solution_benchmark.py -sizes 1000 5000 -output results.json
+    python benchmarks/solution_benchmark.py -sizes 1000 5000 -compare results.json
+"""
+
+import argparse, io, json, os, random, shutil, statistics, sys, tempfile, time, tracemalloc, uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from baton.solution import Solution
+
+CSHARP_PROJECT_GUID = "{FAE04EC0-301F-11D3-BF4B-00C04F79EFBC}"
+CONFIGURATIONS = ["Debug|Any CPU", "Release|Any CPU"]
+
+
+def write_solution(path : str, project_count : int, dependencies_per_project : int, rng : random.Random):
+    guids = ["{" + str(uuid.UUID(int=rng.getrandbits(128))).upper() + "}" for _ in range(project_count)]
+
+    lines = [
+        "",
+        "Microsoft Visual Studio Solution File, Format Version 12.00",
+        "# Visual Studio Version 16",
+        "VisualStudioVersion = 16.0.30114.105",
+        "MinimumVisualStudioVersion = 10.0.40219.1",
+    ]
+    for index, guid in enumerate(guids):
+        lines.append(f'Project("{CSHARP_PROJECT_GUID}") = "Project{index}", "Project{index}\\Project{index}.csproj", "{guid}"')
+        dependencies = rng.sample(guids[:index], min(index, dependencies_per_project))
+        if dependencies:
+            lines.append("\tProjectSection(ProjectDependencies) = postProject")
+            lines += [f"\t\t{dependency} = {dependency}" for dependency in dependencies]
+            lines.append("\tEndProjectSection")
+        lines.append("EndProject")
+
+    lines.append("Global")
+    lines.append("\tGlobalSection(SolutionConfigurationPlatforms) = preSolution")
+    lines += [f"\t\t{configuration} = {configuration}" for configuration in CONFIGURATIONS]
+    lines.append("\tEndGlobalSection")
+    lines.append("\tGlobalSection(ProjectConfigurationPlatforms) = postSolution")
+    for guid in guids:
+        for configuration in CONFIGURATIONS:
+            lines.append(f"\t\t{guid}.{configuration}.ActiveCfg = {configuration}")
+            lines.append(f"\t\t{guid}.{configuration}.Build.0 = {configuration}")
+    lines.append("\tEndGlobalSection")
+    lines.append("EndGlobal")
+
+    with open(path, "w", encoding="utf-8-sig", newline="\r\n") as file:
+        file.write("\n".join(lines) + "\n")
+
+
+def time_milliseconds(function) -> float:
+    start = time.perf_counter()
+    function()
+    return (time.perf_counter() - start) * 1000
+
+
+def measure_memory(path : str) -> 'tuple[int, int]':
+    """The bytes allocated by reading the solution, then by also decoding all of its global sections"""
+    tracemalloc.start()
+    try:
+        solution = Solution.read(path)
+        read_bytes = tracemalloc.get_traced_memory()[0]
+        for section in solution.global_sections.values():
+            section.lines
+        decoded_bytes = tracemalloc.get_traced_memory()[0]
+        solution.close()
+    finally:
+        tracemalloc.stop()
+    return read_bytes, decoded_bytes
+
+
+def run(args) -> dict:
+    results = []
+    directory = tempfile.mkdtemp(prefix="baton-solution-benchmark-")
+    try:
+        for project_count in args.sizes:
+            path = os.path.join(directory, f"Synthetic{project_count}.sln")
+            write_solution(path, project_count, args.dependencies, random.Random(args.seed))
+
+            read = [time_milliseconds(lambda: Solution.read(path)) for _ in range(args.runs)]
+            solution = Solution.read(path)
+            write = [time_milliseconds(lambda: solution.write_to(io.StringIO())) for _ in range(args.runs)]
+            solution.close()
+            read_bytes, decoded_bytes = measure_memory(path)
+
+            result = {
+                "projects": project_count,
+                "file_bytes": os.path.getsize(path),
+                "read_median_ms": round(statistics.median(read), 2),
+                "write_median_ms": round(statistics.median(write), 2),
+                "read_kb": read_bytes // 1024,
+                "decoded_kb": decoded_bytes // 1024,
+                "read_ms": [round(t, 2) for t in read],
+                "write_ms": [round(t, 2) for t in write],
+            }
+            results.append(result)
+            print(f"{project_count:>8} projects: read {result['read_median_ms']:>9}ms, write {result['write_median_ms']:>9}ms,"
+                + f" memory {result['read_kb']:>7}kB, {result['decoded_kb']:>7}kB decoded",
+                file=sys.stderr)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    parameters = { key: value for key, value in vars(args).items() if key not in ("output", "compare") }
+    return { "parameters": parameters, "python": sys.version.split()[0], "results": results }
+
+
+def compare(current : dict, baseline : dict):
+    baseline_by_size = { result["projects"]: result for result in baseline["results"] }
+    print(f"{'projects':>8} {'read ms':>10} {'baseline':>10} {'ratio':>7} {'write ms':>10} {'baseline':>10} {'ratio':>7}")
+    for result in current["results"]:
+        other = baseline_by_size.get(result["projects"])
+        if other is None:
+            continue
+        read_ratio = result["read_median_ms"] / max(other["read_median_ms"], 1e-9)
+        write_ratio = result["write_median_ms"] / max(other["write_median_ms"], 1e-9)
+        print(f"{result['projects']:>8} {result['read_median_ms']:>10} {other['read_median_ms']:>10} {read_ratio:>7.2f}"
+            + f" {result['write_median_ms']:>10} {other['write_median_ms']:>10} {write_ratio:>7.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-sizes", type=int, nargs="+", default=[1000, 5000], help="The numbers of projects to benchmark")
+    parser.add_argument("-dependencies", type=int, default=3, help="The number of dependencies of every project")
+    parser.add_argument("-runs", type=int, default=5)
+    parser.add_argument("-seed", type=int, default=0)
+    parser.add_argument("-output", type=str, default=None, help="The json file to write the results to")
+    parser.add_argument("-compare", type=str, default=None, help="A json file with the results to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+            file.write("\n")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            compare(results, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
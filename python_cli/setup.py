@@ -6,13 +6,14 @@ setup(
     packages=['baton'],
     install_requires=[
         'click>=8.0',
-        'pywin32>=300',
+        'pywin32>=300; platform_system=="Windows"',
         'GitPython>=3.1',
         'colorama>=0.4.4'
     ],
     entry_points={
         'console_scripts': [
-            'baton = baton.baton:cli'
+            'baton = baton.baton:cli',
+            'baton-client = baton.client:main'
         ],
     },
 )
\ No newline at end of file